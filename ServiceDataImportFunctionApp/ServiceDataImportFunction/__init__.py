@@ -1,10 +1,12 @@
+import json
 import logging
 import os
+from typing import List
 import azure.functions as func
 
 from .service_data_import.ptv_importer import *
 
-def main(TestTrigger: func.TimerRequest) -> None:
+def main(TestTrigger: func.TimerRequest, shardWorkers: func.Out[List[str]]) -> None:
     utc_timestamp = datetime.utcnow().replace(
         tzinfo=timezone.utc).isoformat()
 
@@ -13,7 +15,13 @@ def main(TestTrigger: func.TimerRequest) -> None:
 
     logging.info("Running service data importer {}".format(utc_timestamp))
     service_data_importer = PTVImporter()
-    service_data_importer.import_services()
+    if service_data_importer.sharded:
+        # The run is done by ServiceDataShardWorkerFunction, one worker per message
+        run = service_data_importer.start_sharded_run()
+        shardWorkers.set([json.dumps({'run': run['_id']}) for worker in range(service_data_importer.shard_workers)])
+        logging.info("Woke up {} shard workers for run {}".format(service_data_importer.shard_workers, run['_id']))
+    else:
+        service_data_importer.import_services()
     utc_timestamp2 = datetime.utcnow().replace(
         tzinfo=timezone.utc).isoformat()
     logging.info("Finished running service data importer {}".format(utc_timestamp2))
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+import random
+import threading
+import time
+import urllib.parse
+from typing import Any, Callable, Optional
+import requests
+
+# Responses that mean PTV is overloaded or failing and the request can be retried
+retry_statuses = [429, 500, 502, 503, 504]
+# Guid lists longer than the server accepts
+too_long_status = 414
+
+
+class UrlTooLongError(Exception):
+    """
+    Raised when PTV rejects an url as too long, its batch can be split and sent again
+    """
+
+    def __init__(self, url: str) -> None:
+        super().__init__("PTV rejected an url of {} characters".format(len(url)))
+        self.url = url
+
+
+class AdaptiveController():
+    """
+    Sizes concurrent PTV requests and guid batches from how PTV responds
+
+    In-flight requests grow additively while responses are fast and
+    successful and are halved on slow responses, throttling and server
+    errors. Batch size only shrinks when PTV rejects an url as too long and
+    doubles back on fast successful responses, since smaller batches would
+    only mean more requests to an overloaded PTV. Batches are also capped so
+    that their urls stay under max_url_length. An endpoint that keeps
+    failing is not called again until its cooldown has passed.
+
+    Args
+    ----------
+    max_in_flight : int ( default 8 )
+        Upper limit of concurrent requests
+
+    max_batch_size : int ( default 100 )
+        Upper limit of guids in one list request
+
+    min_batch_size : int ( default 10 )
+        Lower limit of guids in one list request
+
+    target_latency : float ( default 5.0 )
+        Seconds above which a response counts as congestion
+
+    max_url_length : int ( default 8000 )
+        Longest url a batch may have
+
+    max_retries : int ( default 4 )
+        Retries of a failed request before giving up
+
+    failure_threshold : int ( default 5 )
+        Consecutive failures of an endpoint after which it is paused
+
+    cooldown : float ( default 60.0 )
+        Seconds an endpoint is paused
+
+
+    Methods
+    -------
+    acquire()
+        Wait for a free request slot
+
+    release()
+        Free a request slot
+
+    on_success( endpoint: str, latency: float )
+        Record a successful request
+
+    on_failure( endpoint: str )
+        Record a throttled or failed request
+
+    on_url_too_long( url_length: int )
+        Halve the batch size and the url length cap below a rejected url
+
+    backoff( attempt: int, retry_after: float )
+        Jittered exponential delay before a retry
+
+    wait_for_endpoint( endpoint: str )
+        Sleep while the endpoint is paused
+
+    batch_count( base_url: str, guids: list )
+        Number of guids from the start of guids that go into the next batch
+
+    report()
+        Print current limits and counts of retries and pauses
+
+    """
+
+    def __init__(self, max_in_flight: int = 8, max_batch_size: int = 100, min_batch_size: int = 10, target_latency: float = 5.0, max_url_length: int = 8000,
+                 max_retries: int = 4, failure_threshold: int = 5, cooldown: float = 60.0, backoff_base: float = 0.5, backoff_cap: float = 30.0,
+                 sleep: Callable[[float], None] = time.sleep, rng: Optional[random.Random] = None) -> None:
+        self.max_in_flight = max_in_flight
+        self.max_batch_size = max_batch_size
+        self.min_batch_size = min(min_batch_size, max_batch_size)
+        self.target_latency = target_latency
+        self.max_url_length = max_url_length
+        self.max_retries = max_retries
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.sleep = sleep
+        self.rng = rng if rng is not None else random.Random()
+        # Start halfway and let successes raise the limits
+        self.in_flight = max(1.0, max_in_flight / 2)
+        self.batch_size = max_batch_size
+        self.active = 0
+        self.failures = {}
+        self.paused_until = {}
+        self.counts = {'requests': 0, 'retries': 0, 'pauses': 0}
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._condition:
+            while self.active >= int(self.in_flight):
+                self._condition.wait()
+            self.active = self.active + 1
+            self.counts['requests'] = self.counts['requests'] + 1
+
+    def release(self) -> None:
+        with self._condition:
+            self.active = self.active - 1
+            self._condition.notify_all()
+
+    def _decrease(self) -> None:
+        self.in_flight = max(1.0, self.in_flight / 2)
+
+    def on_success(self, endpoint: str, latency: float) -> None:
+        with self._condition:
+            self.failures[endpoint] = 0
+            if latency > self.target_latency:
+                self._decrease()
+            else:
+                # One more slot per window of successful requests
+                self.in_flight = min(float(self.max_in_flight), self.in_flight + 1 / self.in_flight)
+                self.batch_size = min(self.max_batch_size, self.batch_size * 2)
+            self._condition.notify_all()
+
+    def on_failure(self, endpoint: str) -> None:
+        with self._condition:
+            self._decrease()
+            self.failures[endpoint] = self.failures.get(endpoint, 0) + 1
+            if self.failures[endpoint] >= self.failure_threshold:
+                self.paused_until[endpoint] = time.monotonic() + self.cooldown
+                self.failures[endpoint] = 0
+                self.counts['pauses'] = self.counts['pauses'] + 1
+                print("Pausing calls to", endpoint, "for", self.cooldown, "seconds.")
+
+    def on_url_too_long(self, url_length: int) -> None:
+        with self._condition:
+            # Halving finds the server limit in a few rejections, a batch split under it needs no more retries
+            self.max_url_length = min(self.max_url_length, url_length // 2)
+            self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        with self._condition:
+            self.counts['retries'] = self.counts['retries'] + 1
+            delay = self.rng.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return(delay)
+
+    def wait_for_endpoint(self, endpoint: str) -> None:
+        with self._condition:
+            paused_until = self.paused_until.get(endpoint, 0)
+        remaining = paused_until - time.monotonic()
+        if remaining > 0:
+            self.sleep(remaining)
+
+    def batch_count(self, base_url: str, guids: list) -> int:
+        count = 0
+        length = len(base_url)
+        for guid in guids[:self.batch_size]:
+            # Separators are encoded as %2C
+            length = length + len(urllib.parse.quote_plus(guid)) + (3 if count > 0 else 0)
+            if count > 0 and length > self.max_url_length:
+                break
+            count = count + 1
+        return(count)
+
+    def report(self) -> None:
+        print("Adaptive controller: {} requests, {} retries, {} pauses, {:.1f} in flight, batches of {}.".format(
+            self.counts['requests'], self.counts['retries'], self.counts['pauses'], self.in_flight, self.batch_size))
+
+
+class AdaptiveSession():
+    """
+    A wrapper around a requests session that sends requests under an AdaptiveController
+
+    Throttled, failed and timed out requests are retried with jittered
+    backoff, after which an exception is raised.
+
+    Args
+    ----------
+    session : requests.Session
+        Session that sends the requests
+
+    controller : AdaptiveController
+        Controller of concurrency, retries and paused endpoints
+
+
+    Methods
+    -------
+    get( url: str )
+        Send a GET request and return its successful response
+
+    """
+
+    def __init__(self, session: Any, controller: AdaptiveController) -> None:
+        self.session = session
+        self.controller = controller
+
+    def __getattr__(self, name: str) -> Any:
+        # Headers, auth and the rest are those of the wrapped session
+        if name == 'session':
+            raise AttributeError(name)
+        return(getattr(self.session, name))
+
+    def _retry_after(self, response: Any) -> Optional[float]:
+        try:
+            return(float(response.headers.get('Retry-After')))
+        except (TypeError, ValueError, AttributeError):
+            return(None)
+
+    def get(self, url: str, **kwargs) -> Any:
+        endpoint = urllib.parse.urlparse(url).path
+        for attempt in range(self.controller.max_retries + 1):
+            self.controller.wait_for_endpoint(endpoint)
+            self.controller.acquire()
+            start = time.perf_counter()
+            response = None
+            error = None
+            try:
+                response = self.session.get(url=url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as request_error:
+                error = request_error
+            finally:
+                self.controller.release()
+            status = getattr(response, 'status_code', None)
+            if response is not None and status == too_long_status:
+                self.controller.on_url_too_long(len(url))
+                raise UrlTooLongError(url)
+            if error is None and status not in retry_statuses:
+                self.controller.on_success(endpoint, time.perf_counter() - start)
+                return(response)
+            self.controller.on_failure(endpoint)
+            if attempt == self.controller.max_retries:
+                if error is not None:
+                    raise error
+                raise Exception("PTV request failed with status {}: {}".format(status, url))
+            retry_after = self._retry_after(response) if response is not None else None
+            self.controller.sleep(self.controller.backoff(attempt, retry_after))
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Coroutine, Iterable, Optional
+from .metrics import run_in_context
+from .paging import PagedIdIterator, merge_listings
+
+
+class AsyncPTVFetcher():
+    """
+    An asyncio engine that sends PTV API requests concurrently
+
+    Blocking session calls are run in a thread pool so the same requests
+    session (and its mocks in tests) can be used as with the synchronous path.
+
+    Args
+    ----------
+    api_session : requests.Session
+        A requests session to send requests to PTV API
+
+    max_in_flight : int ( default 8 )
+        Maximum number of requests sent to PTV API at the same time
+
+
+    Methods
+    -------
+    run( coroutine: Coroutine )
+        Run a coroutine of this fetcher to completion and return its result
+
+    get_json( url: str )
+        Fetch one url and return decoded JSON
+
+    get_many( urls: list )
+        Fetch urls concurrently and return decoded JSON documents in the same order
+
+    get_paged_ids( url_template: str )
+        Fetch all pages of a PTV listing endpoint and return unique item ids
+
+    get_paged_listing( url_template: str )
+        Same as get_paged_ids but also return the number of listed items
+
+    get_paged_listings( url_templates: list )
+        Same as get_paged_listing over several listing endpoints concurrently, ids are deduplicated over all of them
+
+    get_batched( batch_urls: Iterable, get_batch: Callable )
+        Fetch ( end index, url ) batches concurrently as they are taken from batch_urls and return a flat list of documents
+
+    """
+
+    def __init__(self, api_session: Any, max_in_flight: int = 8) -> None:
+        if max_in_flight < 1:
+            raise Exception("max_in_flight must be at least 1")
+        self.api_session = api_session
+        self.max_in_flight = max_in_flight
+        self._semaphore = None
+        self._executor = None
+
+    def run(self, coroutine: Coroutine) -> Any:
+        return(asyncio.run(self._run(coroutine)))
+
+    async def _run(self, coroutine: Coroutine) -> Any:
+        # Semaphore must be created inside the running loop
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            self._executor = executor
+            try:
+                return(await coroutine)
+            finally:
+                self._executor = None
+                self._semaphore = None
+
+    def _blocking_get_json(self, url: str) -> Any:
+        response = self.api_session.get(url=url)
+        return(response.json())
+
+    async def get_json(self, url: str) -> Any:
+        loop = asyncio.get_running_loop()
+        async with self._semaphore:
+            return(await loop.run_in_executor(self._executor, run_in_context(self._blocking_get_json), url))
+
+    async def get_many(self, urls: list) -> list:
+        return(list(await asyncio.gather(*[self.get_json(url) for url in urls])))
+
+    async def get_paged_listing(self, url_template: str) -> tuple:
+        # Pages are fetched concurrently and handed to the shared iterator in page order
+        listing = PagedIdIterator(self._blocking_get_json, url_template)
+        first_page = await self.get_json(listing.first_url())
+        guids = listing.add_page(first_page)
+        for page in await self.get_many(listing.page_urls(first_page)):
+            guids.extend(listing.add_page(page))
+        return(guids, listing.item_count)
+
+    async def get_paged_listings(self, url_templates: list) -> tuple:
+        listings = await asyncio.gather(*[self.get_paged_listing(url_template) for url_template in url_templates])
+        return(merge_listings(listings))
+
+    async def get_paged_ids(self, url_template: str) -> list:
+        guids, item_count = await self.get_paged_listing(url_template)
+        return(guids)
+
+    async def get_batched(self, batch_urls: Iterable, get_batch: Optional[Callable[[str], list]] = None) -> list:
+        # Workers take the next url only when they are free, so lazily built batches follow the controller
+        get_batch = get_batch if get_batch is not None else self._blocking_get_json
+        loop = asyncio.get_running_loop()
+        batch_iterator = enumerate(batch_urls)
+        batches = {}
+
+        async def fetch_batches():
+            for batch_number, (end_index, url) in batch_iterator:
+                async with self._semaphore:
+                    batches[batch_number] = await loop.run_in_executor(self._executor, run_in_context(get_batch), url)
+        await asyncio.gather(*[fetch_batches() for _ in range(self.max_in_flight)])
+        documents = []
+        for batch_number in range(len(batches)):
+            documents.extend(batches[batch_number])
+        return(documents)
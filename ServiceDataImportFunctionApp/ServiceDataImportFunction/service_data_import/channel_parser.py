@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Declarative parser for PTV service channel documents
+
+The shape of a parsed channel is described by channel_spec. The spec is
+compiled once into a transformer that walks every list of the raw channel
+a single time, grouping values by language as it goes.
+
+Spec entries
+------------
+copy : {'field', 'source'}
+    Value of a top level key
+ids : {'field', 'source', 'path'}
+    Value at path for every item of a list
+joined : {'field', 'sources'}
+    Not None values of each language joined with ' - ', None if there are none
+values : {'field', 'sources', 'attribute'}
+    One attribute of every item of each language
+records : {'field', 'sources', 'attributes', 'skip_none'}
+    A dict of attributes ( output key, item key ) for every item of each language,
+    optionally leaving out items whose skip_none attribute is None
+elements : {'field', 'source', 'element', 'unwrap'}
+    Every item in every language. Element fields are ( key, kind, path ) where kind
+    is 'value', 'outer' ( read before unwrapping ) or 'joined'. unwrap is
+    ( path, value, inner_path ) and replaces the item with the one at inner_path
+    when the value at path equals value
+"""
+from typing import Any, Callable
+from .service_parser import languages, values_by_language, join_or_none
+
+address_element = [('type', 'value', ('type',)),
+                   ('subtype', 'value', ('subType',)),
+                   ('streetNumber', 'value', ('streetAddress', 'streetNumber')),
+                   ('postalCode', 'value', ('streetAddress', 'postalCode')),
+                   ('latitude', 'value', ('streetAddress', 'latitude')),
+                   ('longitude', 'value', ('streetAddress', 'longitude')),
+                   ('streetName', 'joined', ('streetAddress', 'street')),
+                   ('postOffice', 'joined', ('streetAddress', 'postOffice')),
+                   ('municipalityCode', 'value', ('streetAddress', 'municipality', 'code')),
+                   ('municipalityName', 'joined', ('streetAddress', 'municipality', 'name'))]
+
+area_element = [('name', 'joined', ('name',)),
+                ('type', 'outer', ('type',)),
+                ('code', 'value', ('code',))]
+
+channel_spec = [{'field': 'id', 'kind': 'copy', 'source': 'id'},
+                {'field': 'type', 'kind': 'copy', 'source': 'serviceChannelType'},
+                {'field': 'areaType', 'kind': 'copy', 'source': 'areaType'},
+                {'field': 'organizationId', 'kind': 'copy', 'source': 'organizationId'},
+                {'field': 'serviceIds', 'kind': 'ids', 'source': 'services', 'path': ('service', 'id')},
+                {'field': 'name', 'kind': 'joined', 'sources': ['serviceChannelNames']},
+                {'field': 'descriptions', 'kind': 'records', 'sources': ['serviceChannelDescriptions'],
+                 'attributes': [('value', 'value'), ('type', 'type')], 'skip_none': 'value'},
+                {'field': 'webPages', 'kind': 'values', 'sources': ['webPages'], 'attribute': 'url'},
+                {'field': 'emails', 'kind': 'values', 'sources': ['supportEmails', 'emails'], 'attribute': 'value'},
+                {'field': 'phoneNumbers', 'kind': 'records', 'sources': ['supportPhones', 'phoneNumbers'],
+                 'attributes': [('number', 'number'), ('prefixNumber', 'prefixNumber'),
+                                ('chargeDescription', 'chargeDescription'), ('serviceChargeType', 'serviceChargeType')]},
+                {'field': 'addresses', 'kind': 'elements', 'source': 'addresses', 'element': address_element},
+                {'field': 'areas', 'kind': 'elements', 'source': 'areas', 'element': area_element,
+                 'unwrap': (('type',), 'Municipality', ('municipalities', 0))},
+                {'field': 'channelUrls', 'kind': 'records', 'sources': ['channelUrls'],
+                 'attributes': [('url', 'value'), ('type', 'type')]}]
+
+
+def _get_path(item: Any, path: tuple) -> Any:
+    for key in path:
+        if item is None:
+            return(None)
+        if isinstance(key, int):
+            item = item[key]
+        else:
+            item = item.get(key)
+    return(item)
+
+
+def _compile_copy(entry: dict) -> Callable:
+    source = entry['source']
+
+    def step(channel):
+        return(channel.get(source))
+    return(step)
+
+
+def _compile_ids(entry: dict) -> Callable:
+    source = entry['source']
+    path = tuple(entry['path'])
+
+    def step(channel):
+        return([_get_path(item, path) for item in channel.get(source) or []])
+    return(step)
+
+
+def _compile_joined(entry: dict) -> Callable:
+    sources = tuple(entry['sources'])
+
+    def step(channel):
+        buckets = {'en': [], 'fi': [], 'sv': []}
+        for source in sources:
+            for item in channel.get(source) or []:
+                bucket = buckets.get(item.get('language'))
+                if bucket is not None:
+                    value = item.get('value')
+                    if value is not None:
+                        bucket.append(value)
+        return({language: join_or_none(buckets[language]) for language in languages})
+    return(step)
+
+
+def _compile_values(entry: dict) -> Callable:
+    sources = tuple(entry['sources'])
+    attribute = entry['attribute']
+
+    def step(channel):
+        buckets = {'en': [], 'fi': [], 'sv': []}
+        for source in sources:
+            for item in channel.get(source) or []:
+                bucket = buckets.get(item.get('language'))
+                if bucket is not None:
+                    bucket.append(item.get(attribute))
+        return(buckets)
+    return(step)
+
+
+def _compile_records(entry: dict) -> Callable:
+    sources = tuple(entry['sources'])
+    attributes = tuple(entry['attributes'])
+    skip_none = entry.get('skip_none')
+
+    def step(channel):
+        buckets = {'en': [], 'fi': [], 'sv': []}
+        for source in sources:
+            for item in channel.get(source) or []:
+                bucket = buckets.get(item.get('language'))
+                if bucket is not None and (skip_none is None or item.get(skip_none) is not None):
+                    bucket.append({key: item.get(attribute) for key, attribute in attributes})
+        return(buckets)
+    return(step)
+
+
+def _compile_elements(entry: dict) -> Callable:
+    source = entry['source']
+    element = tuple((key, kind, tuple(path)) for key, kind, path in entry['element'])
+    joined_fields = tuple((key, path) for key, kind, path in element if kind == 'joined')
+    unwrap = entry.get('unwrap')
+
+    def step(channel):
+        buckets = {'en': [], 'fi': [], 'sv': []}
+        for outer in channel.get(source) or []:
+            item = outer
+            if unwrap is not None and _get_path(outer, unwrap[0]) == unwrap[1]:
+                item = _get_path(outer, unwrap[2])
+            # Language independent values are read once and copied to every language
+            base = {}
+            for key, kind, path in element:
+                if kind == 'outer':
+                    base[key] = _get_path(outer, path)
+                elif kind == 'value':
+                    base[key] = _get_path(item, path)
+                else:
+                    base[key] = None
+            joined = [(key, values_by_language(_get_path(item, path) or [])) for key, path in joined_fields]
+            for language in languages:
+                language_element = base.copy()
+                for key, values in joined:
+                    language_element[key] = join_or_none(values[language])
+                buckets[language].append(language_element)
+        return(buckets)
+    return(step)
+
+
+compilers = {'copy': _compile_copy,
+             'ids': _compile_ids,
+             'joined': _compile_joined,
+             'values': _compile_values,
+             'records': _compile_records,
+             'elements': _compile_elements}
+
+
+def compile_channel_spec(spec: list) -> Callable[[dict], dict]:
+    """
+    Compile a channel spec into a function that parses one raw channel
+    """
+    steps = []
+    for entry in spec:
+        if entry['kind'] not in compilers:
+            raise Exception("Spec kind not recognized")
+        steps.append((entry['field'], compilers[entry['kind']](entry)))
+    steps = tuple(steps)
+
+    def transform(channel: dict) -> dict:
+        return({field: step(channel) for field, step in steps})
+    return(transform)
+
+
+parse_channel_info = compile_channel_spec(channel_spec)
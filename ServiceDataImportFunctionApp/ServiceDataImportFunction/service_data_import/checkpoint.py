@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Optional
+from pymongo import ASCENDING, DESCENDING
+
+# Stages of a checkpointed import run in the order they are completed
+stages = ['service_listing', 'service_batches', 'channel_listing', 'channel_batches', 'store']
+# Guids per listing document, a full listing would not fit in one Mongo document
+listing_chunk_size = 10000
+
+
+class ImportCheckpoint():
+    """
+    Progress of one import run persisted to Mongo
+
+    The run document holds the stage and everything the later stages need.
+    Every completed batch is a document of its own with the stage, the
+    values it appends to the lists of the run and the fields it sets, so
+    the run document does not grow with the run. Listed guids are stored the
+    same way in chunks of listing_chunk_size. A run that was evicted or
+    crashed continues from its last completed batch.
+
+    Args
+    ----------
+    database : Database
+        Mongo database with the import_runs and import_run_batches collections
+
+    run : dict
+        The run document with the progress of its batches
+
+
+    Methods
+    -------
+    resume( database: Database, max_age: timedelta )
+        Return the latest unfinished run started within max_age, older ones are abandoned
+
+    start( database: Database, fields: dict )
+        Start a new run with the given fields
+
+    save( **fields )
+        Set fields of the run
+
+    extend( lists: dict, **fields )
+        Store a completed batch that appends values to list fields of the run and sets fields
+
+    save_listing( key: str, guids: list, **fields )
+        Store listed guids in chunks as the list field key of the run, then set fields
+
+    complete()
+        Mark the run done and remove its batches
+
+    """
+
+    def __init__(self, database: Any, run: dict) -> None:
+        self.runs = database.import_runs
+        self.batches = database.import_run_batches
+        self.run = run
+        self.batch_count = 0
+        self.seconds = 0.0
+        self.saves = 0
+        self.batches.create_index([('run', ASCENDING), ('batch', ASCENDING)], unique=True, name='run_batch')
+
+    @classmethod
+    def resume(cls, database: Any, max_age: timedelta) -> Optional['ImportCheckpoint']:
+        oldest_start = datetime.utcnow() - max_age
+        abandoned_ids = [run['_id'] for run in database.import_runs.find({'status': 'running', 'started': {'$lt': oldest_start}}, {'_id': 1})]
+        if len(abandoned_ids) > 0:
+            database.import_runs.update_many({'_id': {'$in': abandoned_ids}}, {'$set': {'status': 'abandoned'}})
+            database.import_run_batches.delete_many({'run': {'$in': abandoned_ids}})
+        runs = list(database.import_runs.find({'status': 'running'}).sort('started', DESCENDING).limit(1))
+        if len(runs) == 0:
+            return(None)
+        checkpoint = cls(database, runs[0])
+        for batch in database.import_run_batches.find({'run': runs[0]['_id']}).sort('batch', ASCENDING):
+            checkpoint._apply(batch['lists'], batch['fields'])
+            checkpoint.batch_count = batch['batch']
+        print("Resuming import run", runs[0]['_id'], "from stage", runs[0]['stage'], "after", checkpoint.batch_count, "batches")
+        return(checkpoint)
+
+    @classmethod
+    def start(cls, database: Any, fields: dict) -> 'ImportCheckpoint':
+        run = dict(fields)
+        run.update({'_id': uuid.uuid4().hex, 'status': 'running', 'stage': stages[0], 'started': datetime.utcnow()})
+        checkpoint = cls(database, run)
+        start = time.perf_counter()
+        checkpoint.runs.insert_one(dict(run))
+        checkpoint._timed(start)
+        return(checkpoint)
+
+    def _timed(self, start: float) -> None:
+        self.seconds = self.seconds + time.perf_counter() - start
+        self.saves = self.saves + 1
+
+    def _apply(self, lists: dict, fields: dict) -> None:
+        for key, values in lists.items():
+            self.run.setdefault(key, []).extend(values)
+        self.run.update(fields)
+
+    def save(self, **fields) -> None:
+        start = time.perf_counter()
+        self.run.update(fields)
+        self.runs.update_one({'_id': self.run['_id']}, {'$set': fields})
+        self._timed(start)
+
+    def extend(self, lists: dict, **fields) -> None:
+        start = time.perf_counter()
+        lists = {key: list(values) for key, values in lists.items()}
+        # One insert per batch, its lists and fields are applied together when the run is resumed
+        self.batches.insert_one({'run': self.run['_id'], 'batch': self.batch_count + 1, 'stage': self.run['stage'], 'lists': lists, 'fields': fields})
+        self.batch_count = self.batch_count + 1
+        self._apply(lists, fields)
+        self._timed(start)
+
+    def save_listing(self, key: str, guids: list, **fields) -> None:
+        # Chunks of a listing that was interrupted are replaced
+        self.batches.delete_many({'run': self.run['_id'], 'stage': self.run['stage']})
+        self.run[key] = []
+        for start in range(0, len(guids), listing_chunk_size):
+            self.extend({key: guids[start:start + listing_chunk_size]})
+        self.save(**fields)
+
+    def complete(self) -> None:
+        self.save(status='done', finished=datetime.utcnow())
+        self.batches.delete_many({'run': self.run['_id']})
+        print("Checkpointing took {:.3f} s over {} saves.".format(self.seconds, self.saves))
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Normalised output of parsed services and channels
+
+Parsed documents repeat the names of their target groups, service classes,
+life events and areas in every language. In normalised output they carry
+only the codes, and the names live once per code in a dictionary
+collection. The denormalise helpers put the names back for readers that
+expect the parsed shape. Normalised documents are marked with
+normalised: True, so documents stored in the other shape can be told apart.
+"""
+from typing import Any, Optional
+from pymongo import ReplaceOne
+from .service_parser import languages
+
+# Code fields of parsed services and the language dependent attributes of their entries
+service_code_fields = {'targetGroups': ['name'],
+                       'serviceClasses': ['name', 'description'],
+                       'lifeEvents': ['name'],
+                       'areas': ['name']}
+
+
+def code_id(kind: str, code: Any, area_type: Optional[str] = None) -> str:
+    """
+    Return the dictionary id of a code, area codes are only unique within their type
+    """
+    if kind == 'areas':
+        return("{}/{}/{}".format(kind, area_type, code))
+    return("{}/{}".format(kind, code))
+
+
+class CodeDictionary():
+    """
+    Code metadata collected from parsed services and channels
+
+    Entries are keyed by code_id and hold the code, the area type of area
+    codes and the language dependent attributes of the code. An entry is
+    written to the dictionary collection once per run, or again if a later
+    document of the run has different names for it.
+
+    Args
+    ----------
+    entries : dict ( default None )
+        Entries by code id, a dictionary loaded from Mongo for denormalising
+
+
+    Methods
+    -------
+    load( mongo_collection )
+        Read every entry of a dictionary collection
+
+    normalise( collection: str, item: dict )
+        Return a copy of a parsed service or channel with codes only, collecting their entries
+
+    denormalise( collection: str, item: dict )
+        Return a normalised service or channel in the parsed shape
+
+    store( mongo_collection )
+        Upsert the entries that are new or changed since the last store, returns their count
+
+    """
+
+    def __init__(self, entries: Optional[dict] = None) -> None:
+        self.entries = dict(entries or {})
+        self.pending = set()
+
+    @classmethod
+    def load(cls, mongo_collection: Any) -> 'CodeDictionary':
+        return(cls({entry.get('id'): entry for entry in mongo_collection.find({}, {'_id': 0})}))
+
+    def _collect(self, kind: str, code: Any, attributes: dict, area_type: Optional[str] = None) -> dict:
+        entry = {'id': code_id(kind, code, area_type), 'kind': kind, 'code': code}
+        if kind == 'areas':
+            entry['type'] = area_type
+        entry.update(attributes)
+        if self.entries.get(entry['id']) != entry:
+            self.entries[entry['id']] = entry
+            self.pending.add(entry['id'])
+        return(entry)
+
+    def _normalise_codes(self, kind: str, buckets: dict) -> list:
+        codes = []
+        # Buckets of every language have the same codes in the same order
+        for index, element in enumerate(buckets['fi']):
+            attributes = {attribute: {language: buckets[language][index].get(attribute) for language in languages}
+                          for attribute in service_code_fields[kind]}
+            if kind == 'areas':
+                self._collect(kind, element.get('code'), attributes, element.get('type'))
+                codes.append({'type': element.get('type'), 'code': element.get('code')})
+            else:
+                self._collect(kind, element.get('code'), attributes)
+                codes.append(element.get('code'))
+        return(codes)
+
+    def normalise(self, collection: str, item: dict) -> dict:
+        normalised = dict(item)
+        normalised['normalised'] = True
+        if collection == "services":
+            for kind in service_code_fields:
+                normalised[kind] = self._normalise_codes(kind, item.get(kind))
+        elif collection == "channels":
+            normalised['areas'] = self._normalise_codes('areas', item.get('areas'))
+            addresses = {language: [] for language in languages}
+            for index, address in enumerate(item.get('addresses')['fi']):
+                if address.get('municipalityCode') is not None:
+                    self._collect('areas', address.get('municipalityCode'),
+                                  {'name': {language: item.get('addresses')[language][index].get('municipalityName') for language in languages}},
+                                  'Municipality')
+                for language in languages:
+                    language_address = dict(item.get('addresses')[language][index])
+                    if address.get('municipalityCode') is not None:
+                        del language_address['municipalityName']
+                    addresses[language].append(language_address)
+            normalised['addresses'] = addresses
+        else:
+            raise Exception("Collection not recognized")
+        return(normalised)
+
+    def _denormalise_codes(self, kind: str, codes: list) -> dict:
+        buckets = {language: [] for language in languages}
+        for code in codes:
+            if kind == 'areas':
+                entry = self.entries.get(code_id(kind, code.get('code'), code.get('type'))) or {}
+            else:
+                entry = self.entries.get(code_id(kind, code)) or {}
+            for language in languages:
+                element = {attribute: (entry.get(attribute) or {}).get(language) for attribute in service_code_fields[kind]}
+                if kind == 'areas':
+                    element['type'] = code.get('type')
+                    element['code'] = code.get('code')
+                else:
+                    element['code'] = code
+                buckets[language].append(element)
+        return(buckets)
+
+    def denormalise(self, collection: str, item: dict) -> dict:
+        denormalised = dict(item)
+        denormalised.pop('normalised', None)
+        if collection == "services":
+            for kind in service_code_fields:
+                denormalised[kind] = self._denormalise_codes(kind, item.get(kind) or [])
+        elif collection == "channels":
+            denormalised['areas'] = self._denormalise_codes('areas', item.get('areas') or [])
+            addresses = {}
+            for language in languages:
+                addresses[language] = []
+                for address in (item.get('addresses') or {}).get(language, []):
+                    language_address = dict(address)
+                    if address.get('municipalityCode') is not None:
+                        entry = self.entries.get(code_id('areas', address.get('municipalityCode'), 'Municipality')) or {}
+                        language_address['municipalityName'] = (entry.get('name') or {}).get(language)
+                    addresses[language].append(language_address)
+            denormalised['addresses'] = addresses
+        else:
+            raise Exception("Collection not recognized")
+        return(denormalised)
+
+    def store(self, mongo_collection: Any) -> int:
+        pending = sorted(self.pending)
+        if len(pending) > 0:
+            mongo_collection.bulk_write([ReplaceOne({'id': entry_id}, self.entries[entry_id], upsert=True) for entry_id in pending], ordered=False)
+        self.pending = set()
+        return(len(pending))
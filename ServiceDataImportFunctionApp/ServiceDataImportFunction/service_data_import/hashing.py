@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+
+# Bump when the parsers change so that stored raw hashes no longer skip parsing
+hash_version = "1"
+
+# Fields that are stamped on parsed documents and not part of their content
+unhashed_fields = ('_id', 'lastUpdated', 'rawHash', 'contentHash')
+
+
+def content_hash(document: dict) -> str:
+    """
+    Stable hash of a raw PTV payload or a parsed document
+
+    Keys are sorted so the hash does not depend on key order, and the
+    stamped fields in unhashed_fields are left out.
+    """
+    content = {key: value for key, value in document.items() if key not in unhashed_fields}
+    serialized = json.dumps(content, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return(hashlib.sha1((hash_version + serialized).encode('utf-8')).hexdigest())
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.parse
+from typing import Any, Optional
+
+# Seconds a cached response is used without asking PTV, by longest matching path prefix.
+# Other responses are always revalidated with their ETag or Last-Modified.
+endpoint_ttls = {'/CodeList/': 7*24*60*60}
+
+
+class CachedResponse():
+    """
+    Response read from the cache, enough of a requests.Response for the importer
+    """
+
+    def __init__(self, url: str, content: bytes, headers: dict) -> None:
+        self.url = url
+        self.content = content
+        self.headers = headers
+        self.status_code = 200
+
+    def json(self) -> Any:
+        return(json.loads(self.content.decode('utf-8')))
+
+
+class CachingSession():
+    """
+    A caching wrapper around a requests session for PTV API GET requests
+
+    Responses are stored on disk, one metadata file and one body file per
+    url. A response younger than the TTL of its endpoint is served without
+    a request, an older one is revalidated with If-None-Match and
+    If-Modified-Since when PTV gave an ETag or Last-Modified for it.
+
+    Args
+    ----------
+    session : requests.Session
+        Session that sends the requests
+
+    cache_dir : str
+        Directory where responses are stored
+
+    ttls : dict ( default None )
+        TTL seconds by url path prefix, endpoint_ttls if not given
+
+    max_age_days : float ( default 14 )
+        Entries stored longer ago than this are removed on construction
+
+
+    Methods
+    -------
+    get( url: str )
+        Return a cached or fetched response of url
+
+    prune( max_age_days: float )
+        Remove entries stored longer ago than max_age_days
+
+    hit_ratio()
+        Share of requests answered from the cache, revalidated ones included
+
+    report()
+        Print hits, revalidations, misses and bytes saved
+
+    """
+
+    def __init__(self, session: Any, cache_dir: str, ttls: Optional[dict] = None, max_age_days: float = 14) -> None:
+        self.session = session
+        self.cache_dir = cache_dir
+        self.ttls = ttls if ttls is not None else endpoint_ttls
+        self.stats = {'hits': 0, 'revalidated': 0, 'misses': 0, 'bytes_saved': 0}
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.prune(max_age_days)
+
+    def __getattr__(self, name: str) -> Any:
+        # Headers, auth and the rest are those of the wrapped session
+        if name == 'session':
+            raise AttributeError(name)
+        return(getattr(self.session, name))
+
+    def _ttl(self, url: str) -> float:
+        path = urllib.parse.urlparse(url).path
+        matches = [prefix for prefix in self.ttls if prefix in path]
+        if len(matches) == 0:
+            return(0)
+        return(self.ttls[max(matches, key=len)])
+
+    def _paths(self, url: str) -> tuple:
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return(os.path.join(self.cache_dir, key + ".json"), os.path.join(self.cache_dir, key + ".body"))
+
+    def _load(self, url: str) -> Optional[tuple]:
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as meta_file:
+                meta = json.load(meta_file)
+            with open(body_path, 'rb') as body_file:
+                body = body_file.read()
+        except (OSError, ValueError):
+            return(None)
+        if meta.get('url') != url:
+            return(None)
+        return(meta, body)
+
+    def _write(self, path: str, content: bytes) -> None:
+        # Written aside and renamed so concurrent readers never see a partial file
+        temp_path = path + ".{}.{}.tmp".format(os.getpid(), threading.get_ident())
+        with open(temp_path, 'wb') as temp_file:
+            temp_file.write(content)
+        os.replace(temp_path, path)
+
+    def _store(self, url: str, meta: dict, body: Optional[bytes] = None) -> None:
+        meta_path, body_path = self._paths(url)
+        if body is not None:
+            self._write(body_path, body)
+        self._write(meta_path, json.dumps(meta).encode('utf-8'))
+
+    def _count(self, outcome: str, bytes_saved: int = 0) -> None:
+        with self._lock:
+            self.stats[outcome] = self.stats[outcome] + 1
+            self.stats['bytes_saved'] = self.stats['bytes_saved'] + bytes_saved
+
+    def get(self, url: str, **kwargs) -> Any:
+        cached = self._load(url)
+        if cached is not None:
+            meta, body = cached
+            if time.time() - meta['stored'] < self._ttl(url):
+                self._count('hits', len(body))
+                return(CachedResponse(url, body, meta['headers']))
+            validators = {}
+            if meta['headers'].get('ETag'):
+                validators['If-None-Match'] = meta['headers']['ETag']
+            if meta['headers'].get('Last-Modified'):
+                validators['If-Modified-Since'] = meta['headers']['Last-Modified']
+            if len(validators) > 0:
+                headers = dict(kwargs.pop('headers', None) or {})
+                headers.update(validators)
+                kwargs['headers'] = headers
+        response = self.session.get(url=url, **kwargs)
+        if cached is not None and response.status_code == 304:
+            meta['stored'] = time.time()
+            self._store(url, meta)
+            os.utime(self._paths(url)[1])
+            self._count('revalidated', len(body))
+            return(CachedResponse(url, body, meta['headers']))
+        self._count('misses')
+        if response.status_code == 200:
+            headers = {name: response.headers.get(name) for name in ['ETag', 'Last-Modified'] if response.headers.get(name)}
+            # A response that is neither fresh for a while nor revalidatable would never be served back
+            if self._ttl(url) > 0 or len(headers) > 0:
+                self._store(url, {'url': url, 'stored': time.time(), 'headers': headers}, response.content)
+        return(response)
+
+    def prune(self, max_age_days: float) -> None:
+        oldest = time.time() - max_age_days*24*60*60
+        for file_name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, file_name)
+            try:
+                if os.path.getmtime(path) < oldest:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def hit_ratio(self) -> float:
+        request_count = self.stats['hits'] + self.stats['revalidated'] + self.stats['misses']
+        if request_count == 0:
+            return(0.0)
+        return((self.stats['hits'] + self.stats['revalidated']) / request_count)
+
+    def report(self) -> None:
+        print("HTTP cache: {} hits, {} revalidated, {} misses, hit ratio {:.1%}, {} bytes saved.".format(
+            self.stats['hits'], self.stats['revalidated'], self.stats['misses'], self.hit_ratio(), self.stats['bytes_saved']))
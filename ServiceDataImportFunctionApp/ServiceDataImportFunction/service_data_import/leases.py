@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Optional
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+# Task kinds of a sharded run in order, a kind is claimed only when every task of the earlier kinds is done
+task_kinds = ['plan_services', 'services', 'plan_channels', 'channels', 'finish']
+# Document of import_shard_runs that points to the latest started run
+active_run_key = "active"
+
+
+class LeaseLost(Exception):
+    """
+    Raised when the lease of a task has expired and another replica has claimed it
+    """
+
+
+class ShardCoordinator():
+    """
+    Shares the tasks of an import run between replicas with leases in Mongo
+
+    A run is a list of task documents: planning the service shards, the
+    service shards, planning the channel shards, the channel shards and
+    finishing the run. A replica claims a task by atomically setting itself
+    as the owner with a lease, renews the lease with heartbeats while it
+    works and marks the task done with its results. The task of a replica
+    that stops heartbeating is claimed again once the lease expires, and a
+    task that fails is released to be claimed again right away. A task that
+    has used max_attempts claims is failed along with its run.
+
+    Args
+    ----------
+    database : Database
+        Mongo database with the import_shard_runs and import_shards collections
+
+    owner : str ( default None )
+        Name of this worker, host name, process id and a random suffix if not given
+
+    lease_seconds : float ( default 300 )
+        How long a claimed task is reserved without a heartbeat
+
+    shard_size : int ( default 500 )
+        Number of guids in a shard
+
+    max_attempts : int ( default 3 )
+        How many times a task is claimed before it and its run are failed
+
+
+    Methods
+    -------
+    join( max_age: timedelta )
+        Return the run the replicas are working on, None if there is none
+
+    join_or_start( fields: dict, max_age: timedelta )
+        Return the run the replicas are working on, starting one if there is none
+
+    add_shards( run_id: str, kind: str, guids: list )
+        Split guids into shard tasks of the run
+
+    claim( run_id: str )
+        Claim the next task that is ready, None if there is none. A run left without tasks by its starter is abandoned once it is older than the lease
+
+    heartbeat( task: dict )
+        Renew the lease of a task, raises LeaseLost if it was claimed by another replica
+
+    complete( task: dict, result: dict )
+        Mark a task done with its result
+
+    release( task: dict, error: str )
+        Give up a task that failed, so it is claimed again or failed with its run if it has no attempts left
+
+    done_tasks( run_id: str, kind: str )
+        Return the done tasks of a kind
+
+    finished( run_id: str )
+        Whether the run is finished
+
+    failed( run_id: str )
+        Whether the run was failed by a task that used its attempts
+
+    """
+
+    def __init__(self, database: Any, owner: Optional[str] = None, lease_seconds: float = 300, shard_size: int = 500, max_attempts: int = 3) -> None:
+        self.runs = database.import_shard_runs
+        self.tasks = database.import_shards
+        # Workers of one process are told apart, so a lease is never renewed by the wrong one
+        self.owner = owner if owner is not None else "{}-{}-{}".format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:4])
+        self.lease = timedelta(seconds=lease_seconds)
+        self.shard_size = shard_size
+        self.max_attempts = max_attempts
+        self.tasks.create_index([('run', ASCENDING), ('kind', ASCENDING), ('status', ASCENDING)], name='run_kind_status')
+
+    def join(self, max_age: timedelta) -> Optional[dict]:
+        self.runs.update_many({'status': 'running', 'started': {'$lt': datetime.utcnow() - max_age}}, {'$set': {'status': 'abandoned'}})
+        running = self.runs.find_one({'status': 'running'})
+        if running is not None:
+            print("Joining sharded import run", running['_id'], "as", self.owner)
+        return(running)
+
+    def join_or_start(self, fields: dict, max_age: timedelta) -> dict:
+        running = self.join(max_age)
+        if running is not None:
+            return(running)
+        active = self.runs.find_one({'_id': active_run_key}) or {}
+        if active.get('run') is not None:
+            # A run started since the running runs were looked up
+            latest = self.runs.find_one({'_id': active['run']})
+            if latest is not None and latest.get('status') == 'running':
+                print("Joining sharded import run", latest['_id'], "as", self.owner)
+                return(latest)
+        now = datetime.utcnow()
+        run = dict(fields)
+        run.update({'_id': "{}-{}".format(now.strftime("%Y%m%dT%H%M%S"), uuid.uuid4().hex[:8]), 'status': 'running', 'started': now})
+        self.runs.insert_one(dict(run))
+        # Tasks are added before the run is made active, so an active run always has them
+        self.tasks.insert_many([{'run': run['_id'], 'kind': kind, 'shard': 0, 'status': 'pending'} for kind in task_kinds if kind not in ['services', 'channels']])
+        # Replicas starting at the same time race on moving the active run pointer from the same run and only one of them wins
+        try:
+            self.runs.update_one({'_id': active_run_key, 'run': active.get('run')}, {'$set': {'run': run['_id']}}, upsert=True)
+        except DuplicateKeyError:
+            self.runs.delete_many({'_id': run['_id']})
+            self.tasks.delete_many({'run': run['_id']})
+            winner = self.runs.find_one({'_id': self.runs.find_one({'_id': active_run_key})['run']})
+            print("Joining sharded import run", winner['_id'], "as", self.owner)
+            return(winner)
+        print("Started sharded import run", run['_id'], "as", self.owner)
+        return(run)
+
+    def add_shards(self, run_id: str, kind: str, guids: list) -> int:
+        shards = [{'run': run_id, 'kind': kind, 'shard': number, 'status': 'pending', 'guids': guids[start:start + self.shard_size]}
+                  for number, start in enumerate(range(0, len(guids), self.shard_size))]
+        # A planning task that is run again replaces the shards of its earlier attempt
+        self.tasks.delete_many({'run': run_id, 'kind': kind})
+        if len(shards) > 0:
+            self.tasks.insert_many(shards)
+        return(len(shards))
+
+    def _claim_kind(self, run_id: str, kind: str) -> Optional[dict]:
+        now = datetime.utcnow()
+        query = {'run': run_id, 'kind': kind, '$or': [{'status': 'pending'}, {'status': 'claimed', 'leaseUntil': {'$lt': now}, 'attempts': {'$lt': self.max_attempts}}]}
+        update = {'$set': {'status': 'claimed', 'owner': self.owner, 'leaseUntil': now + self.lease, 'claimed': now}, '$inc': {'attempts': 1}}
+        return(self.tasks.find_one_and_update(query, update, sort=[('shard', ASCENDING)], return_document=ReturnDocument.AFTER))
+
+    def _fail(self, task: dict, error: str) -> None:
+        now = datetime.utcnow()
+        self.tasks.update_one({'_id': task['_id']}, {'$set': {'status': 'failed', 'error': error, 'finished': now}})
+        self.runs.update_one({'_id': task['run'], 'status': 'running'}, {'$set': {'status': 'failed', 'finished': now}})
+        print("Sharded import run", task['run'], "failed,", task['kind'], "task", task['shard'], "used", task.get('attempts'), "attempts:", error)
+
+    def claim(self, run_id: str) -> Optional[dict]:
+        if self.tasks.count_documents({'run': run_id}) == 0:
+            # The replica that started the run stopped before adding its tasks, nobody could ever finish it
+            abandoned = self.runs.update_one({'_id': run_id, 'status': 'running', 'started': {'$lt': datetime.utcnow() - self.lease}}, {'$set': {'status': 'abandoned'}})
+            if abandoned.modified_count > 0:
+                print("Abandoned sharded import run", run_id, "without tasks")
+            return(None)
+        # A task whose every attempt has expired is not claimed again
+        exhausted = self.tasks.find_one({'run': run_id, 'status': 'claimed', 'leaseUntil': {'$lt': datetime.utcnow()}, 'attempts': {'$gte': self.max_attempts}})
+        if exhausted is not None:
+            self._fail(exhausted, "Lease expired")
+            return(None)
+        for number, kind in enumerate(task_kinds):
+            if number > 0 and self.tasks.count_documents({'run': run_id, 'kind': {'$in': task_kinds[:number]}, 'status': {'$ne': 'done'}}) > 0:
+                return(None)
+            task = self._claim_kind(run_id, kind)
+            if task is not None:
+                if task.get('attempts', 1) > 1:
+                    print("Reclaimed", kind, "task", task['shard'], "of run", run_id)
+                return(task)
+        return(None)
+
+    def heartbeat(self, task: dict) -> None:
+        result = self.tasks.update_one({'_id': task['_id'], 'owner': self.owner, 'status': 'claimed'},
+                                       {'$set': {'leaseUntil': datetime.utcnow() + self.lease}})
+        if result.matched_count == 0:
+            raise LeaseLost("Lease of {} task {} was lost".format(task['kind'], task['shard']))
+
+    def complete(self, task: dict, result: Optional[dict] = None) -> None:
+        fields = dict(result or {})
+        fields.update({'status': 'done', 'finished': datetime.utcnow()})
+        update = self.tasks.update_one({'_id': task['_id'], 'owner': self.owner}, {'$set': fields})
+        if update.matched_count == 0:
+            raise LeaseLost("Lease of {} task {} was lost".format(task['kind'], task['shard']))
+        if task['kind'] == 'finish':
+            self.runs.update_one({'_id': task['run']}, {'$set': {'status': 'done', 'finished': datetime.utcnow()}})
+
+    def release(self, task: dict, error: str) -> None:
+        if task.get('attempts', 1) >= self.max_attempts:
+            self._fail(task, error)
+            return
+        self.tasks.update_one({'_id': task['_id'], 'owner': self.owner, 'status': 'claimed'}, {'$set': {'status': 'pending', 'error': error}})
+
+    def done_tasks(self, run_id: str, kind: str) -> list:
+        return(list(self.tasks.find({'run': run_id, 'kind': kind, 'status': 'done'})))
+
+    def finished(self, run_id: str) -> bool:
+        run = self.runs.find_one({'_id': run_id})
+        return(run is None or run.get('status') != 'running')
+
+    def failed(self, run_id: str) -> bool:
+        run = self.runs.find_one({'_id': run_id})
+        return(run is not None and run.get('status') == 'failed')
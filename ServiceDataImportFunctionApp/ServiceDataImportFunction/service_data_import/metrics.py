@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+import cProfile
+import contextvars
+import json
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Iterator, Optional
+try:
+    import resource
+except ImportError:
+    resource = None
+
+profilers = ['cprofile', 'tracemalloc']
+# Summed over the entries of a stage, peaks are the largest of them
+stage_fields = ['seconds', 'requests', 'bytes', 'documents_in', 'documents_out', 'process_peak_rss_bytes', 'peak_traced_bytes', 'entries']
+stage_help = {'seconds': "Wall time spent in the stage",
+              'requests': "PTV API requests sent by the stage",
+              'bytes': "Bytes downloaded from PTV API by the stage",
+              'documents_in': "Documents going into the stage",
+              'documents_out': "Documents coming out of the stage",
+              'process_peak_rss_bytes': "Peak resident memory of the process since it started, read at the end of the stage",
+              'peak_traced_bytes': "Peak memory traced by tracemalloc during the stage, entries that overlapped other stages are left out",
+              'entries': "Times the stage was entered"}
+
+# Request counters of the stages open in the current context, innermost last
+_open_stages = contextvars.ContextVar('open_stages', default=())
+
+
+def run_in_context(function: Callable) -> Callable:
+    """
+    Return function bound to a copy of the current context, so requests it
+    sends from a worker thread are counted in the stages open here
+    """
+    context = contextvars.copy_context()
+    return(lambda *args: context.run(function, *args))
+
+
+class MeteredSession():
+    """
+    A wrapper around a requests session that counts requests and downloaded bytes
+
+    Totals are kept for the whole session. Every request is also counted in
+    the stages open in the context that sent it, so requests of prefetch
+    threads are not counted in stages that merely overlap them.
+
+    Args
+    ----------
+    session : requests.Session
+        Session that sends the requests
+
+    """
+
+    def __init__(self, session: Any) -> None:
+        self.session = session
+        self.requests = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        # Headers, auth and the rest are those of the wrapped session
+        if name == 'session':
+            raise AttributeError(name)
+        return(getattr(self.session, name))
+
+    def get(self, url: str, **kwargs) -> Any:
+        response = self.session.get(url=url, **kwargs)
+        content = getattr(response, 'content', None)
+        size = len(content) if isinstance(content, (bytes, str)) else 0
+        with self._lock:
+            self.requests = self.requests + 1
+            self.bytes = self.bytes + size
+            for meter, counts in _open_stages.get():
+                if meter is self:
+                    counts['requests'] = counts['requests'] + 1
+                    counts['bytes'] = counts['bytes'] + size
+        return(response)
+
+
+class RunMetrics():
+    """
+    Metrics of the stages of one import run
+
+    Every stage records wall time, requests, downloaded bytes, documents
+    in and out and memory. Requests and bytes are those sent from the
+    context of the stage, including worker threads started with
+    run_in_context. Resident memory is the peak of the whole process so far,
+    tracemalloc gives the peak of the stage itself. Stages entered several times, like the
+    batches of a streaming run, are summed. Stages may optionally be
+    profiled with cProfile and tracemalloc. Tracemalloc only runs between
+    start_tracing and finish, and as its peak is global to the process, the
+    peak and snapshot of a stage are only kept when no other stage was open
+    during it.
+
+    Args
+    ----------
+    meter : MeteredSession ( default None )
+        Session whose request and byte counts are attributed to stages
+
+    profile : list ( default None )
+        Profilers to run per stage, 'cprofile' and/or 'tracemalloc'
+
+    output_dir : str ( default None )
+        Directory where the summary and profiles are written, summary is only printed if not given
+
+
+    Methods
+    -------
+    from_env( environ: dict, meter: MeteredSession )
+        Build from PTV_METRICS_DIR and PTV_PROFILE
+
+    start_tracing()
+        Start tracemalloc if it is a profiler of the run and no one else is tracing
+
+    stage( name: str, collection: str )
+        Context manager that records one entry of a stage, yields a dict for documents_in and documents_out
+
+    summary()
+        Metrics as a dict
+
+    prometheus()
+        Metrics in Prometheus text format
+
+    finish()
+        Stop profiling and tracing, print the summary and write it to output_dir
+
+    """
+
+    def __init__(self, meter: Optional[MeteredSession] = None, profile: Optional[list] = None, output_dir: Optional[str] = None) -> None:
+        self.meter = meter
+        self.profile = profile if profile is not None else []
+        for profiler in self.profile:
+            if profiler not in profilers:
+                raise Exception("Profiler not recognized")
+        self.output_dir = output_dir
+        self.run_id = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        self.stages = {}
+        self.started = time.perf_counter()
+        self.seconds = None
+        self._lock = threading.Lock()
+        self._profiles = {}
+        self._profiling = False
+        self._started_tracemalloc = False
+        self._traced_entries = []
+
+    @classmethod
+    def from_env(cls, environ: dict, meter: Optional[MeteredSession] = None) -> 'RunMetrics':
+        profile = [profiler.strip().lower() for profiler in environ.get("PTV_PROFILE", "").split(",") if profiler.strip()]
+        return(cls(meter, profile, environ.get("PTV_METRICS_DIR") or None))
+
+    def _counts(self) -> tuple:
+        if self.meter is None:
+            return(0, 0)
+        return(self.meter.requests, self.meter.bytes)
+
+    def start_tracing(self) -> None:
+        if 'tracemalloc' in self.profile and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+    def _start_trace(self) -> Optional[dict]:
+        if not self._started_tracemalloc:
+            return(None)
+        entry = {'overlapped': False}
+        with self._lock:
+            # Resetting the process-wide peak would spoil the open stages, so none of them is measured
+            if len(self._traced_entries) > 0:
+                entry['overlapped'] = True
+                for open_entry in self._traced_entries:
+                    open_entry['overlapped'] = True
+            elif hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            self._traced_entries.append(entry)
+        return(entry)
+
+    def _dump_path(self, key: tuple, extension: str) -> str:
+        output_dir = self.output_dir if self.output_dir is not None else tempfile.gettempdir()
+        os.makedirs(output_dir, exist_ok=True)
+        return(os.path.join(output_dir, "{}_{}.{}".format(self.run_id, "_".join([part for part in key if part]), extension)))
+
+    def _start_cprofile(self, key: tuple) -> Optional[cProfile.Profile]:
+        # One profiler can be active at a time, stages in worker threads are not profiled
+        if 'cprofile' not in self.profile or self._profiling or threading.current_thread() is not threading.main_thread():
+            return(None)
+        profiler = self._profiles.setdefault(key, cProfile.Profile())
+        self._profiling = True
+        profiler.enable()
+        return(profiler)
+
+    @contextmanager
+    def stage(self, name: str, collection: Optional[str] = None) -> Iterator[dict]:
+        key = (name, collection)
+        documents = {'documents_in': 0, 'documents_out': 0}
+        counts = {'requests': 0, 'bytes': 0}
+        token = _open_stages.set(_open_stages.get() + ((self.meter, counts),)) if self.meter is not None else None
+        trace = self._start_trace()
+        profiler = self._start_cprofile(key)
+        start = time.perf_counter()
+        try:
+            yield documents
+        finally:
+            seconds = time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+                self._profiling = False
+            if token is not None:
+                _open_stages.reset(token)
+            peak_traced = None
+            if trace is not None:
+                with self._lock:
+                    self._traced_entries.remove(trace)
+                if not trace['overlapped'] and tracemalloc.is_tracing():
+                    peak_traced = tracemalloc.get_traced_memory()[1]
+                    # Later entries of the stage replace the dump of earlier ones
+                    tracemalloc.take_snapshot().dump(self._dump_path(key, "tracemalloc"))
+            peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 if resource is not None else 0
+            with self._lock:
+                record = self.stages.setdefault(key, {field: 0 if field != 'peak_traced_bytes' else None for field in stage_fields})
+                record['seconds'] = record['seconds'] + seconds
+                record['requests'] = record['requests'] + counts['requests']
+                record['bytes'] = record['bytes'] + counts['bytes']
+                record['documents_in'] = record['documents_in'] + documents['documents_in']
+                record['documents_out'] = record['documents_out'] + documents['documents_out']
+                record['process_peak_rss_bytes'] = max(record['process_peak_rss_bytes'], peak_rss)
+                if peak_traced is not None:
+                    record['peak_traced_bytes'] = max(record['peak_traced_bytes'] or 0, peak_traced)
+                record['entries'] = record['entries'] + 1
+
+    def summary(self) -> dict:
+        seconds = self.seconds if self.seconds is not None else time.perf_counter() - self.started
+        requests, downloaded = self._counts()
+        stages = []
+        with self._lock:
+            for (name, collection), record in self.stages.items():
+                stage = {'stage': name, 'collection': collection}
+                stage.update(record)
+                stages.append(stage)
+        return({'run': self.run_id, 'seconds': seconds, 'requests': requests, 'bytes': downloaded, 'stages': stages})
+
+    def prometheus(self) -> str:
+        summary = self.summary()
+        lines = ["# HELP ptv_import_run_seconds Wall time of the import run",
+                 "# TYPE ptv_import_run_seconds gauge",
+                 "ptv_import_run_seconds {}".format(summary['seconds'])]
+        for field in stage_fields:
+            lines.append("# HELP ptv_import_stage_{} {}".format(field, stage_help[field]))
+            lines.append("# TYPE ptv_import_stage_{} gauge".format(field))
+            for stage in summary['stages']:
+                if stage[field] is None:
+                    continue
+                labels = 'stage="{}"'.format(stage['stage'])
+                if stage['collection'] is not None:
+                    labels = labels + ',collection="{}"'.format(stage['collection'])
+                lines.append("ptv_import_stage_{}{{{}}} {}".format(field, labels, stage[field]))
+        return("\n".join(lines) + "\n")
+
+    def finish(self) -> dict:
+        self.seconds = time.perf_counter() - self.started
+        for key, profiler in self._profiles.items():
+            profiler.dump_stats(self._dump_path(key, "prof"))
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        summary = self.summary()
+        print("Import metrics:", json.dumps(summary))
+        if self.output_dir is not None:
+            os.makedirs(self.output_dir, exist_ok=True)
+            with open(os.path.join(self.output_dir, "ptv_import_metrics.json"), 'w', encoding='utf-8') as summary_file:
+                json.dump(summary, summary_file, indent=2)
+            with open(os.path.join(self.output_dir, "ptv_import_metrics.prom"), 'w', encoding='utf-8') as prometheus_file:
+                prometheus_file.write(self.prometheus())
+        return(summary)
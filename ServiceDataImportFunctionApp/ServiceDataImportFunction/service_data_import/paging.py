@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Iterable, Iterator, Optional
+from .metrics import run_in_context
+
+
+def prefetch_map(function: Callable, items: Iterable, window: int) -> Iterator:
+    """
+    Yield function(item) for every item in order while keeping at most
+    window calls running ahead in a thread pool
+    """
+    if window <= 1:
+        for item in items:
+            yield function(item)
+        return
+    with ThreadPoolExecutor(max_workers=window) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(run_in_context(function), item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def page_ids(page: dict, seen: set) -> list:
+    """
+    Return ids of a PTV listing page that are not in seen and add them to it
+    """
+    new_ids = []
+    for item in page.get('itemList') or []:
+        guid = item.get('id')
+        if guid not in seen:
+            seen.add(guid)
+            new_ids.append(guid)
+    return(new_ids)
+
+
+def merge_listings(listings: list) -> tuple:
+    """
+    Merge ( ids, item count ) results of several listings, ids are deduplicated in listing order
+    """
+    guids = list(dict.fromkeys(guid for listing_guids, item_count in listings for guid in listing_guids))
+    return(guids, sum(item_count for listing_guids, item_count in listings))
+
+
+def parse_modified(value: Optional[str]) -> Optional[datetime]:
+    """
+    Parse a PTV modification time to a naive UTC datetime, None if it can not be parsed
+    """
+    if not value:
+        return(None)
+    value = value.strip()
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    date_part, separator, time_part = value.partition('T')
+    offset = ''
+    for sign in ['+', '-']:
+        if sign in time_part:
+            time_part, offset_part = time_part.split(sign, 1)
+            offset = sign + offset_part
+    # .NET gives up to seven fraction digits, fromisoformat takes six
+    if '.' in time_part:
+        seconds, fraction = time_part.split('.', 1)
+        time_part = seconds + '.' + (fraction + '000000')[:6]
+    try:
+        modified = datetime.fromisoformat(date_part + separator + time_part + offset)
+    except ValueError:
+        return(None)
+    if modified.tzinfo is not None:
+        modified = modified.astimezone(timezone.utc).replace(tzinfo=None)
+    return(modified)
+
+
+def latest_modified(items: list, current: Optional[datetime] = None) -> Optional[datetime]:
+    """
+    Latest modification time of fetched PTV services or channels, or current if it is later
+    """
+    for item in items:
+        modified = parse_modified(item.get('modified'))
+        if modified is not None and (current is None or modified > current):
+            current = modified
+    return(current)
+
+
+class PagedIdIterator():
+    """
+    Iterator over unique item ids of a paged PTV listing endpoint
+
+    The first page is fetched to learn pageCount, after which the remaining
+    pages are fetched ahead of the consumer with bounded parallelism.
+    Every page is decoded only once. The number of listed items is kept in
+    item_count. Callers that fetch the pages themselves, like the async
+    engine, fetch first_url, then the urls returned by page_urls, and pass
+    every page to add_page in page order.
+
+    Args
+    ----------
+    get_json : Callable
+        Function that fetches an url and returns decoded JSON
+
+    url_template : str
+        Listing url with a {} placeholder for the page number
+
+    prefetch : int ( default 4 )
+        Maximum number of pages fetched ahead at the same time
+
+    seen : set ( default None )
+        Ids that are already yielded, shared to dedupe over several listings
+
+
+    Methods
+    -------
+    first_url()
+        Url of the first page
+
+    page_urls( first_page: dict )
+        Urls of the rest of the pages, read from pageCount of the first page
+
+    add_page( page: dict )
+        Count the items of a page and return its ids that were not seen before
+
+    """
+
+    def __init__(self, get_json: Callable[[str], Any], url_template: str, prefetch: int = 4, seen: Optional[set] = None) -> None:
+        self.get_json = get_json
+        self.url_template = url_template
+        self.prefetch = prefetch
+        self.seen = seen if seen is not None else set()
+        self.page_count = None
+        self.item_count = 0
+
+    def first_url(self) -> str:
+        return(self.url_template.format("1"))
+
+    def page_urls(self, first_page: dict) -> list:
+        self.page_count = first_page.get('pageCount') or 1
+        return([self.url_template.format(str(page)) for page in range(2, self.page_count + 1)])
+
+    def add_page(self, page: dict) -> list:
+        self.item_count = self.item_count + len(page.get('itemList') or [])
+        return(page_ids(page, self.seen))
+
+    def __iter__(self) -> Iterator[str]:
+        first_page = self.get_json(self.first_url())
+        yield from self.add_page(first_page)
+        for page in prefetch_map(self.get_json, self.page_urls(first_page), self.prefetch):
+            yield from self.add_page(page)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+from .service_parser import parse_service_info
+from .channel_parser import parse_channel_info
+
+parsers = {'services': parse_service_info,
+           'channels': parse_channel_info}
+
+
+def _parse_chunk(collection: str, chunk: list) -> list:
+    parse = parsers[collection]
+    return([parse(item) for item in chunk])
+
+
+class ParallelParser():
+    """
+    Parse raw PTV services or channels in a process pool
+
+    Raw items are sent to worker processes in chunks and the parsed items are
+    returned in input order. A batch is split over all workers when it is
+    smaller than workers full chunks, so the 100 guid batches of streaming
+    runs are parsed in parallel too. Batches smaller than min_parallel_items
+    are parsed in this process because pickling them would cost more than parsing.
+
+    Args
+    ----------
+    workers : int
+        Number of worker processes
+
+    chunk_size : int ( default 200 )
+        Number of raw items sent to a worker at a time
+
+    min_parallel_items : int ( default 20 )
+        Smallest batch that is parsed in the process pool
+
+
+    Methods
+    -------
+    parse( collection: str, raw_items: list )
+        Parse raw items of 'services' or 'channels' and return them in order
+
+    close()
+        Shut down worker processes
+
+    """
+
+    def __init__(self, workers: int, chunk_size: int = 200, min_parallel_items: int = 20) -> None:
+        if workers < 1 or chunk_size < 1:
+            raise Exception("workers and chunk_size must be at least 1")
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.min_parallel_items = min_parallel_items
+        self._executor = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Spawned workers do not inherit locks held by the fetcher threads
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return(self._executor)
+
+    def parse(self, collection: str, raw_items: list) -> list:
+        if collection not in parsers:
+            raise Exception("Collection not recognized")
+        if len(raw_items) < self.min_parallel_items or self.workers == 1:
+            return(_parse_chunk(collection, raw_items))
+        chunk_size = min(self.chunk_size, -(-len(raw_items) // self.workers))
+        chunks = [raw_items[start:start + chunk_size] for start in range(0, len(raw_items), chunk_size)]
+        parsed_items = []
+        for parsed_chunk in self._get_executor().map(_parse_chunk, [collection] * len(chunks), chunks):
+            parsed_items.extend(parsed_chunk)
+        return(parsed_items)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+def parallel_parser_from_env(environ: dict) -> Optional[ParallelParser]:
+    """
+    ParallelParser configured by PTV_PARSE_WORKERS, PTV_PARSE_CHUNK_SIZE and
+    PTV_PARSE_MIN_PARALLEL, or None when PTV_PARSE_WORKERS is not set
+    """
+    workers = int(environ.get("PTV_PARSE_WORKERS", "0"))
+    if workers < 1:
+        return(None)
+    return(ParallelParser(workers,
+                          int(environ.get("PTV_PARSE_CHUNK_SIZE", "200")),
+                          int(environ.get("PTV_PARSE_MIN_PARALLEL", "20"))))
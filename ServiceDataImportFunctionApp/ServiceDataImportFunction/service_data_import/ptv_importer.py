@@ -5,15 +5,29 @@ Created on Wed Jun  2 09:40:06 2021
 @author: joonas.itkonen
 """
 import os
-from pymongo import MongoClient, DESCENDING
+from pymongo import MongoClient, ASCENDING, DESCENDING, ReplaceOne
 import requests
 import json
 import time
 import urllib
 import math
-import pickle
-from datetime import datetime, timezone
-from typing import Optional
+from pymongo.errors import OperationFailure
+from datetime import datetime, timezone, timedelta
+from typing import Callable, Optional
+from .async_fetch import AsyncPTVFetcher
+from .paging import PagedIdIterator, latest_modified, merge_listings, prefetch_map
+from .service_parser import parse_service_info
+from .channel_parser import parse_channel_info
+from .parallel_parse import ParallelParser, parallel_parser_from_env
+from .hashing import content_hash
+from .checkpoint import ImportCheckpoint
+from .http_cache import CachingSession
+from .suitability import SuitabilityFilter
+from .adaptive import AdaptiveController, AdaptiveSession, UrlTooLongError
+from .metrics import MeteredSession, RunMetrics
+from .snapshot import RawSnapshot
+from .leases import LeaseLost, ShardCoordinator
+from .codes import CodeDictionary
 API = "https://api.palvelutietovaranto.suomi.fi/api/v11"
 municipality_names = ["Aura", "Kaarina", "Kemiönsaari", "Koski Tl", "Kustavi", "Laitila",
                       "Lieto", "Loimaa", "Marttila", "Masku", "Mynämäki", "Naantali", "Nousiainen",
@@ -21,6 +35,17 @@ municipality_names = ["Aura", "Kaarina", "Kemiönsaari", "Koski Tl", "Kustavi",
                       "Salo", "Sauvo", "Somero", "Taivassalo", "Turku", "Uusikaupunki", "Vehmaa"]
 suitable_target_groups = ['KR1', 'KR1.2']
 nonsuitable_target_groups = ['KR1.1', 'KR1.3', 'KR1.4', 'KR1.5', 'KR1.6']
+fetch_engines = ['sync', 'async']
+# Service listings of the whole country, the province or every municipality of the region, 'auto' uses the cheapest measured one
+fetch_strategies = ['country', 'province', 'municipality', 'auto']
+sync_source = "ptv"
+write_modes = ['upsert', 'delete_insert']
+output_modes = ['denormalised', 'normalised']
+# Indexes the importer relies on, ( field, unique ) per collection
+collection_indexes = {'services': [('id', True), ('lastUpdated', False)],
+                      'channels': [('id', True), ('lastUpdated', False)],
+                      'municipalities': [('id', True)],
+                      'codes': [('id', True)]}
 
 class PTVImporter():
     """
@@ -32,7 +57,52 @@ class PTVImporter():
         MongoDB client where service data is stored
 
     api_session : requests.Session ( default None )
-        A requests session to send requests to PTV API
+        A requests session to send requests to PTV API. Wrapped in a CachingSession when PTV_HTTP_CACHE_DIR is set
+
+    engine : str ( default None )
+        Fetch engine, 'sync' or 'async'. Read from PTV_FETCH_ENGINE if not given, defaults to 'sync'. Streaming, checkpointed and sharded runs fetch with prefetch threads and only support 'sync'
+
+    max_in_flight : int ( default None )
+        Maximum concurrent requests of the async engine. Read from PTV_MAX_IN_FLIGHT if not given, defaults to 8
+
+    streaming : bool ( default None )
+        Fetch, parse, filter and store one batch at a time. Read from PTV_STREAMING if not given, defaults to False
+
+    batches_in_flight : int ( default None )
+        Maximum number of raw batches held in memory in streaming mode. Read from PTV_BATCHES_IN_FLIGHT if not given, defaults to 2
+
+    parallel_parser : ParallelParser ( default None )
+        Process pool used to parse raw batches. Built from PTV_PARSE_WORKERS if not given, parsing is done in-process if that is not set either
+
+    write_mode : str ( default None )
+        How incremental runs write, 'upsert' or 'delete_insert'. Read from PTV_WRITE_MODE if not given, defaults to 'upsert'
+
+    checkpointed : bool ( default None )
+        Stream in stages and persist progress after every batch so an interrupted run resumes. Read from PTV_CHECKPOINTS if not given, defaults to False
+
+    api_url : str ( default None )
+        Base url of PTV API. Read from PTV_API_URL if not given, defaults to API
+
+    controller : AdaptiveController ( default None )
+        Sizes concurrency and guid batches and retries failed requests. Built when PTV_ADAPTIVE is true if not given, otherwise batches have 100 guids
+
+    snapshot_dir : str ( default None )
+        Directory where raw services and channels of every run are snapshotted. Read from PTV_SNAPSHOT_DIR if not given, no snapshots by default. Runs beyond the last PTV_SNAPSHOT_KEEP_RUNS ( default 10 ) or older than PTV_SNAPSHOT_MAX_AGE_DAYS ( default 30 ) are removed
+
+    reconcile : bool ( default None )
+        Delete stored services and channels missing from the full PTV listings after incremental runs. Read from PTV_RECONCILE if not given, defaults to False
+
+    refetch_day : str ( default None )
+        Day of the month of the full refetch, 'never' for none. Read from PTV_REFETCH_DAY if not given, defaults to '1'
+
+    sharded : bool ( default None )
+        Share the guid batches of a run with other replicas through leases in Mongo. Read from PTV_SHARDED if not given, defaults to False
+
+    output_mode : str ( default None )
+        Shape of stored documents, 'denormalised' or 'normalised' with code names in the codes collection. Read from PTV_OUTPUT_MODE if not given, defaults to 'denormalised'
+
+    fetch_strategy : str ( default None )
+        How services are listed, 'country', 'province', 'municipality' or 'auto' for the cheapest one that misses no suitable service. Read from PTV_FETCH_STRATEGY if not given, defaults to 'country'
 
 
     Methods
@@ -43,18 +113,75 @@ class PTVImporter():
     remove_old_from_mongo( collection: str, delete_ids: list )
         Delete elements from Mongo collection
 
+    upsert_to_mongo( collection: str, to_upsert: list, chunk_size: int )
+        Replace or insert elements by id with chunked unordered bulk writes
+
+    prepare_for_storage( collection: str, items: list )
+        Normalise parsed elements and store their codes when the output mode is normalised
+
+    store_to_staging( collection: str, to_store: list )
+        Store a full refetch into an empty staging collection and index it
+
+    swap_in_staging( collection: str )
+        Copy the live collection to previous generation and rename the staging collection over it
+
+    swap_in_staging_together( collections: list )
+        Swap in the staging collections, rolling back the swapped ones if a later swap fails
+
+    rollback_collection( collection: str )
+        Bring the previous generation of a collection back
+
+    ensure_indexes()
+        Create the indexes the importer relies on and verify that they exist
+
     get_latest_update_time_from_mongo( collection: str )
         Get latest update time of services or channels from Mongo
+
+    get_sync_watermark( entity: str )
+        Get the PTV modification time up to which services or channels are synced
+
+    get_stored_output_mode()
+        Get the output mode the stored services and channels are in
+
+    commit_output_mode()
+        Record the output mode after a run has stored everything in it
+
+    commit_sync_watermark( entity: str, watermark: datetime )
+        Store the sync watermark of services or channels after a successful store
         
     update_municipalities_in_mongo( municipalities: list )
         Replace current municipality list in Mongo with a new updated one
         
-    import_services()
-        Run the whole process to check new or changed services in Varsinais-Suomi and update the current state in Mongo
+    import_services( engine: str, join_only: bool )
+        Run the whole process to check new or changed services in Varsinais-Suomi and update the current state in Mongo, with join_only only help with a sharded run that is already running
+
+    import_services_streaming()
+        Same as import_services but every batch is stored before the next ones are fetched
+
+    import_services_checkpointed()
+        Same as import_services_streaming but resumes an interrupted run from its last completed batch
+
+    measure_fetch_strategies()
+        List services with every fetch strategy, store their costs and choose the cheapest one that misses no suitable service
+
+    reconcile_deletions()
+        Delete stored services and channels that are no longer listed in PTV, without fetching any details
+
+    start_sharded_run()
+        Start a sharded run for the shard workers to join, or return the one that is running
+
+    import_services_sharded( join_only: bool )
+        Same as import_services_streaming but the guids are split into shards that replicas claim with leases, with join_only no run is started
+
+    refresh( service_ids: list, channel_ids: list )
+        Fetch, parse, filter and upsert only the given services and channels
+
+    import_from_snapshot( snapshot: RawSnapshot, chunk_size: int )
+        Parse, filter and store services and channels of a raw snapshot without fetching anything
 
     """
     
-    def __init__(self, mongo_client: Optional[MongoClient] = None, api_session: Optional[requests.Session] = None) -> None:
+    def __init__(self, mongo_client: Optional[MongoClient] = None, api_session: Optional[requests.Session] = None, engine: Optional[str] = None, max_in_flight: Optional[int] = None, streaming: Optional[bool] = None, batches_in_flight: Optional[int] = None, parallel_parser: Optional[ParallelParser] = None, write_mode: Optional[str] = None, checkpointed: Optional[bool] = None, controller: Optional[AdaptiveController] = None, api_url: Optional[str] = None, snapshot_dir: Optional[str] = None, reconcile: Optional[bool] = None, refetch_day: Optional[str] = None, sharded: Optional[bool] = None, output_mode: Optional[str] = None, fetch_strategy: Optional[str] = None) -> None:
         if mongo_client is None:
             self.mongo_client = MongoClient("mongodb://{}:{}@{}:{}/{}".format(
                 os.environ.get("MONGO_USERNAME"),
@@ -72,6 +199,8 @@ class PTVImporter():
         else:
             self.mongo_client = mongo_client
         
+        self.api_url = api_url if api_url is not None else os.environ.get("PTV_API_URL", API)
+
         # Init DB api session
         if api_session is None:
             self.api_session = requests.Session()
@@ -83,32 +212,179 @@ class PTVImporter():
                                    }
         else:
             self.api_session = api_session
-        self.municipalities = self._get_municipalities()
-        self.provinces = self._get_provinces('Varsinais-Suomi')
 
-    def _write_pickle(self, services: list) -> None:
-        with open('service_data.pkl', 'wb') as output:
-            pickle.dump(services, output, pickle.HIGHEST_PROTOCOL)
-            
-    def _read_pickle(self) -> list:
-        with open('service_data.pkl', 'rb') as input:
-            services_1 = pickle.load(input)
-        return(services_1)
-    
-    def _get_provinces(self, region_name: str) -> list:
-        endpoint = "/CodeList/GetAreaCodes/type/Province"
-        url = API + endpoint
+        # Requests and downloaded bytes are counted closest to the wire, after retries and cache hits
+        self.meter = MeteredSession(self.api_session)
+        self.api_session = self.meter
+        self.metrics = RunMetrics.from_env(os.environ, self.meter)
+
+        self.max_in_flight = max_in_flight if max_in_flight is not None else int(os.environ.get("PTV_MAX_IN_FLIGHT", "8"))
+
+        # Optional adaptive concurrency, batch sizes and retries, inside the cache so that cache hits are not throttled
+        if controller is None and os.environ.get("PTV_ADAPTIVE", "false").lower() == "true":
+            controller = AdaptiveController(max_in_flight=self.max_in_flight, max_url_length=int(os.environ.get("PTV_MAX_URL_LENGTH", "8000")))
+        self.controller = controller
+        if self.controller is not None:
+            self.api_session = AdaptiveSession(self.api_session, self.controller)
+
+        # Optional on-disk cache of PTV responses, code lists are then read from disk on warm starts, unless the caller gave a cache
+        cache_dir = os.environ.get("PTV_HTTP_CACHE_DIR")
+        if cache_dir and not isinstance(api_session, CachingSession):
+            self.api_session = CachingSession(self.api_session, cache_dir)
+
+        # Fetch engine, either blocking calls one after another or concurrent asyncio calls
+        self.engine = engine if engine is not None else os.environ.get("PTV_FETCH_ENGINE", "sync")
+        if self.engine not in fetch_engines:
+            raise Exception("Fetch engine not recognized")
+        self.async_fetcher = AsyncPTVFetcher(self.api_session, self.max_in_flight)
+
+        # Streaming mode stores every fetched batch before holding more than batches_in_flight batches in memory
+        self.streaming = streaming if streaming is not None else os.environ.get("PTV_STREAMING", "false").lower() == "true"
+        self.batches_in_flight = batches_in_flight if batches_in_flight is not None else int(os.environ.get("PTV_BATCHES_IN_FLIGHT", "2"))
+
+        # Optional process pool for parsing, configured by PTV_PARSE_WORKERS if not given
+        self.parallel_parser = parallel_parser if parallel_parser is not None else parallel_parser_from_env(os.environ)
+
+        self.write_mode = write_mode if write_mode is not None else os.environ.get("PTV_WRITE_MODE", "upsert")
+        if self.write_mode not in write_modes:
+            raise Exception("Write mode not recognized")
+        self.upsert_chunk_size = int(os.environ.get("PTV_UPSERT_CHUNK_SIZE", "500"))
+
+        # Checkpointed runs keep their progress in import_runs and import_run_batches, unfinished runs older than the max age are abandoned
+        self.checkpointed = checkpointed if checkpointed is not None else os.environ.get("PTV_CHECKPOINTS", "false").lower() == "true"
+        self.checkpoint_max_age = timedelta(hours=float(os.environ.get("PTV_CHECKPOINT_MAX_AGE_HOURS", "24")))
+
+        # Optional raw snapshots of fetched services and channels, one subdirectory per run, older runs are pruned when a run starts
+        self.snapshot_dir = snapshot_dir if snapshot_dir is not None else os.environ.get("PTV_SNAPSHOT_DIR")
+        self.snapshot = None
+        self.snapshot_keep_runs = int(os.environ.get("PTV_SNAPSHOT_KEEP_RUNS", "10"))
+        self.snapshot_max_age_days = float(os.environ.get("PTV_SNAPSHOT_MAX_AGE_DAYS", "30"))
+
+        # Deletion reconciliation keeps incremental runs free of withdrawn items, so the full refetch can be rare or off
+        self.reconcile = reconcile if reconcile is not None else os.environ.get("PTV_RECONCILE", "false").lower() == "true"
+        self.reconcile_max_share = float(os.environ.get("PTV_RECONCILE_MAX_SHARE", "0.2"))
+        refetch_day = refetch_day if refetch_day is not None else os.environ.get("PTV_REFETCH_DAY", "1")
+        self.refetch_day = None if str(refetch_day).lower() in ["", "0", "never"] else int(refetch_day)
+
+        # Sharded runs split the guid batches between replicas, a task of a replica that stops heartbeating is claimed again
+        self.sharded = sharded if sharded is not None else os.environ.get("PTV_SHARDED", "false").lower() == "true"
+        self.shard_size = int(os.environ.get("PTV_SHARD_SIZE", "500"))
+        self.lease_seconds = float(os.environ.get("PTV_LEASE_SECONDS", "300"))
+        self.shard_poll_seconds = float(os.environ.get("PTV_SHARD_POLL_SECONDS", "5"))
+        # Number of shard workers woken up for a run, KEDA scales the replicas on their messages
+        self.shard_workers = int(os.environ.get("PTV_SHARD_WORKERS", "4"))
+        self.shard_max_attempts = int(os.environ.get("PTV_SHARD_MAX_ATTEMPTS", "3"))
+
+        # Normalised documents carry codes only, their names are kept once per code in the codes collection
+        self.output_mode = output_mode if output_mode is not None else os.environ.get("PTV_OUTPUT_MODE", "denormalised")
+        if self.output_mode not in output_modes:
+            raise Exception("Output mode not recognized")
+        self.codes = CodeDictionary()
+
+        # Services can be listed for the whole country and filtered locally, or listed by area so that fewer are fetched
+        self.fetch_strategy = fetch_strategy if fetch_strategy is not None else os.environ.get("PTV_FETCH_STRATEGY", "country")
+        if self.fetch_strategy not in fetch_strategies:
+            raise Exception("Fetch strategy not recognized")
+        self.strategy_max_age = timedelta(days=float(os.environ.get("PTV_STRATEGY_MAX_AGE_DAYS", "30")))
+        self.active_fetch_strategy = None
+
+        self.skipped = {'services': {'parse': 0, 'write': 0, 'fetch': 0}, 'channels': {'parse': 0, 'write': 0, 'fetch': 0}}
+        # Item counts of the latest listings and latest modification times of the fetched details
+        self.listings = {}
+        self.fetched_modified = {}
+
+        self.ensure_indexes()
+
+        if self.engine == "async":
+            raw_municipalities, raw_provinces = self.async_fetcher.run(self.async_fetcher.get_many([self._municipality_codes_url(), self._province_codes_url()]))
+        else:
+            raw_municipalities = self._get_json(self._municipality_codes_url())
+            raw_provinces = self._get_json(self._province_codes_url())
+        # Raw code lists are kept for snapshots, so that a snapshot can be replayed without PTV API
+        self.raw_code_lists = {'municipalities': raw_municipalities, 'provinces': raw_provinces}
+        self.municipalities = self._parse_municipalities(raw_municipalities)
+        self.provinces = self._parse_provinces(raw_provinces, 'Varsinais-Suomi')
+        self.suitability = SuitabilityFilter.from_regions(self.municipalities, self.provinces, suitable_target_groups)
+
+    def _start_snapshot(self, run_id: Optional[str] = None) -> None:
+        self.snapshot = RawSnapshot(self.snapshot_dir, run_id)
+        self.snapshot.write('code_lists', [{'id': name, 'items': raw_code_list} for name, raw_code_list in self.raw_code_lists.items()])
+        pruned = RawSnapshot.prune(self.snapshot_dir, self.snapshot_keep_runs, self.snapshot_max_age_days, [self.snapshot.run_id])
+        if len(pruned) > 0:
+            print(len(pruned), "old raw snapshots removed.")
+
+    def _track_modified(self, collection: str, raw_items: list) -> None:
+        # Listings do not tell when items were modified, the fetched details do
+        self.fetched_modified[collection] = latest_modified(raw_items, self.fetched_modified.get(collection))
+
+    def _snapshot_raw(self, collection: str, raw_items: list) -> None:
+        if self.snapshot is not None:
+            self.snapshot.write(collection, raw_items)
+
+    def _get_snapshotted_batch_json(self, collection: str, url: str) -> list:
+        # Batches are snapshotted as they arrive, so the snapshot keeps what a failed run fetched
+        raw_batch = self._get_batch_json(url)
+        self._snapshot_raw(collection, raw_batch)
+        return(raw_batch)
+
+    def _get_json(self, url: str):
         response = self.api_session.get(url=url)
-        vs_region = [region for region in response.json() if region_name in [language_el.get('value') for language_el in region.get('names') if language_el.get('language') == 'fi']]
+        return(response.json())
+
+    def _date_parameter(self, lu_time: Optional[datetime] = None) -> str:
+        if lu_time is None:
+            return("")
+        return("&date=" + urllib.parse.quote_plus(lu_time.strftime("%Y-%m-%dT%H:%M:%S")))
+
+    def _iter_batch_urls(self, endpoint: str, guids: list, start_index: int = 0):
+        return(self._iter_guid_urls(self.api_url + endpoint + "?showHeader=true&guids=", guids, start_index))
+
+    def _iter_guid_urls(self, base_url: str, guids: list, start_index: int = 0):
+        # Batch sizes are asked from the controller when the batch is needed, so they follow it during a run
+        while start_index < len(guids):
+            batch_size = 100 if self.controller is None else self.controller.batch_count(base_url, guids[start_index:])
+            end_index = start_index + batch_size
+            yield (end_index, base_url + urllib.parse.quote_plus(','.join(guids[start_index:end_index])))
+            start_index = end_index
+
+    def _get_batch_json(self, url: str) -> list:
+        try:
+            return(self._get_json(url))
+        except UrlTooLongError:
+            base_url, quoted_guids = url.split("guids=", 1)
+            guids = urllib.parse.unquote_plus(quoted_guids).split(',')
+            if len(guids) < 2:
+                raise
+            # The controller has lowered its url cap, the batch is sent again in parts under it
+            print("Batch of", len(guids), "guids was rejected as too long, sending it in parts.")
+            documents = []
+            for end_index, part_url in self._iter_guid_urls(base_url + "guids=", guids):
+                documents.extend(self._get_batch_json(part_url))
+            return(documents)
+
+    def _province_codes_url(self) -> str:
+        return(self.api_url + "/CodeList/GetAreaCodes/type/Province")
+
+    def _municipality_codes_url(self) -> str:
+        return(self.api_url + "/CodeList/GetMunicipalityCodes")
+
+    def _service_list_url(self, lu_time: Optional[datetime] = None) -> str:
+        return(self.api_url + "/Service?page={}" + self._date_parameter(lu_time))
+
+    def _service_channel_list_url(self, lu_time: Optional[datetime] = None) -> str:
+        return(self.api_url + "/ServiceChannel/area/Province/code/" + self.provinces[0].get('code') + "?includeWholeCountry=true&page={}" + self._date_parameter(lu_time))
+
+    def _parse_provinces(self, raw_provinces: list, region_name: str) -> list:
+        vs_region = [region for region in raw_provinces if region_name in [language_el.get('value') for language_el in region.get('names') if language_el.get('language') == 'fi']]
         return(vs_region)
-    
-    def _get_municipalities(self) -> list:
-        endpoint = "/CodeList/GetMunicipalityCodes"
-        url = API + endpoint
+
+    def _get_provinces(self, region_name: str) -> list:
+        return(self._parse_provinces(self._get_json(self._province_codes_url()), region_name))
+
+    def _parse_municipalities(self, raw_municipalities: list) -> list:
         all_municipalities = []
-        response = self.api_session.get(url=url)
         languages = ['en', 'fi', 'sv']
-        for municipality in response.json():
+        for municipality in raw_municipalities:
             names = {'en': None, 'fi': None, 'sv': None}
             code = municipality.get('code')
             for language in languages:
@@ -120,461 +396,262 @@ class PTVImporter():
                 all_municipalities.append(mun)
         return(all_municipalities)
 
-    def _get_all_service_guids(self, lu_time: Optional[datetime] = None) -> list:
-        
-        endpoint = "/Service?page={}"
-        if lu_time is not None:
-            endpoint = endpoint + "&date=" + urllib.parse.quote_plus(lu_time.strftime("%Y-%m-%dT%H:%M:%S"))
-        url = API + endpoint.format("1")
-        service_guids = []
-        response = self.api_session.get(url=url)
-        item_list = response.json().get('itemList')
-        if item_list is not None and len(item_list) > 0:
-            service_guids = service_guids + item_list
-        page_count = response.json().get('pageCount')
-        if page_count > 1:
-            for page in range(2, page_count + 1):
-                url = API + endpoint.format(str(page))   
-                response = self.api_session.get(url=url)
-                service_guids = service_guids + response.json().get('itemList')
-        guids = [service_guid.get('id') for service_guid in service_guids]
-        guids = list(set(guids))
+    def _get_municipalities(self) -> list:
+        return(self._parse_municipalities(self._get_json(self._municipality_codes_url())))
+
+    def _iter_paged_ids(self, url_template: str, seen: Optional[set] = None) -> PagedIdIterator:
+        return(PagedIdIterator(self._get_json, url_template, self.max_in_flight, seen))
+
+    def _collect_ids(self, url_templates: list) -> tuple:
+        # Listings are fetched concurrently and their ids deduplicated in listing order
+        iterators = [self._iter_paged_ids(url_template) for url_template in url_templates]
+        listings = prefetch_map(lambda iterator: (list(iterator), iterator.item_count), iterators, self.max_in_flight if len(iterators) > 1 else 1)
+        return(merge_listings(list(listings)))
+
+    def _list_ids(self, entity: str, url_template: str) -> list:
+        return(self._list_ids_of_all(entity, [url_template]))
+
+    def _list_ids_of_all(self, entity: str, url_templates: list) -> list:
+        with self.metrics.stage('listing', entity) as stage:
+            guids, item_count = self._collect_ids(url_templates)
+            self.listings[entity] = {'items': item_count}
+            stage['documents_in'] = item_count
+            stage['documents_out'] = len(guids)
         return(guids)
 
-    def _get_all_service_guids_by_province(self, lu_time: Optional[datetime] = None, include_whole_country: bool = True) -> list:
-        
+    def _service_area_list_url(self, area_type: str, code: str, include_whole_country: bool = True, lu_time: Optional[datetime] = None) -> str:
         include_whole_country_str = "true" if include_whole_country else "false"
-        endpoint = "/Service/area/Province/code/{}?includeWholeCountry={}&page={}"
-        vs_region = self.provinces
-        if lu_time is not None:
-            endpoint = endpoint + "&date=" + urllib.parse.quote_plus(lu_time.strftime("%Y-%m-%dT%H:%M:%S"))
-        url = API + endpoint.format(vs_region[0].get('code'), include_whole_country_str, "1")
-        service_guids = []
-        response = self.api_session.get(url=url)
-        item_list = response.json().get('itemList')
-        if item_list is not None and len(item_list) > 0:
-            service_guids = service_guids + item_list
-        page_count = response.json().get('pageCount')
-        if page_count > 1:
-            for page in range(2, page_count + 1):
-                url = API + endpoint.format(vs_region[0].get('code'), include_whole_country_str, str(page))   
-                response = self.api_session.get(url=url)
-                service_guids = service_guids + response.json().get('itemList')
-        guids = [service_guid.get('id') for service_guid in service_guids]
-        guids = list(set(guids))
-        return(guids)
+        return(self.api_url + "/Service/area/" + area_type + "/code/" + code + "?includeWholeCountry=" + include_whole_country_str + "&page={}" + self._date_parameter(lu_time))
+
+    def _service_list_urls(self, strategy: str, lu_time: Optional[datetime] = None) -> list:
+        if strategy == "country":
+            return([self._service_list_url(lu_time)])
+        elif strategy == "province":
+            return([self._service_area_list_url('Province', self.provinces[0].get('code'), True, lu_time)])
+        elif strategy == "municipality":
+            # Services of the whole country would be listed again for every municipality, so only the first listing includes them
+            return([self._service_area_list_url('Municipality', municipality.get('id'), index == 0, lu_time) for index, municipality in enumerate(self.municipalities)])
+        else:
+            raise Exception("Fetch strategy not recognized")
+
+    def _get_all_service_guids(self, lu_time: Optional[datetime] = None) -> list:
+        return(self._list_ids_of_all('services', self._service_list_urls(self._service_fetch_strategy(), lu_time)))
+
+    def _get_all_service_guids_by_province(self, lu_time: Optional[datetime] = None, include_whole_country: bool = True) -> list:
+        return(self._collect_ids([self._service_area_list_url('Province', self.provinces[0].get('code'), include_whole_country, lu_time)])[0])
     
     def _get_all_service_guids_by_municipalities(self, lu_time: Optional[datetime] = None, include_whole_country: bool = True) -> list:
-        
-        include_whole_country_str = "true" if include_whole_country else "false"
-        endpoint = "/Service/area/Municipality/code/{}?includeWholeCountry={}&page={}"
-        if lu_time is not None:
-            endpoint = endpoint + "&date=" + urllib.parse.quote_plus(lu_time.strftime("%Y-%m-%dT%H:%M:%S"))
-        municipality_codes = [mun.get('id') for mun in self.municipalities]
-        service_guids = []
-        for mun_code in municipality_codes:
-            url = API + endpoint.format(mun_code, include_whole_country_str, "1")
-
-            response = self.api_session.get(url=url)
-            item_list = response.json().get('itemList')
-            if item_list is not None and len(item_list) > 0:
-                service_guids = service_guids + item_list
-            page_count = response.json().get('pageCount')
-            if page_count > 1:
-                for page in range(2, page_count + 1):
-                    url = API + endpoint.format(mun_code, include_whole_country_str, str(page))   
-                    response = self.api_session.get(url=url)
-                    service_guids = service_guids + response.json().get('itemList')
-        guids = [service_guid.get('id') for service_guid in service_guids]
-        guids = list(set(guids))
-        return(guids)
-                
+        return(self._collect_ids([self._service_area_list_url('Municipality', municipality.get('id'), include_whole_country, lu_time) for municipality in self.municipalities])[0])
+
+    def _service_fetch_strategy(self) -> str:
+        if self.fetch_strategy != "auto":
+            return(self.fetch_strategy)
+        if self.active_fetch_strategy is None:
+            latest = list(self.mongo_client.service_db.import_strategies.find({}, {'_id': 0}).sort('measured', DESCENDING).limit(1))
+            if len(latest) > 0 and latest[0].get('strategy') in fetch_strategies and latest[0]['measured'] > datetime.utcnow() - self.strategy_max_age:
+                self.active_fetch_strategy = latest[0]['strategy']
+            else:
+                self.active_fetch_strategy = self.measure_fetch_strategies()['strategy']
+            print("Services are listed by", self.active_fetch_strategy)
+        return(self.active_fetch_strategy)
+
+    def measure_fetch_strategies(self) -> dict:
+        strategies = [strategy for strategy in fetch_strategies if strategy != "auto"]
+        measured = {}
+        listed = {}
+        for strategy in strategies:
+            with self.metrics.stage('measuring', strategy) as stage:
+                requests_before = self.meter.requests
+                bytes_before = self.meter.bytes
+                listed[strategy] = self._collect_ids(self._service_list_urls(strategy))[0]
+                measured[strategy] = {'guids': len(listed[strategy]), 'listingRequests': self.meter.requests - requests_before,
+                                      'listingBytes': self.meter.bytes - bytes_before}
+                stage['documents_out'] = len(listed[strategy])
+        # Only services that some strategy leaves out can make the final sets differ, so only they are fetched
+        country_guids = set(listed['country'])
+        left_out = {strategy: country_guids.difference(listed[strategy]) for strategy in strategies}
+        to_check = sorted(set().union(*left_out.values()))
+        with self.metrics.stage('measuring', 'services') as stage:
+            stage['documents_in'] = len(to_check)
+            bytes_before = self.meter.bytes
+            raw_services = self._get_services(to_check)
+            bytes_per_service = (self.meter.bytes - bytes_before) / len(raw_services) if len(raw_services) > 0 else 0
+            suitable_ids = set(service.get('id') for service in (self._parse_service_info(raw_service) for raw_service in raw_services) if self._is_suitable_service(service))
+            stage['documents_out'] = len(suitable_ids)
+        for strategy in strategies:
+            measured[strategy]['missedSuitable'] = len(suitable_ids.intersection(left_out[strategy]))
+            measured[strategy]['detailRequests'] = math.ceil(measured[strategy]['guids'] / 100)
+            measured[strategy]['estimatedBytes'] = measured[strategy]['listingBytes'] + int(measured[strategy]['guids'] * bytes_per_service)
+            print("{}: {} services, {} listing requests, {} listing bytes, about {} bytes in total, {} suitable services missed.".format(
+                strategy, measured[strategy]['guids'], measured[strategy]['listingRequests'], measured[strategy]['listingBytes'],
+                measured[strategy]['estimatedBytes'], measured[strategy]['missedSuitable']))
+        # The whole country listing misses nothing by definition
+        complete = [strategy for strategy in strategies if measured[strategy]['missedSuitable'] == 0]
+        chosen = min(complete, key=lambda strategy: measured[strategy]['estimatedBytes'])
+        measurement = {'measured': datetime.utcnow(), 'strategy': chosen, 'strategies': measured}
+        self.mongo_client.service_db.import_strategies.insert_one(dict(measurement))
+        print("Fetch strategy", chosen, "chosen.")
+        return(measurement)
                 
-    def _get_services(self, guids: list) -> list:
-        endpoint = "/Service/serviceWithGD/list"
+    def _get_services(self, guids: list, get_batch: Optional[Callable[[str], list]] = None) -> list:
+        get_batch = get_batch if get_batch is not None else self._get_batch_json
         services = []
-        batches = math.ceil(len(guids)/100)
-        for batch in range(0, batches):
-            start_index = batch*100
-            end_index = (batch+1)*100
-            url = API + endpoint + "?showHeader=true&guids=" + urllib.parse.quote_plus(','.join(guids[start_index:end_index]))
-            response = self.api_session.get(url=url)  
-            services = services + response.json()
+        for end_index, url in self._iter_batch_urls("/Service/serviceWithGD/list", guids):
+            services.extend(get_batch(url))
         return(services)
     
     
     def _get_service_channel_ids(self, lu_time: Optional[datetime] = None) -> list:
-        
-        endpoint = "/ServiceChannel/area/Province/code/{}?includeWholeCountry=true&page={}"
-        vs_region = self.provinces
-        if lu_time is not None:
-            endpoint = endpoint + "&date=" + urllib.parse.quote_plus(lu_time.strftime("%Y-%m-%dT%H:%M:%S"))
-        url = API + endpoint.format(vs_region[0].get('code'), "1")
-        channel_guids = []
-        response = self.api_session.get(url=url)
-        item_list = response.json().get('itemList')
-        if item_list is not None and len(item_list) > 0:
-            channel_guids = channel_guids + item_list
-        page_count = response.json().get('pageCount')
-        if page_count > 1:
-            for page in range(2, page_count + 1):
-                url = API + endpoint.format(vs_region[0].get('code'), str(page)) 
-                response = self.api_session.get(url=url)
-                channel_guids = channel_guids + response.json().get('itemList')
-        guids = [channel_guid.get('id') for channel_guid in channel_guids]
-        guids = list(set(guids))
-        return(guids)
+        return(self._list_ids('channels', self._service_channel_list_url(lu_time)))
            
-    def _get_service_channels(self, channel_ids: list) -> list:
-        endpoint = "/ServiceChannel/list"
+    def _changed_channel_ids(self, lu_time: datetime) -> set:
+        with self.metrics.stage('listing', 'changed_channels') as stage:
+            iterator = self._iter_paged_ids(self.api_url + "/ServiceChannel?page={}" + self._date_parameter(lu_time))
+            changed_ids = set(iterator)
+            stage['documents_in'] = iterator.item_count
+            stage['documents_out'] = len(changed_ids)
+        return(changed_ids)
+
+    def _referenced_channel_guids(self, referenced_ids: list, listed_guids: list, lu_time: Optional[datetime]) -> list:
+        # Channels outside the listing are fetched only when missing or changed since the last sync
+        listed = set(listed_guids)
+        candidates = sorted(set(channel_id for channel_id in referenced_ids if channel_id not in listed))
+        if lu_time is None:
+            return(candidates)
+        requests_before = self.meter.requests
+        changed_ids = self._changed_channel_ids(lu_time)
+        stored_ids = set(self._stored_hashes('channels', candidates))
+        referenced_to_fetch = [channel_id for channel_id in candidates if channel_id not in stored_ids or channel_id in changed_ids]
+        skipped_count = len(candidates) - len(referenced_to_fetch)
+        avoided_requests = math.ceil((len(listed) + len(candidates)) / 100) - math.ceil((len(listed) + len(referenced_to_fetch)) / 100)
+        self.skipped['channels']['fetch'] = self.skipped['channels']['fetch'] + skipped_count
+        print(skipped_count, "unchanged referenced channels not fetched, about", avoided_requests, "batch requests avoided for", self.meter.requests - requests_before, "listing requests.")
+        # Stored channels that changed are fetched even when no changed service refers to them
+        changed_stored_ids = sorted(self._stored_hashes('channels', sorted(changed_ids.difference(listed, referenced_to_fetch))))
+        return(referenced_to_fetch + changed_stored_ids)
+
+    def _get_service_channels(self, channel_ids: list, get_batch: Optional[Callable[[str], list]] = None) -> list:
+        get_batch = get_batch if get_batch is not None else self._get_batch_json
         channels = []
-        batches = math.ceil(len(channel_ids)/100)
-        for batch in range(0, batches):
-            start_index = batch*100
-            end_index = (batch+1)*100
-            url = API + endpoint + "?showHeader=true&guids=" + urllib.parse.quote_plus(','.join(channel_ids[start_index:end_index]))
-            response = self.api_session.get(url=url)  
-            channels = channels + response.json()
+        for end_index, url in self._iter_batch_urls("/ServiceChannel/list", channel_ids):
+            channels.extend(get_batch(url))
         return(channels)
-                 
-    def _parse_service_info(self, service: dict) -> dict:
-        service_final = {}
-        service_id = service.get('id')
-        service_final['id'] = service_id
-        service_type = service.get('type')
-        service_final['type'] = service_type
-        service_subtype = service.get('subType')
-        service_final['subtype'] = service_subtype
-        
-        channel_ids = [channel.get('serviceChannel').get('id') for channel in service.get('serviceChannels')]
-        service_final['channelIds'] = channel_ids
-        
-        organizations = service.get('organizations')
-        organization_elements = []
-        for organization in organizations:
-            role_type = organization.get('roleType')
-            if organization.get('organization') is not None:
-                organization_el = organization.get('organization')
-                organization_el['roleType'] = role_type
-                organization_elements.append(organization_el)
+
+    def _fetch_listing_async(self, entity: str, url_templates: list) -> list:
+        with self.metrics.stage('listing', entity) as stage:
+            guids, item_count = self.async_fetcher.run(self.async_fetcher.get_paged_listings(url_templates))
+            self.listings[entity] = {'items': item_count}
+            stage['documents_in'] = item_count
+            stage['documents_out'] = len(guids)
+        return(guids)
+
+    def _fetch_service_guids(self, lu_time: Optional[datetime], engine: str) -> list:
+        if engine == "async":
+            return(self._fetch_listing_async('services', self._service_list_urls(self._service_fetch_strategy(), lu_time)))
+        return(self._get_all_service_guids(lu_time))
+
+    def _fetch_services(self, guids: list, engine: str) -> list:
+        get_batch = lambda url: self._get_snapshotted_batch_json('services', url)
+        with self.metrics.stage('fetching', 'services') as stage:
+            stage['documents_in'] = len(guids)
+            if engine == "async":
+                services = self.async_fetcher.run(self.async_fetcher.get_batched(self._iter_batch_urls("/Service/serviceWithGD/list", guids), get_batch))
             else:
-                if len(organization.get('additionalInformation')) > 0:
-                    org_name = organization.get('additionalInformation')[0]['value']
-                    organization_el = {'name': org_name, 'id': None, 'roleType': role_type}
-                    organization_elements.append(organization_el)
-            
-        service_final['organizations'] = organization_elements
-            
-        
-        languages = ['en', 'fi', 'sv']
-        language_division = {'en': None, 'fi': None, 'sv': None}
-        service_final['name'] = language_division.copy()
-        service_final['descriptions'] = language_division.copy()
-        service_final['requirement'] = language_division.copy()
-        service_final['targetGroups'] = language_division.copy()
-        service_final['serviceClasses'] = language_division.copy()
-        service_final['areas'] = language_division.copy()
-        service_final['lifeEvents'] = language_division.copy()
-        # Divided by language    
-        for language in languages:
-            names = [l_name.get('value') for l_name in [name for name in service.get('serviceNames') if name.get('language') == language]]
-            names = [l_name for l_name in names if l_name is not None]
-            if len(names) > 0:
-                name = ' - '.join(names)
+                services = self._get_services(guids, get_batch)
+            stage['documents_out'] = len(services)
+        self._track_modified('services', services)
+        return(services)
+
+    def _fetch_service_channel_ids(self, lu_time: Optional[datetime], engine: str) -> list:
+        if engine == "async":
+            return(self._fetch_listing_async('channels', [self._service_channel_list_url(lu_time)]))
+        return(self._get_service_channel_ids(lu_time))
+
+    def _fetch_service_channels(self, channel_ids: list, engine: str) -> list:
+        get_batch = lambda url: self._get_snapshotted_batch_json('channels', url)
+        with self.metrics.stage('fetching', 'channels') as stage:
+            stage['documents_in'] = len(channel_ids)
+            if engine == "async":
+                channels = self.async_fetcher.run(self.async_fetcher.get_batched(self._iter_batch_urls("/ServiceChannel/list", channel_ids), get_batch))
             else:
-                name = None
-            service_final['name'][language] = name
-            descriptions = [{'value': l_description.get('value'), 'type': l_description.get('type')} for l_description in [description for description in service.get('serviceDescriptions') if description.get('language') == language]]
-            descriptions = [d for d in descriptions if d['value'] is not None]
-            service_final['descriptions'][language] = descriptions
-            
-            requirements = [l_requirement.get('value') for l_requirement in [requirement for requirement in service.get('requirements') if requirement.get('language') == language]]
-            requirements = [r for r in requirements if r is not None]
-            requirement = " ".join(requirements)
-            service_final['requirement'][language] = requirement
-            
-            # Target groups
-            target_groups = service.get('targetGroups')
-            target_group_elements = []
-            for target_group in target_groups:
-                target_group_names = [l_target_group_name.get('value') for l_target_group_name in [target_group_name for target_group_name in target_group.get('name') if target_group_name.get('language') == language]]
-                target_group_names = [tgn for tgn in target_group_names if tgn is not None]
-                target_group_name = " ".join(target_group_names)
-                target_group_code = target_group.get('code')
-                target_group_el = {"name": target_group_name,
-                                   "code": target_group_code}
-                target_group_elements.append(target_group_el) 
-            service_final['targetGroups'][language] = target_group_elements
-    
-            
-            # Service classes
-            service_classes = service.get('serviceClasses')
-            service_class_elements = []
-            for service_class in service_classes:
-                service_class_names = [l_service_class_name.get('value') for l_service_class_name in [service_class_name for service_class_name in service_class.get('name') if service_class_name.get('language') == language]]
-                service_class_names = [sc_name for sc_name in service_class_names if sc_name is not None]
-                if len(service_class_names) > 0:
-                    service_class_name = ' - '.join(service_class_names)
-                else:
-                    service_class_name = None
-                service_class_descriptions = [l_service_class_description.get('value') for l_service_class_description in [service_class_description for service_class_description in service_class.get('description') if service_class_description.get('language') == language]]
-                service_class_descriptions = [scd for scd in service_class_descriptions if scd is not None]
-                service_class_description = " ".join(service_class_descriptions)
-                service_class_code = service_class.get('code')
-                service_class_el = {"name": service_class_name,
-                                    "description": service_class_description,
-                                    "code": service_class_code}
-                service_class_elements.append(service_class_el)
-            service_final['serviceClasses'][language] = service_class_elements
-                
-            # Areas
-            areas = service.get('areas')
-            area_elements = []
-            for area in areas:
-                area_type = area.get('type')
-                if area.get('type') == 'Municipality':
-                    area = area.get('municipalities')[0]
-                area_code = area.get('code')
-                area_names = [l_area_name.get('value') for l_area_name in [area_name for area_name in area.get('name') if area_name.get('language') == language]]
-                area_names = [a_name for a_name in area_names if a_name is not None]
-                if len(area_names) > 0:
-                    area_name = ' - '.join(area_names)
-                else:
-                    area_name = None
-                area_el = {"name": area_name,
-                                    "type": area_type,
-                                    "code": area_code}
-                area_elements.append(area_el)
-            service_final['areas'][language] = area_elements
-            
-            # Life events
-            life_events = service.get('lifeEvents')
-            le_elements = []
-            for life_event in life_events:
-                life_event_code = life_event.get('code')
-                life_event_names = [l_life_event_name.get('value') for l_life_event_name in [life_event_name for life_event_name in life_event.get('name') if life_event_name.get('language') == language]]
-                life_event_names = [le_name for le_name in life_event_names if le_name is not None]
-                if len(life_event_names) > 0:
-                    life_event_name = ' - '.join(life_event_names)
-                else:
-                    life_event_name = None
-                life_event_el = {"name": life_event_name,
-                                    "code": life_event_code}
-                le_elements.append(life_event_el)
-            service_final['lifeEvents'][language] = le_elements          
-            
-        return(service_final)
+                channels = self._get_service_channels(channel_ids, get_batch)
+            stage['documents_out'] = len(channels)
+        self._track_modified('channels', channels)
+        return(channels)
+                 
+    def _parse_service_info(self, service: dict) -> dict:
+        return(parse_service_info(service))
 
 
     def _parse_channel_info(self, channel: dict) -> dict:
-        channel_final = {}
-        channel_id = channel.get('id')
-        channel_final['id'] = channel_id
-        channel_type = channel.get('serviceChannelType')
-        channel_final['type'] = channel_type
-        area_type = channel.get('areaType')
-        channel_final['areaType'] = area_type 
-        organization_id = channel.get('organizationId')
-        channel_final['organizationId'] = organization_id
-        
-        service_ids = [service.get('service').get('id') for service in channel.get('services')]
-        channel_final['serviceIds'] = service_ids
-        
-        languages = ['en', 'fi', 'sv']
-        language_division = {'en': None, 'fi': None, 'sv': None}
-        channel_final['name'] = language_division.copy()
-        channel_final['descriptions'] = language_division.copy()
-        channel_final['webPages'] = language_division.copy()
-        channel_final['emails'] = language_division.copy()
-        channel_final['phoneNumbers'] = language_division.copy()
-        channel_final['addresses'] = language_division.copy()
-        channel_final['areas'] = language_division.copy()
-        channel_final['channelUrls'] = language_division.copy()
-        # Divided by language    
-        for language in languages:
-            names = [l_name.get('value') for l_name in [name for name in channel.get('serviceChannelNames') if name.get('language') == language]]
-            names = [l_name for l_name in names if l_name is not None]
-            if len(names) > 0:
-                name = ' - '.join(names)
-            else:
-                name = None
-            channel_final['name'][language] = name
-            
-            if channel.get('serviceChannelDescriptions') is not None:
-                descriptions = [{'value': l_description.get('value'), 'type': l_description.get('type')} for l_description in [description for description in channel.get('serviceChannelDescriptions') if description.get('language') == language]]
-                descriptions = [d for d in descriptions if d['value'] is not None]
-            else:
-                descriptions = []
-            channel_final['descriptions'][language] = descriptions
-            
-            # Web pages
-            if channel.get('webPages') is not None:
-                web_pages = [l_web_page for l_web_page in [web_page for web_page in channel.get('webPages') if web_page.get('language') == language]]
-            else:
-                web_pages = []
-            web_page_elements = []
-            for web_page in web_pages:
-                web_page_url = web_page.get('url')
-                web_page_elements.append(web_page_url)
-            channel_final['webPages'][language] = web_page_elements
-                
-            # Support phones
-            if channel.get('supportPhones') is not None:
-                support_phones = [l_support_phone for l_support_phone in [support_phone for support_phone in channel.get('supportPhones') if support_phone.get('language') == language]]
-            else:
-                support_phones = []
-            if channel.get('phoneNumbers') is not None:
-                support_phones = support_phones + [l_support_phone for l_support_phone in [support_phone for support_phone in channel.get('phoneNumbers') if support_phone.get('language') == language]]
-            
-            support_phone_elements = []
-            for support_phone in support_phones:
-                support_phone_number = support_phone.get('number')
-                support_phone_prefix = support_phone.get('prefixNumber')
-                support_phone_description = support_phone.get('chargeDescription')
-                support_phone_charge_type = support_phone.get('serviceChargeType')  
-                support_phone_el = {"number": support_phone_number,
-                                   "prefixNumber": support_phone_prefix,
-                                   "chargeDescription": support_phone_description,
-                                   "serviceChargeType": support_phone_charge_type}
-                support_phone_elements.append(support_phone_el)
-            channel_final['phoneNumbers'][language] = support_phone_elements
-                
-            # Support emails
-            if channel.get('supportEmails') is not None:
-                support_emails = [l_support_email for l_support_email in [support_email for support_email in channel.get('supportEmails') if support_email.get('language') == language]]
-            else:
-                support_emails = []
-            if channel.get('emails') is not None:
-                support_emails = support_emails + [l_support_email for l_support_email in [support_email for support_email in channel.get('emails') if support_email.get('language') == language]]
-            support_email_elements = []
-            for support_email in support_emails:
-                support_email_value = support_email.get('value')
-                support_email_elements.append(support_email_value)
-            channel_final['emails'][language] = support_email_elements
-            
-            # Addresses
-            if channel.get('addresses') is not None:
-                addresses = channel.get('addresses')
-            else:
-                addresses = []
-            address_elements = []
-            for address in addresses:
-                address_type = address.get('type')
-                address_subtype = address.get('subType')
-                street_address = address.get('streetAddress')
-                street_number = None
-                postal_code = None
-                latitude = None
-                longitude = None
-                street_name = None
-                post_office = None
-                municipality_name = None
-                municipality_code = None
-                if street_address is not None:
-                    street_number = street_address.get('streetNumber')
-                    postal_code = street_address.get('postalCode')                    
-                    latitude = street_address.get('latitude')                  
-                    longitude = street_address.get('longitude')
-                    street_names = [street_name.get('value') for street_name in street_address.get('street') if street_name.get('language') == language]
-                    street_names = [s_name for s_name in street_names if s_name is not None]
-                    if len(street_names) > 0:
-                        street_name = ' - '.join(street_names)
-                    post_offices = [post_office.get('value') for post_office in street_address.get('postOffice') if post_office.get('language') == language]
-                    post_offices = [p_office for p_office in post_offices if p_office is not None]
-                    if len(post_offices) > 0:
-                        post_office = ' - '.join(post_offices)
-                    municipality_code = street_address.get('municipality').get('code')
-                    sa_municipality_names = [municipality_name.get('value') for municipality_name in street_address.get('municipality').get('name') if municipality_name.get('language') == language]
-                    sa_municipality_names = [sa_municipality_name for sa_municipality_name in sa_municipality_names if sa_municipality_name is not None]
-                    if len(sa_municipality_names) > 0:
-                        municipality_name = ' - '.join(sa_municipality_names)
-
-                address_el = {"type": address_type,
-                                   "subtype": address_subtype,
-                                   "streetNumber": street_number,
-                                   "postalCode": postal_code,
-                                   "latitude": latitude,
-                                   "longitude": longitude,
-                                   "streetName": street_name,
-                                   "postOffice": post_office,
-                                   "municipalityCode": municipality_code,
-                                   "municipalityName": municipality_name}
-                address_elements.append(address_el)
-            channel_final['addresses'][language] = address_elements
-                
-            # Areas
-            if channel.get('areas') is not None:
-                areas = channel.get('areas')
-            else:
-                areas = []
-            area_elements = []
-            for area in areas:
-                area_type = area.get('type')
-                if area.get('type') == 'Municipality':
-                    area = area.get('municipalities')[0]
-                area_code = area.get('code')
-                area_names = [l_area_name.get('value') for l_area_name in [area_name for area_name in area.get('name') if area_name.get('language') == language]]
-                area_names = [a_name for a_name in area_names if a_name is not None]
-                if len(area_names) > 0:
-                    area_name = ' - '.join(area_names)
-                else:
-                    area_name=None
-                area_el = {"name": area_name,
-                                    "type": area_type,
-                                    "code": area_code}
-                area_elements.append(area_el)
-            channel_final['areas'][language] = area_elements
-            
-            # Channel Urls
-            if channel.get('channelUrls') is not None:
-                channel_urls = [l_channel_url for l_channel_url in [channel_url for channel_url in channel.get('channelUrls') if channel_url.get('language') == language]]
-            else:
-                channel_urls = []
-            channel_url_elements = []
-            for channel_url in channel_urls:
-                channel_url_value = channel_url.get('value')
-                channel_url_type = channel_url.get('type')
-                channel_url_el = {"url": channel_url_value,
-                                  "type": channel_url_type}                
-                channel_url_elements.append(channel_url_el)
-            channel_final['channelUrls'][language] = channel_url_elements            
-            
-        return(channel_final)
+        return(parse_channel_info(channel))
     
+    def _parse_batch(self, collection: str, raw_items: list, now: datetime, raw_hashes: Optional[list] = None) -> list:
+        # Raw payloads are hashed before parsing, the service parser adds role types to them
+        if raw_hashes is None:
+            raw_hashes = [content_hash(raw_item) for raw_item in raw_items]
+        if self.parallel_parser is not None:
+            parsed_items = self.parallel_parser.parse(collection, raw_items)
+        elif collection == "services":
+            parsed_items = [self._parse_service_info(raw_item) for raw_item in raw_items]
+        elif collection == "channels":
+            parsed_items = [self._parse_channel_info(raw_item) for raw_item in raw_items]
+        else:
+            raise Exception("Collection not recognized")
+        for parsed_item, raw_hash in zip(parsed_items, raw_hashes):
+            parsed_item['contentHash'] = content_hash(parsed_item)
+            parsed_item['rawHash'] = raw_hash
+            parsed_item['lastUpdated'] = now
+        return(parsed_items)
+
+    def _stored_hashes(self, collection: str, ids: list) -> dict:
+        if len(ids) == 0:
+            return({})
+        projection = {'_id': 0, 'id': 1, 'rawHash': 1, 'contentHash': 1, 'channelIds': 1, 'normalised': 1}
+        stored_items = list(self._collection(collection).find({'id': {'$in': ids}}, projection))
+        for stored_item in stored_items:
+            # Documents stored in the other output mode are rewritten even if they have not changed
+            if stored_item.pop('normalised', False) != (self.output_mode == "normalised"):
+                stored_item['rawHash'] = None
+                stored_item['contentHash'] = None
+        return({stored_item.get('id'): stored_item for stored_item in stored_items})
+
+    def _parse_changed(self, collection: str, raw_items: list, now: datetime, stored: dict, reparse: bool = False) -> tuple:
+        with self.metrics.stage('parsing', collection) as stage:
+            stage['documents_in'] = len(raw_items)
+            changed_items = []
+            raw_hashes = []
+            unchanged_items = []
+            for raw_item in raw_items:
+                raw_hash = content_hash(raw_item)
+                stored_item = stored.get(raw_item.get('id'))
+                if not reparse and stored_item is not None and stored_item.get('rawHash') == raw_hash:
+                    unchanged_items.append(stored_item)
+                else:
+                    changed_items.append(raw_item)
+                    raw_hashes.append(raw_hash)
+            self.skipped[collection]['parse'] = self.skipped[collection]['parse'] + len(unchanged_items)
+            parsed_items = self._parse_batch(collection, changed_items, now, raw_hashes)
+            stage['documents_out'] = len(parsed_items)
+        return(parsed_items, unchanged_items)
+
+    def _report_skipped(self) -> None:
+        for collection in ['services', 'channels']:
+            print(self.skipped[collection]['parse'], "unchanged", collection, "not parsed,", self.skipped[collection]['write'], "unchanged", collection, "not written.")
+
+    def _filter_suitable(self, collection: str, items: list) -> list:
+        with self.metrics.stage('filtering', collection) as stage:
+            stage['documents_in'] = len(items)
+            suitable_items = self.suitability.filter(collection, items)
+            stage['documents_out'] = len(suitable_items)
+        return(suitable_items)
+
     def _is_suitable_service(self, service: dict) -> bool:
-        service_tg_codes = [t_group.get('code') for t_group in service.get('targetGroups')['fi']]
-        contains_suitable = True
-        if len(service_tg_codes) > 0:
-            contains_suitable = any([True for tg_code in service_tg_codes if tg_code in suitable_target_groups])
-        tg_OK = contains_suitable
-        
-        service_areas = service.get('areas')['fi']
-        province_match = True
-        municipality_match = True
-        if len(service_areas) > 0:
-            municipality_codes = [mun.get('id') for mun in self.municipalities]
-            province_codes = [pro.get('code') for pro in self.provinces]
-            address_municipality_codes = [area.get('code') for area in service_areas if area.get('type') == 'Municipality']
-            address_province_codes = [area.get('code') for area in service_areas if area.get('type') == 'Province' or area.get('type') == 'Region']
-            province_match = any([True for pro_code in address_province_codes if pro_code in province_codes])
-            municipality_match = any([True for mun_code in address_municipality_codes if mun_code in municipality_codes])
-        region_OK = province_match or municipality_match
-        return(tg_OK and region_OK)        
-    
+        return(self.suitability.is_suitable_service(service))
+
     def _is_suitable_channel(self, channel: dict) -> bool:
-        if channel.get('type') == 'ServiceLocation':
-            addresses = channel.get('addresses')['fi']
-            if len(addresses) > 0:
-                municipality_codes = [mun.get('id') for mun in self.municipalities]
-                address_municipality_codes = [add.get('municipalityCode') for add in addresses]
-                contains_region_mun = any([True for am_code in address_municipality_codes if am_code in municipality_codes])
-                return(contains_region_mun)
-            else:
-                return(True)     
-        else:
-            return(True)       
-            
-    
+        return(self.suitability.is_suitable_channel(channel))
+
     def store_to_mongo(self, collection: str, to_store: list) -> None:
         if collection == "services":
             if len(to_store) > 0:
@@ -587,6 +664,147 @@ class PTVImporter():
         else:
             raise Exception("Collection not recognized")
 
+    def _collection(self, collection: str):
+        if collection == "services":
+            return(self.mongo_client.service_db.services)
+        elif collection == "channels":
+            return(self.mongo_client.service_db.channels)
+        elif collection == "municipalities":
+            return(self.mongo_client.service_db.municipalities)
+        elif collection == "codes":
+            return(self.mongo_client.service_db.codes)
+        else:
+            raise Exception("Collection not recognized")
+
+    def _create_indexes(self, collection: str, mongo_collection) -> None:
+        for field, unique in collection_indexes[collection]:
+            try:
+                mongo_collection.create_index([(field, ASCENDING)], unique=unique, name=field + "_1")
+            except OperationFailure as error:
+                print("Creating index", field, "on", collection, "failed:", error)
+
+    def _missing_indexes(self, collection: str, mongo_collection) -> list:
+        index_information = mongo_collection.index_information()
+        existing = {}
+        for index in index_information.values():
+            keys = tuple(key for key, direction in index.get('key', []))
+            existing[keys] = index.get('unique', False)
+        return([field for field, unique in collection_indexes[collection] if (field,) not in existing or (unique and not existing[(field,)])])
+
+    def ensure_indexes(self) -> dict:
+        missing = {}
+        for collection in collection_indexes:
+            mongo_collection = self._collection(collection)
+            start = time.perf_counter()
+            self._create_indexes(collection, mongo_collection)
+            created = time.perf_counter()
+            missing[collection] = self._missing_indexes(collection, mongo_collection)
+            verified = time.perf_counter()
+            print("Indexes of {} created in {:.3f} s and verified in {:.3f} s.".format(collection, created - start, verified - created))
+            if len(missing[collection]) > 0:
+                print("Missing indexes on", collection + ":", ", ".join(missing[collection]))
+        return(missing)
+
+    def upsert_to_mongo(self, collection: str, to_upsert: list, chunk_size: Optional[int] = None) -> dict:
+        mongo_collection = self._collection(collection)
+        if chunk_size is None:
+            chunk_size = self.upsert_chunk_size
+        totals = {'matched': 0, 'upserted': 0, 'modified': 0}
+        for start_index in range(0, len(to_upsert), chunk_size):
+            chunk = to_upsert[start_index:start_index + chunk_size]
+            result = mongo_collection.bulk_write([ReplaceOne({'id': item.get('id')}, item, upsert=True) for item in chunk], ordered=False)
+            counts = {'matched': result.matched_count, 'upserted': result.upserted_count, 'modified': result.modified_count}
+            print("Chunk {} of {}: {} matched, {} upserted, {} modified.".format(start_index // chunk_size + 1, collection, counts['matched'], counts['upserted'], counts['modified']))
+            for key in totals:
+                totals[key] = totals[key] + counts[key]
+        print(len(to_upsert), collection, "upserted:", totals['matched'], "matched,", totals['upserted'], "upserted,", totals['modified'], "modified.")
+        return(totals)
+
+    def prepare_for_storage(self, collection: str, items: list) -> list:
+        if self.output_mode == "denormalised":
+            return(items)
+        with self.metrics.stage('normalising', collection) as stage:
+            stage['documents_in'] = len(items)
+            normalised_items = [self.codes.normalise(collection, item) for item in items]
+            # Codes are stored before the documents that refer to them
+            stored_codes = self.codes.store(self._collection('codes'))
+            stage['documents_out'] = len(normalised_items)
+        if stored_codes > 0:
+            print(stored_codes, "codes of", collection, "stored.")
+        return(normalised_items)
+
+    def _write_changed(self, collection: str, items: list, stored: Optional[dict] = None) -> None:
+        if stored:
+            changed_items = [item for item in items if stored.get(item.get('id'), {}).get('contentHash') != item.get('contentHash')]
+            self.skipped[collection]['write'] = self.skipped[collection]['write'] + len(items) - len(changed_items)
+            items = changed_items
+        items = self.prepare_for_storage(collection, items)
+        if self.write_mode == "delete_insert" and len(items) > 0:
+            # An empty id list would delete the whole collection
+            with self.metrics.stage('deleting', collection) as stage:
+                stage['documents_in'] = len(items)
+                self.remove_old_from_mongo(collection, [item.get('id') for item in items])
+        with self.metrics.stage('storing', collection) as stage:
+            stage['documents_in'] = len(items)
+            if self.write_mode == "upsert":
+                self.upsert_to_mongo(collection, items)
+            else:
+                self.store_to_mongo(collection, items)
+            stage['documents_out'] = len(items)
+
+    def store_to_staging(self, collection: str, to_store: list) -> None:
+        self._collection(collection)
+        to_store = self.prepare_for_storage(collection, to_store)
+        with self.metrics.stage('storing', collection) as stage:
+            stage['documents_in'] = len(to_store)
+            staging = self.mongo_client.service_db.get_collection(collection + "_staging")
+            staging.drop()
+            if len(to_store) > 0:
+                staging.insert_many(to_store)
+            self._create_indexes(collection, staging)
+            stage['documents_out'] = len(to_store)
+        print(len(to_store), collection, "stored to staging.")
+
+    def swap_in_staging(self, collection: str) -> None:
+        self._collection(collection)
+        service_db = self.mongo_client.service_db
+        with self.metrics.stage('storing', collection):
+            # Renames move the collections with their indexes instead of copying the live one aside
+            had_live = collection in service_db.list_collection_names()
+            if had_live:
+                service_db.get_collection(collection).rename(collection + "_previous", dropTarget=True)
+            try:
+                service_db.get_collection(collection + "_staging").rename(collection)
+            except Exception:
+                if had_live:
+                    service_db.get_collection(collection + "_previous").rename(collection)
+                raise
+        print("Staged", collection, "swapped in.")
+
+    def swap_in_staging_together(self, collections: list) -> None:
+        swapped = []
+        try:
+            for collection in collections:
+                had_live = collection in self.mongo_client.service_db.list_collection_names()
+                self.swap_in_staging(collection)
+                swapped.append((collection, had_live))
+        except Exception:
+            # Collections go live together, the ones already swapped in are rolled back
+            for collection, had_live in reversed(swapped):
+                if had_live:
+                    self.rollback_collection(collection)
+                else:
+                    self.mongo_client.service_db.get_collection(collection).drop()
+            raise
+
+    def rollback_collection(self, collection: str) -> None:
+        self._collection(collection)
+        service_db = self.mongo_client.service_db
+        if collection + "_previous" not in service_db.list_collection_names():
+            raise Exception("No previous generation to roll back to")
+        service_db.get_collection(collection + "_previous").rename(collection, dropTarget=True)
+        print("Previous", collection, "rolled back.")
+
     def remove_old_from_mongo(self, collection: str, delete_ids: Optional[list] = None) -> None:
         del_count = 0
         if collection == "services":
@@ -606,23 +824,103 @@ class PTVImporter():
         else:
             raise Exception("Collection not recognized")
         
+    def remove_stale_from_mongo(self, collection: str, keep_ids: list) -> None:
+        if collection not in ["services", "channels"]:
+            raise Exception("Collection not recognized")
+        with self.metrics.stage('deleting', collection) as stage:
+            delete_result = self._collection(collection).delete_many({'id': {"$nin": keep_ids}})
+            stage['documents_out'] = delete_result.deleted_count
+        print(delete_result.deleted_count, "stale", collection, "deleted.")
+
+    def reconcile_deletions(self) -> dict:
+        deleted = {}
+        for collection, url_template in [('services', self.api_url + "/Service?page={}"), ('channels', self.api_url + "/ServiceChannel?page={}")]:
+            with self.metrics.stage('reconciling', collection) as stage:
+                # Full listings carry ids only, so they cost a fraction of a refetch
+                live_ids = set(self._iter_paged_ids(url_template))
+                stored_ids = [item.get('id') for item in self._collection(collection).find({}, {'_id': 0, 'id': 1})]
+                delete_ids = [guid for guid in stored_ids if guid not in live_ids]
+                stage['documents_in'] = len(stored_ids)
+                # A broken or truncated listing must not empty the collection
+                if len(live_ids) == 0 or len(delete_ids) > self.reconcile_max_share * len(stored_ids):
+                    print("Reconciliation of", collection, "skipped,", len(delete_ids), "of", len(stored_ids), "stored would have been deleted.")
+                    delete_ids = []
+                elif len(delete_ids) > 0:
+                    self.remove_old_from_mongo(collection, delete_ids)
+                stage['documents_out'] = len(delete_ids)
+            deleted[collection] = len(delete_ids)
+        return(deleted)
+
+    def _is_refetch_day(self, now: datetime) -> bool:
+        return(self.refetch_day is not None and now.day == self.refetch_day)
+
+    def get_stored_output_mode(self) -> str:
+        state = self.mongo_client.service_db.sync_state.find_one({'source': sync_source, 'entity': 'output_mode'})
+        # Collections were denormalised before the output mode was recorded
+        if state is None or state.get('outputMode') not in output_modes:
+            return("denormalised")
+        return(state['outputMode'])
+
+    def commit_output_mode(self) -> None:
+        if self.get_stored_output_mode() == self.output_mode:
+            return
+        self.mongo_client.service_db.sync_state.update_one({'source': sync_source, 'entity': 'output_mode'},
+                                                           {'$set': {'outputMode': self.output_mode, 'committed': datetime.utcnow()}},
+                                                           upsert=True)
+        print("Output mode", self.output_mode, "committed.")
+
+    def _output_mode_changed(self) -> bool:
+        return(self.get_stored_output_mode() != self.output_mode)
+
+    def _is_full_refetch(self, now: datetime) -> bool:
+        # Incremental runs only rewrite changed documents, so documents stored in the other output mode need a full refetch
+        return(self._is_refetch_day(now) or self._output_mode_changed())
+
     def get_latest_update_time_from_mongo(self, collection: str) -> Optional[datetime]:
-        if collection == "services":
-            last_result = self.mongo_client.service_db.services.aggregate([{"$group" : {"_id" : None, "max" : {"$max" : "$lastUpdated"}}}])
-            last_result = list(last_result)
-            time = None
-            if len(last_result) > 0 and last_result[0].get('max') is not None:
-                time = datetime.fromtimestamp(last_result[0]['max']/1000)
-        elif collection == "channels":
-            last_result = self.mongo_client.service_db.channels.aggregate([{"$group" : {"_id" : None, "max" : {"$max" : "$lastUpdated"}}}])
-            last_result = list(last_result)
-            time = None
-            if len(last_result) > 0 and last_result[0].get('max') is not None:
-                time = datetime.fromtimestamp(last_result[0]['max']/1000)
-        else:
+        if collection not in ["services", "channels"]:
             raise Exception("Collection not recognized")
+        # Served by the lastUpdated index instead of scanning the collection
+        last_result = self._collection(collection).find({}, {'_id': 0, 'lastUpdated': 1}).sort('lastUpdated', DESCENDING).limit(1)
+        last_result = list(last_result)
+        time = None
+        if len(last_result) > 0 and last_result[0].get('lastUpdated') is not None:
+            time = last_result[0]['lastUpdated']
+            if isinstance(time, (int, float)):
+                time = datetime.fromtimestamp(time/1000)
         return(time)
 
+    def get_sync_watermark(self, entity: str) -> Optional[datetime]:
+        if entity not in ["services", "channels"]:
+            raise Exception("Collection not recognized")
+        state = self.mongo_client.service_db.sync_state.find_one({'source': sync_source, 'entity': entity})
+        if state is not None and state.get('watermark') is not None:
+            return(state['watermark'])
+        # No sync state yet, continue from the stored documents
+        return(self.get_latest_update_time_from_mongo(entity))
+
+    def _fetched_watermark(self, entity: str, listing_started: datetime, previous: Optional[datetime]) -> Optional[datetime]:
+        listing = self.listings.get(entity)
+        if listing is None:
+            return(previous)
+        fetched_modified = self.fetched_modified.get(entity)
+        # Items modified after the listing was requested may not have been listed
+        if fetched_modified is not None:
+            return(min(fetched_modified, listing_started))
+        # Details without modification times, fall back to when the listing was requested
+        if listing['items'] > 0:
+            return(listing_started)
+        return(previous)
+
+    def commit_sync_watermark(self, entity: str, watermark: Optional[datetime]) -> None:
+        if entity not in ["services", "channels"]:
+            raise Exception("Collection not recognized")
+        if watermark is None:
+            return
+        self.mongo_client.service_db.sync_state.update_one({'source': sync_source, 'entity': entity},
+                                                           {'$set': {'watermark': watermark, 'committed': datetime.utcnow()}},
+                                                           upsert=True)
+        print("Sync watermark of", entity, "committed:", watermark.isoformat())
+
     def update_municipalities_in_mongo(self, municipalities: list) -> None:
 
         old_municipalities = self.mongo_client.service_db.municipalities.find({})
@@ -634,13 +932,60 @@ class PTVImporter():
 
         self.mongo_client.service_db.municipalities.insert_many(municipalities)
         print(len(municipalities), "municipalities stored.")
+
+    def _store_municipalities(self) -> None:
+        with self.metrics.stage('municipalities') as stage:
+            stage['documents_in'] = len(self.municipalities)
+            self.update_municipalities_in_mongo(self.municipalities)
+            stage['documents_out'] = len(self.municipalities)
             
-    def import_services(self) -> None:
+    def import_services(self, engine: Optional[str] = None, join_only: bool = False) -> None:
         
-        ## Do full refetch if it the first day of the month
+        if join_only and not self.sharded:
+            raise Exception("Only sharded runs can be joined")
+        if (self.sharded or self.checkpointed or self.streaming) and (engine if engine is not None else self.engine) != "sync":
+            raise Exception("Fetch engine not supported in streaming, checkpointed and sharded runs")
+        self.skipped = {'services': {'parse': 0, 'write': 0, 'fetch': 0}, 'channels': {'parse': 0, 'write': 0, 'fetch': 0}}
+        self.listings = {}
+        self.fetched_modified = {}
+        self.metrics = RunMetrics.from_env(os.environ, self.meter)
+        self.metrics.start_tracing()
+        self.codes = CodeDictionary()
+        self.active_fetch_strategy = None
+        self.snapshot = None
+        # Checkpointed runs name their snapshot after the run, so a resumed run appends to it
+        if self.snapshot_dir and not self.checkpointed:
+            self._start_snapshot()
+        try:
+            if self.sharded:
+                self.import_services_sharded(join_only)
+            elif self.checkpointed:
+                self.import_services_checkpointed()
+            elif self.streaming:
+                self.import_services_streaming()
+            else:
+                self._import_services(engine)
+        finally:
+            if self.parallel_parser is not None:
+                self.parallel_parser.close()
+            if isinstance(self.api_session, CachingSession):
+                self.api_session.report()
+            if self.controller is not None:
+                self.controller.report()
+            if self.snapshot is not None:
+                print("Raw snapshot", self.snapshot.run_id, "written:", ", ".join("{} {}".format(count, collection) for collection, count in self.snapshot.counts.items() if collection != 'code_lists'))
+            self.metrics.finish()
+
+    def _import_services(self, engine: Optional[str] = None) -> None:
+
+        if engine is None:
+            engine = self.engine
+        if engine not in fetch_engines:
+            raise Exception("Fetch engine not recognized")
+
+        ## Do full refetch on the refetch day of the month
         now = datetime.utcnow()
-        day_number = now.day
-        if now.day == 1:
+        if self._is_full_refetch(now):
             refetch = True
         else:
             refetch = False
@@ -650,54 +995,377 @@ class PTVImporter():
             services_lu_time = None
             channels_lu_time = None
         else:
-            services_lu_time = self.get_latest_update_time_from_mongo('services')
-            channels_lu_time = self.get_latest_update_time_from_mongo('channels')
+            services_lu_time = self.get_sync_watermark('services')
+            channels_lu_time = self.get_sync_watermark('channels')
         
         ## Fetch new services
-        service_guids = self._get_all_service_guids(services_lu_time)
+        services_listing_started = datetime.utcnow()
+        service_guids = self._fetch_service_guids(services_lu_time, engine)
         now = datetime.utcnow()
-        raw_services = self._get_services(service_guids)
-        services = []
-        for service in raw_services:
-            parsed_service = self._parse_service_info(service)
-            parsed_service['lastUpdated'] = now
-            services.append(parsed_service)
+        raw_services = self._fetch_services(service_guids, engine)
+        # A full refetch rewrites the collections from staging, so nothing is skipped
+        stored_services = {} if refetch else self._stored_hashes('services', service_guids)
+        services, unchanged_services = self._parse_changed('services', raw_services, now, stored_services)
         
         # Filter in services that belong to suitable target groups
-        services = [service for service in services if self._is_suitable_service(service)]
+        services = self._filter_suitable('services', services)
 
-        ## Find out channels that are related to fetched services
-        channels_ids = [service_el.get('channelIds') for service_el in services]
+        ## Find out channels that are related to fetched services, unchanged ones included as in streaming mode
+        channels_ids = [service_el.get('channelIds') or [] for service_el in services + unchanged_services]
         channels_ids = [item for sublist in channels_ids for item in sublist]
         channels_ids = list(set(channels_ids))
         
-        channel_guids = self._get_service_channel_ids(channels_lu_time)
-        channel_guids = list(set(channel_guids + channels_ids))
+        channels_listing_started = datetime.utcnow()
+        channel_guids = self._fetch_service_channel_ids(channels_lu_time, engine)
+        channel_guids = list(set(channel_guids + self._referenced_channel_guids(channels_ids, channel_guids, channels_lu_time)))
         now = datetime.utcnow()
-        raw_channels = self._get_service_channels(channel_guids)
-        channels = []
-        for channel in raw_channels:
-            parsed_channel = self._parse_channel_info(channel)
-            parsed_channel['lastUpdated'] = now
-            channels.append(parsed_channel)        
+        raw_channels = self._fetch_service_channels(channel_guids, engine)
+        stored_channels = {} if refetch else self._stored_hashes('channels', channel_guids)
+        channels, unchanged_channels = self._parse_changed('channels', raw_channels, now, stored_channels)
         
         # Filter out channels that are service locations that are not inside region
-        channels = [channel for channel in channels if self._is_suitable_channel(channel)]
+        channels = self._filter_suitable('channels', channels)
 
         if refetch:
-            self.remove_old_from_mongo('services')
-            self.remove_old_from_mongo('channels')
+            # Load into staging and swap both in only when both are complete
+            self.store_to_staging('services', services)
+            self.store_to_staging('channels', channels)
+            self.swap_in_staging_together(['services', 'channels'])
         else:
-            services_to_delete = [service.get('id') for service in services]
-            channels_to_delete = [channel.get('id') for channel in channels]
-            self.remove_old_from_mongo('services', services_to_delete)
-            self.remove_old_from_mongo('channels', channels_to_delete)
-   
-        self.store_to_mongo('services', services)
-        self.store_to_mongo('channels', channels)
+            self._write_changed('services', services, stored_services)
+            self._write_changed('channels', channels, stored_channels)
+            if self.reconcile:
+                self.reconcile_deletions()
+        self._report_skipped()
+
+        # Everything up to the fetched modification times is stored
+        self.commit_sync_watermark('services', self._fetched_watermark('services', services_listing_started, services_lu_time))
+        self.commit_sync_watermark('channels', self._fetched_watermark('channels', channels_listing_started, channels_lu_time))
+        self.commit_output_mode()
 
         # Update municipalities
-        municipalities = self.municipalities
-        self.update_municipalities_in_mongo(municipalities)
-        
-        
\ No newline at end of file
+        self._store_municipalities()
+
+    def _fetch_batch(self, collection: str, batch: tuple) -> tuple:
+        end_index, url = batch
+        with self.metrics.stage('fetching', collection) as stage:
+            raw_batch = self._get_batch_json(url)
+            stage['documents_out'] = len(raw_batch)
+        self._snapshot_raw(collection, raw_batch)
+        return(end_index, raw_batch)
+
+    def _stream_to_mongo(self, collection: str, guids: list, now: datetime, referenced_channel_ids: Optional[set] = None, start_batch: int = 0, start_index: int = 0, on_batch: Optional[Callable] = None, refetch: bool = False) -> list:
+        if collection == "services":
+            endpoint = "/Service/serviceWithGD/list"
+        elif collection == "channels":
+            endpoint = "/ServiceChannel/list"
+        else:
+            raise Exception("Collection not recognized")
+        stored_ids = []
+        batches = prefetch_map(lambda batch: self._fetch_batch(collection, batch), self._iter_batch_urls(endpoint, guids, start_index), self.batches_in_flight)
+        for batch_number, (end_index, raw_batch) in enumerate(batches, start_batch + 1):
+            self._track_modified(collection, raw_batch)
+            # Batches are written in place, so unchanged documents are not written on a full refetch either, but they are parsed again so parser changes reach them
+            stored = self._stored_hashes(collection, [raw_item.get('id') for raw_item in raw_batch])
+            parsed_batch, unchanged_batch = self._parse_changed(collection, raw_batch, now, stored, refetch)
+            batch = self._filter_suitable(collection, parsed_batch)
+            # Release raw documents before storing
+            raw_batch = None
+            self._write_changed(collection, batch, stored)
+            batch_ids = [item.get('id') for item in batch + unchanged_batch]
+            batch_channel_ids = [channel_id for item in batch + unchanged_batch for channel_id in item.get('channelIds') or []]
+            stored_ids.extend(batch_ids)
+            if referenced_channel_ids is not None:
+                referenced_channel_ids.update(batch_channel_ids)
+            if on_batch is not None:
+                on_batch(batch_number, end_index, batch_ids, batch_channel_ids)
+        return(stored_ids)
+
+    def import_services_streaming(self) -> None:
+
+        ## Do full refetch on the refetch day of the month
+        now = datetime.utcnow()
+        refetch = self._is_full_refetch(now)
+
+        ## Get latest addition times of services from DB
+        if refetch:
+            services_lu_time = None
+            channels_lu_time = None
+        else:
+            services_lu_time = self.get_sync_watermark('services')
+            channels_lu_time = self.get_sync_watermark('channels')
+
+        ## Stream new services batch by batch, keeping only ids of stored services and their channels
+        services_listing_started = datetime.utcnow()
+        service_guids = self._get_all_service_guids(services_lu_time)
+        now = datetime.utcnow()
+        channels_ids = set()
+        stored_service_ids = self._stream_to_mongo('services', service_guids, now, channels_ids, refetch=refetch)
+
+        ## Stream channels of the region and channels related to stored services
+        channels_listing_started = datetime.utcnow()
+        channel_guids = self._get_service_channel_ids(channels_lu_time)
+        channel_guids = channel_guids + self._referenced_channel_guids(list(channels_ids), channel_guids, channels_lu_time)
+        now = datetime.utcnow()
+        stored_channel_ids = self._stream_to_mongo('channels', channel_guids, now, refetch=refetch)
+
+        # Full refetch replaces everything, so drop what was not stored in this run
+        if refetch:
+            self.remove_stale_from_mongo('services', stored_service_ids)
+            self.remove_stale_from_mongo('channels', stored_channel_ids)
+        elif self.reconcile:
+            self.reconcile_deletions()
+        self._report_skipped()
+
+        # Everything up to the fetched modification times is stored
+        self.commit_sync_watermark('services', self._fetched_watermark('services', services_listing_started, services_lu_time))
+        self.commit_sync_watermark('channels', self._fetched_watermark('channels', channels_listing_started, channels_lu_time))
+        self.commit_output_mode()
+
+        # Update municipalities
+        self._store_municipalities()
+
+    def _shard_coordinator(self) -> ShardCoordinator:
+        return(ShardCoordinator(self.mongo_client.service_db, lease_seconds=self.lease_seconds, shard_size=self.shard_size, max_attempts=self.shard_max_attempts))
+
+    def start_sharded_run(self) -> dict:
+        ## Do full refetch on the refetch day of the month
+        return(self._shard_coordinator().join_or_start({'refetch': self._is_full_refetch(datetime.utcnow())}, self.checkpoint_max_age))
+
+    def import_services_sharded(self, join_only: bool = False) -> None:
+
+        coordinator = self._shard_coordinator()
+        if join_only:
+            # Shard workers join the run they were woken up for
+            run = coordinator.join(self.checkpoint_max_age)
+            if run is None:
+                print("No sharded import run to join.")
+                return
+        else:
+            run = self.start_sharded_run()
+        tasks_done = 0
+        while not coordinator.finished(run['_id']):
+            task = coordinator.claim(run['_id'])
+            if task is None:
+                # Other replicas hold the remaining tasks, their tasks become claimable if their leases expire
+                time.sleep(self.shard_poll_seconds)
+                continue
+            try:
+                self._run_shard_task(coordinator, run, task)
+                tasks_done = tasks_done + 1
+            except LeaseLost as error:
+                print(error)
+            except Exception as error:
+                # The task is claimed again until it has used its attempts
+                print(task['kind'], "task", task['shard'], "of sharded import run", run['_id'], "failed:", repr(error))
+                coordinator.release(task, repr(error))
+        self._report_skipped()
+        print(tasks_done, "tasks of sharded import run", run['_id'], "done by", coordinator.owner)
+        if coordinator.failed(run['_id']):
+            raise Exception("Sharded import run {} failed".format(run['_id']))
+
+    def _run_shard_task(self, coordinator: ShardCoordinator, run: dict, task: dict) -> None:
+        refetch = run['refetch']
+        heartbeat = lambda *batch: coordinator.heartbeat(task)
+
+        ## List services and split them into shards
+        if task['kind'] == 'plan_services':
+            services_lu_time = None if refetch else self.get_sync_watermark('services')
+            services_listing_started = datetime.utcnow()
+            service_guids = self._get_all_service_guids(services_lu_time)
+            coordinator.add_shards(run['_id'], 'services', service_guids)
+            coordinator.complete(task, {'luTime': services_lu_time, 'listingStarted': services_listing_started, 'listing': self.listings['services']})
+
+        ## Stream a shard of services, keeping the ids of stored services and their channels
+        elif task['kind'] == 'services':
+            channels_ids = set()
+            self.fetched_modified = {}
+            stored_service_ids = self._stream_to_mongo('services', task['guids'], datetime.utcnow(), channels_ids, on_batch=heartbeat, refetch=refetch)
+            coordinator.complete(task, {'storedIds': stored_service_ids, 'channelIds': sorted(channels_ids), 'modified': self.fetched_modified.get('services')})
+
+        ## List channels of the region, add channels related to stored services and split them into shards
+        elif task['kind'] == 'plan_channels':
+            channels_ids = set(channel_id for shard in coordinator.done_tasks(run['_id'], 'services') for channel_id in shard.get('channelIds', []))
+            channels_lu_time = None if refetch else self.get_sync_watermark('channels')
+            channels_listing_started = datetime.utcnow()
+            channel_guids = self._get_service_channel_ids(channels_lu_time)
+            channel_guids = channel_guids + self._referenced_channel_guids(list(channels_ids), channel_guids, channels_lu_time)
+            coordinator.add_shards(run['_id'], 'channels', channel_guids)
+            coordinator.complete(task, {'luTime': channels_lu_time, 'listingStarted': channels_listing_started, 'listing': self.listings['channels']})
+
+        ## Stream a shard of channels
+        elif task['kind'] == 'channels':
+            self.fetched_modified = {}
+            stored_channel_ids = self._stream_to_mongo('channels', task['guids'], datetime.utcnow(), on_batch=heartbeat, refetch=refetch)
+            coordinator.complete(task, {'storedIds': stored_channel_ids, 'modified': self.fetched_modified.get('channels')})
+
+        ## Finish the run once every shard is stored
+        elif task['kind'] == 'finish':
+            if refetch:
+                for collection in ['services', 'channels']:
+                    self.remove_stale_from_mongo(collection, [guid for shard in coordinator.done_tasks(run['_id'], collection) for guid in shard.get('storedIds', [])])
+            elif self.reconcile:
+                self.reconcile_deletions()
+            plans = {entity: coordinator.done_tasks(run['_id'], 'plan_' + entity)[0] for entity in ['services', 'channels']}
+            # Listings come from the replicas that planned the run and modification times from those that fetched the shards
+            self.listings = {entity: plan['listing'] for entity, plan in plans.items()}
+            self.fetched_modified = {}
+            for entity in ['services', 'channels']:
+                self.fetched_modified[entity] = max([shard['modified'] for shard in coordinator.done_tasks(run['_id'], entity) if shard.get('modified') is not None], default=None)
+            for entity, plan in plans.items():
+                self.commit_sync_watermark(entity, self._fetched_watermark(entity, plan['listingStarted'], plan['luTime']))
+            self.commit_output_mode()
+            self._store_municipalities()
+            coordinator.complete(task)
+
+        else:
+            raise Exception("Task not recognized")
+
+    def refresh(self, service_ids: list, channel_ids: list) -> dict:
+
+        # Targeted refreshes leave watermarks alone, the next scheduled run still lists everything it would have
+        self.skipped = {'services': {'parse': 0, 'write': 0, 'fetch': 0}, 'channels': {'parse': 0, 'write': 0, 'fetch': 0}}
+        self.metrics = RunMetrics.from_env(os.environ, self.meter)
+        self.metrics.start_tracing()
+        self.codes = CodeDictionary()
+        result = {}
+        try:
+            requested = {'services': list(dict.fromkeys(service_ids)), 'channels': list(dict.fromkeys(channel_ids))}
+            for collection in ['services', 'channels']:
+                guids = requested[collection]
+                if collection == 'channels':
+                    # Channels that refreshed services refer to but that are not stored yet come along
+                    referenced_ids = [channel_id for service in result['services']['items'] for channel_id in service.get('channelIds') or []]
+                    missing_ids = [channel_id for channel_id in dict.fromkeys(referenced_ids) if channel_id not in set(guids)]
+                    stored_ids = set(self._stored_hashes('channels', missing_ids))
+                    guids = guids + [channel_id for channel_id in missing_ids if channel_id not in stored_ids]
+                if len(guids) == 0:
+                    result[collection] = {'requested': 0, 'fetched': 0, 'stored': 0, 'deleted': 0, 'items': []}
+                    continue
+                now = datetime.utcnow()
+                if collection == 'services':
+                    raw_items = self._fetch_services(guids, self.engine)
+                else:
+                    raw_items = self._fetch_service_channels(guids, self.engine)
+                stored = self._stored_hashes(collection, guids)
+                parsed_items, unchanged_items = self._parse_changed(collection, raw_items, now, stored)
+                items = self._filter_suitable(collection, parsed_items)
+                changed_items = [item for item in items if stored.get(item.get('id'), {}).get('contentHash') != item.get('contentHash')]
+                self.skipped[collection]['write'] = self.skipped[collection]['write'] + len(items) - len(changed_items)
+                to_upsert = self.prepare_for_storage(collection, changed_items)
+                with self.metrics.stage('storing', collection) as stage:
+                    stage['documents_in'] = len(to_upsert)
+                    self.upsert_to_mongo(collection, to_upsert)
+                    stage['documents_out'] = len(to_upsert)
+                # Requested items that PTV no longer returns or that are no longer suitable are removed
+                kept_ids = set(item.get('id') for item in items + unchanged_items)
+                delete_ids = [guid for guid in requested[collection] if guid not in kept_ids and guid in stored]
+                if len(delete_ids) > 0:
+                    with self.metrics.stage('deleting', collection) as stage:
+                        stage['documents_in'] = len(delete_ids)
+                        self.remove_old_from_mongo(collection, delete_ids)
+                result[collection] = {'requested': len(requested[collection]), 'fetched': len(raw_items), 'stored': len(changed_items),
+                                      'deleted': len(delete_ids), 'items': items + unchanged_items}
+            self._report_skipped()
+        finally:
+            self.metrics.finish()
+        return({collection: {key: value for key, value in counts.items() if key != 'items'} for collection, counts in result.items()})
+
+    def import_from_snapshot(self, snapshot: RawSnapshot, chunk_size: int = 1000) -> None:
+
+        # Everything is parsed again so parser changes reach stored documents, only changed documents are written
+        self.skipped = {'services': {'parse': 0, 'write': 0, 'fetch': 0}, 'channels': {'parse': 0, 'write': 0, 'fetch': 0}}
+        self.metrics = RunMetrics.from_env(os.environ, self.meter)
+        self.metrics.start_tracing()
+        self.codes = CodeDictionary()
+        try:
+            for collection in ['services', 'channels']:
+                now = datetime.utcnow()
+                raw_items = snapshot.items(collection)
+                stored_count = 0
+                while True:
+                    raw_chunk = [raw_item for _, raw_item in zip(range(chunk_size), raw_items)]
+                    if len(raw_chunk) == 0:
+                        break
+                    parsed_chunk, unchanged_chunk = self._parse_changed(collection, raw_chunk, now, {})
+                    chunk = self._filter_suitable(collection, parsed_chunk)
+                    self._write_changed(collection, chunk, self._stored_hashes(collection, [item.get('id') for item in chunk]))
+                    stored_count = stored_count + len(chunk)
+                print(stored_count, collection, "restored from snapshot", snapshot.run_id)
+            self._report_skipped()
+        finally:
+            if self.parallel_parser is not None:
+                self.parallel_parser.close()
+            self.metrics.finish()
+
+    def import_services_checkpointed(self) -> None:
+
+        checkpoint = ImportCheckpoint.resume(self.mongo_client.service_db, self.checkpoint_max_age)
+        if checkpoint is None:
+            ## Do full refetch on the refetch day of the month
+            checkpoint = ImportCheckpoint.start(self.mongo_client.service_db, {'refetch': self._is_full_refetch(datetime.utcnow())})
+        run = checkpoint.run
+        refetch = run['refetch']
+        # Modification times of batches fetched by an earlier attempt of the run
+        self.fetched_modified = {'services': run.get('servicesModified'), 'channels': run.get('channelsModified')}
+        if self.snapshot_dir:
+            self._start_snapshot(str(run['_id']))
+
+        ## List services
+        if run['stage'] == 'service_listing':
+            services_lu_time = None if refetch else self.get_sync_watermark('services')
+            services_listing_started = datetime.utcnow()
+            service_guids = self._get_all_service_guids(services_lu_time)
+            checkpoint.save_listing('serviceGuids', service_guids, stage='service_batches', servicesLuTime=services_lu_time,
+                                    servicesListingStarted=services_listing_started, servicesListing=self.listings['services'],
+                                    servicesNow=datetime.utcnow(), serviceBatches=0, serviceIndex=0, storedServiceIds=[], referencedChannelIds=[])
+
+        ## Stream services, checkpointing after every stored batch
+        if run['stage'] == 'service_batches':
+            referenced_channel_ids = set(run['referencedChannelIds'])
+
+            def service_batch_stored(batch_number: int, end_index: int, batch_ids: list, batch_channel_ids: list) -> None:
+                new_channel_ids = sorted(set(batch_channel_ids).difference(referenced_channel_ids))
+                referenced_channel_ids.update(new_channel_ids)
+                checkpoint.extend({'storedServiceIds': batch_ids, 'referencedChannelIds': new_channel_ids}, serviceBatches=batch_number, serviceIndex=end_index,
+                                  servicesModified=self.fetched_modified.get('services'))
+
+            self._stream_to_mongo('services', run['serviceGuids'], run['servicesNow'], start_batch=run['serviceBatches'], start_index=run['serviceIndex'], on_batch=service_batch_stored, refetch=refetch)
+            checkpoint.save(stage='channel_listing')
+
+        ## List channels of the region and add channels related to stored services
+        if run['stage'] == 'channel_listing':
+            channels_lu_time = None if refetch else self.get_sync_watermark('channels')
+            channels_listing_started = datetime.utcnow()
+            channel_guids = self._get_service_channel_ids(channels_lu_time)
+            channel_guids = channel_guids + self._referenced_channel_guids(run['referencedChannelIds'], channel_guids, channels_lu_time)
+            checkpoint.save_listing('channelGuids', channel_guids, stage='channel_batches', channelsLuTime=channels_lu_time,
+                                    channelsListingStarted=channels_listing_started, channelsListing=self.listings['channels'],
+                                    channelsNow=datetime.utcnow(), channelBatches=0, channelIndex=0, storedChannelIds=[])
+
+        ## Stream channels, checkpointing after every stored batch
+        if run['stage'] == 'channel_batches':
+
+            def channel_batch_stored(batch_number: int, end_index: int, batch_ids: list, batch_channel_ids: list) -> None:
+                checkpoint.extend({'storedChannelIds': batch_ids}, channelBatches=batch_number, channelIndex=end_index,
+                                  channelsModified=self.fetched_modified.get('channels'))
+
+            self._stream_to_mongo('channels', run['channelGuids'], run['channelsNow'], start_batch=run['channelBatches'], start_index=run['channelIndex'], on_batch=channel_batch_stored, refetch=refetch)
+            checkpoint.save(stage='store')
+
+        ## Finish the run, every step here can be repeated if the run is interrupted again
+        if refetch:
+            self.remove_stale_from_mongo('services', run['storedServiceIds'])
+            self.remove_stale_from_mongo('channels', run['storedChannelIds'])
+        elif self.reconcile:
+            self.reconcile_deletions()
+        self._report_skipped()
+
+        # Listings may come from an earlier attempt of the run
+        self.listings = {'services': run['servicesListing'], 'channels': run['channelsListing']}
+        self.commit_sync_watermark('services', self._fetched_watermark('services', run['servicesListingStarted'], run['servicesLuTime']))
+        self.commit_sync_watermark('channels', self._fetched_watermark('channels', run['channelsListingStarted'], run['channelsLuTime']))
+        self.commit_output_mode()
+
+        self._store_municipalities()
+        checkpoint.complete()
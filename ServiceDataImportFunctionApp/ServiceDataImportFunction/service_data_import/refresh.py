@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+import time
+import uuid
+from typing import Any, Callable, Optional
+
+
+def parse_refresh_message(body: Any) -> tuple:
+    """
+    Return ( service ids, channel ids ) of a refresh message
+
+    The body is JSON like {"services": [guids], "channels": [guids]}, either
+    key may be left out. Raises ValueError for anything else.
+    """
+    if isinstance(body, (bytes, bytearray)):
+        body = body.decode('utf-8')
+    message = json.loads(body) if isinstance(body, str) else body
+    if not isinstance(message, dict):
+        raise ValueError("Refresh message is not an object")
+    ids = []
+    for key in ['services', 'channels']:
+        guids = message.get(key) or []
+        if not isinstance(guids, list):
+            raise ValueError("Refresh message " + key + " is not a list")
+        for guid in guids:
+            # PTV ids are GUIDs, anything else would only cost a request
+            uuid.UUID(str(guid))
+        ids.append([str(guid).lower() for guid in guids])
+    return(tuple(ids))
+
+
+class RefreshCoalescer():
+    """
+    Debounces and merges refresh requests of the same GUIDs
+
+    Every request of a GUID gets a ticket number. A GUID with requests that
+    no refresh has started to cover yet is pending, and further requests of
+    it are merged into the pending one. A pending GUID is refreshed once no
+    new request of it has arrived for window seconds, together with every
+    other GUID that is ready by then. Refreshes run one at a time, so
+    requests arriving during a refresh are merged into the next one instead
+    of being dropped: a refresh only covers the tickets handed out before it
+    started.
+
+    Args
+    ----------
+    window : float ( default 2 )
+        Seconds without new requests of a GUID before it is refreshed
+
+    clock : Callable ( default time.monotonic )
+        Returns the current time in seconds
+
+
+    Methods
+    -------
+    request( service_ids: list, channel_ids: list )
+        Register requests, returns their tickets
+
+    next_claim( tickets: dict )
+        Wait until the tickets are covered, returning None, or until pending GUIDs are ready, returning ( service ids, channel ids ) to refresh now
+
+    release( service_ids: list, channel_ids: list, refreshed: bool )
+        End a claimed refresh, its tickets are covered only if it succeeded
+
+    """
+
+    def __init__(self, window: float = 2, clock: Optional[Callable[[], float]] = None) -> None:
+        self.window = window
+        self.clock = clock if clock is not None else time.monotonic
+        # Latest ticket, time of the latest request and the latest covered ticket of GUIDs with uncovered tickets
+        self.tickets = {}
+        self.requested = {}
+        self.covered = {}
+        # Tickets the refresh in flight covers once it succeeds
+        self.in_flight = {}
+        self.coalesced = 0
+        self._condition = threading.Condition()
+
+    def _is_pending(self, key: tuple) -> bool:
+        return(self.tickets.get(key, 0) > max(self.covered.get(key, 0), self.in_flight.get(key, 0)))
+
+    def request(self, service_ids: list, channel_ids: list) -> dict:
+        now = self.clock()
+        tickets = {}
+        with self._condition:
+            for key in [('services', guid) for guid in service_ids] + [('channels', guid) for guid in channel_ids]:
+                if key in tickets or self._is_pending(key):
+                    # Merged into a request that no refresh has started to cover yet
+                    self.coalesced = self.coalesced + 1
+                else:
+                    self.tickets[key] = self.tickets.get(key, 0) + 1
+                self.requested[key] = now
+                tickets[key] = self.tickets[key]
+            self._condition.notify_all()
+        return(tickets)
+
+    def _is_covered(self, tickets: dict) -> bool:
+        # Fully covered GUIDs are forgotten, so a missing GUID is covered
+        return(all(key not in self.tickets or self.covered.get(key, 0) >= ticket for key, ticket in tickets.items()))
+
+    def next_claim(self, tickets: dict) -> Optional[tuple]:
+        with self._condition:
+            while True:
+                if self._is_covered(tickets):
+                    return(None)
+                delay = None
+                if len(self.in_flight) == 0:
+                    now = self.clock()
+                    ready = []
+                    for key in self.tickets:
+                        if not self._is_pending(key):
+                            continue
+                        remaining = self.window - (now - self.requested[key])
+                        if remaining <= 0:
+                            ready.append(key)
+                        elif delay is None or remaining < delay:
+                            delay = remaining
+                    if len(ready) > 0:
+                        for key in ready:
+                            self.in_flight[key] = self.tickets[key]
+                        return(([guid for collection, guid in ready if collection == 'services'],
+                                [guid for collection, guid in ready if collection == 'channels']))
+                # Waits for the refresh in flight, or for the next pending GUID to be ready
+                self._condition.wait(delay)
+
+    def release(self, service_ids: list, channel_ids: list, refreshed: bool) -> None:
+        with self._condition:
+            for key in [('services', guid) for guid in service_ids] + [('channels', guid) for guid in channel_ids]:
+                ticket = self.in_flight.pop(key, 0)
+                if refreshed:
+                    self.covered[key] = max(self.covered.get(key, 0), ticket)
+                if self.covered.get(key, 0) >= self.tickets.get(key, 0):
+                    for state in [self.tickets, self.requested, self.covered]:
+                        state.pop(key, None)
+            self._condition.notify_all()
+
+
+def _add_counts(total: Optional[dict], result: dict) -> dict:
+    if total is None:
+        return(result)
+    for collection, counts in result.items():
+        total_counts = total.setdefault(collection, {})
+        for key, value in counts.items():
+            total_counts[key] = total_counts.get(key, 0) + value
+    return(total)
+
+
+def handle_refresh_messages(importer: Any, coalescer: RefreshCoalescer, bodies: list) -> Optional[dict]:
+    """
+    Refresh the GUIDs of a batch of message bodies
+
+    Malformed messages are reported and skipped so they do not block the
+    rest of the batch. Returns once every GUID of the batch is covered by a
+    refresh that started after it was requested, either one made here or
+    one of a concurrent batch. Returns the summed counts of the refreshes
+    made here, None if there were none. If a refresh fails the error is
+    raised so the messages are delivered again.
+    """
+    service_ids = []
+    channel_ids = []
+    for body in bodies:
+        try:
+            message_services, message_channels = parse_refresh_message(body)
+        except ValueError as error:
+            print("Skipped malformed refresh message:", error)
+            continue
+        service_ids.extend(message_services)
+        channel_ids.extend(message_channels)
+    coalesced_before = coalescer.coalesced
+    tickets = coalescer.request(service_ids, channel_ids)
+    print(len(bodies), "refresh messages with", len(service_ids) + len(channel_ids), "ids,", coalescer.coalesced - coalesced_before, "merged into pending requests.")
+    result = None
+    while True:
+        claim = coalescer.next_claim(tickets)
+        if claim is None:
+            return(result)
+        claimed_services, claimed_channels = claim
+        try:
+            refreshed = importer.refresh(claimed_services, claimed_channels)
+        except Exception:
+            coalescer.release(claimed_services, claimed_channels, False)
+            raise
+        coalescer.release(claimed_services, claimed_channels, True)
+        result = _add_counts(result, refreshed)
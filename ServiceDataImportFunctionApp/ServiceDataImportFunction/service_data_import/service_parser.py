@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Single pass parser for PTV service documents
+
+Every multilingual list is walked once and its values are grouped by
+language, instead of filtering the same list again for every language.
+"""
+languages = ('en', 'fi', 'sv')
+
+
+def values_by_language(items: list) -> dict:
+    """
+    Group not None values of multilingual items by language
+    """
+    buckets = {'en': [], 'fi': [], 'sv': []}
+    for item in items:
+        bucket = buckets.get(item.get('language'))
+        if bucket is not None:
+            value = item.get('value')
+            if value is not None:
+                bucket.append(value)
+    return(buckets)
+
+
+def join_or_none(values: list) -> str:
+    if len(values) > 0:
+        return(' - '.join(values))
+    return(None)
+
+
+def _descriptions_by_language(items: list) -> dict:
+    buckets = {'en': [], 'fi': [], 'sv': []}
+    for item in items:
+        bucket = buckets.get(item.get('language'))
+        if bucket is not None and item.get('value') is not None:
+            bucket.append({'value': item.get('value'), 'type': item.get('type')})
+    return(buckets)
+
+
+def _parse_organizations(organizations: list) -> list:
+    organization_elements = []
+    for organization in organizations:
+        role_type = organization.get('roleType')
+        if organization.get('organization') is not None:
+            organization_el = organization.get('organization')
+            organization_el['roleType'] = role_type
+            organization_elements.append(organization_el)
+        else:
+            if len(organization.get('additionalInformation')) > 0:
+                org_name = organization.get('additionalInformation')[0]['value']
+                organization_el = {'name': org_name, 'id': None, 'roleType': role_type}
+                organization_elements.append(organization_el)
+    return(organization_elements)
+
+
+def parse_service_info(service: dict) -> dict:
+    service_final = {}
+    service_final['id'] = service.get('id')
+    service_final['type'] = service.get('type')
+    service_final['subtype'] = service.get('subType')
+    service_final['channelIds'] = [channel.get('serviceChannel').get('id') for channel in service.get('serviceChannels')]
+    service_final['organizations'] = _parse_organizations(service.get('organizations'))
+
+    names = values_by_language(service.get('serviceNames'))
+    descriptions = _descriptions_by_language(service.get('serviceDescriptions'))
+    requirements = values_by_language(service.get('requirements'))
+    service_final['name'] = {language: join_or_none(names[language]) for language in languages}
+    service_final['descriptions'] = descriptions
+    service_final['requirement'] = {language: " ".join(requirements[language]) for language in languages}
+
+    target_groups = {'en': [], 'fi': [], 'sv': []}
+    for target_group in service.get('targetGroups'):
+        target_group_code = target_group.get('code')
+        target_group_names = values_by_language(target_group.get('name'))
+        for language in languages:
+            target_groups[language].append({"name": " ".join(target_group_names[language]),
+                                            "code": target_group_code})
+    service_final['targetGroups'] = target_groups
+
+    service_classes = {'en': [], 'fi': [], 'sv': []}
+    for service_class in service.get('serviceClasses'):
+        service_class_code = service_class.get('code')
+        service_class_names = values_by_language(service_class.get('name'))
+        service_class_descriptions = values_by_language(service_class.get('description'))
+        for language in languages:
+            service_classes[language].append({"name": join_or_none(service_class_names[language]),
+                                              "description": " ".join(service_class_descriptions[language]),
+                                              "code": service_class_code})
+    service_final['serviceClasses'] = service_classes
+
+    areas = {'en': [], 'fi': [], 'sv': []}
+    for area in service.get('areas'):
+        area_type = area.get('type')
+        if area_type == 'Municipality':
+            area = area.get('municipalities')[0]
+        area_code = area.get('code')
+        area_names = values_by_language(area.get('name'))
+        for language in languages:
+            areas[language].append({"name": join_or_none(area_names[language]),
+                                    "type": area_type,
+                                    "code": area_code})
+    service_final['areas'] = areas
+
+    life_events = {'en': [], 'fi': [], 'sv': []}
+    for life_event in service.get('lifeEvents'):
+        life_event_code = life_event.get('code')
+        life_event_names = values_by_language(life_event.get('name'))
+        for language in languages:
+            life_events[language].append({"name": join_or_none(life_event_names[language]),
+                                          "code": life_event_code})
+    service_final['lifeEvents'] = life_events
+
+    return(service_final)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+import gzip
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime
+from typing import Any, Iterator, Optional
+from .http_cache import CachedResponse
+
+# Items per gzip member, a lookup decompresses one member
+member_size = 500
+code_list_paths = {'municipalities': "/CodeList/GetMunicipalityCodes", 'provinces': "/CodeList/GetAreaCodes/type/Province"}
+
+
+class RawSnapshot():
+    """
+    Append-only store of raw PTV responses of one import run
+
+    Every collection is a gzip file of JSON lines, written as independent
+    gzip members of at most member_size items, so the file can be read as a
+    stream and appended to without rewriting it. Next to it an index of
+    JSON lines holds [ guid, fetch time, member offset, member length, line ]
+    for every item, so a single item can be read by decompressing one member.
+
+    Args
+    ----------
+    directory : str
+        Directory of the snapshots, every run has a subdirectory
+
+    run_id : str ( default None )
+        Run to open, a new run named by the current time if not given
+
+
+    Methods
+    -------
+    runs( directory: str )
+        Return run ids of the directory from oldest to newest
+
+    latest( directory: str )
+        Open the newest run of the directory
+
+    prune( directory: str, keep_runs: int, max_age_days: float, keep: list )
+        Remove runs beyond the keep_runs last written and runs last written longer ago than max_age_days, returns their ids
+
+    write( collection: str, items: list, fetched: datetime = None )
+        Append raw items fetched at the given time
+
+    items( collection: str )
+        Iterate over raw items in the order they were written
+
+    lookup( collection: str, guid: str, fetched_before: datetime = None )
+        Return the latest raw item with the guid fetched before the given time
+
+    code_list( name: str )
+        Return the raw municipality or province code list of the run
+
+    """
+
+    def __init__(self, directory: str, run_id: Optional[str] = None) -> None:
+        if run_id is None:
+            run_id = datetime.utcnow().strftime("%Y%m%dT%H%M%S") + "_" + uuid.uuid4().hex[:8]
+        self.run_id = run_id
+        self.path = os.path.join(directory, run_id)
+        os.makedirs(self.path, exist_ok=True)
+        self.counts = {}
+        self._index = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def runs(cls, directory: str) -> list:
+        if not os.path.isdir(directory):
+            return([])
+        return(sorted(name for name in os.listdir(directory) if os.path.isdir(os.path.join(directory, name))))
+
+    @classmethod
+    def latest(cls, directory: str) -> 'RawSnapshot':
+        runs = cls.runs(directory)
+        if len(runs) == 0:
+            raise Exception("No snapshots in " + directory)
+        return(cls(directory, runs[-1]))
+
+    @classmethod
+    def _last_written(cls, path: str) -> float:
+        # Resumed runs append to files of an older directory
+        times = [os.path.getmtime(path)]
+        for name in os.listdir(path):
+            try:
+                times.append(os.path.getmtime(os.path.join(path, name)))
+            except OSError:
+                pass
+        return(max(times))
+
+    @classmethod
+    def prune(cls, directory: str, keep_runs: Optional[int] = None, max_age_days: Optional[float] = None, keep: Optional[list] = None) -> list:
+        oldest = time.time() - max_age_days*24*60*60 if max_age_days is not None else None
+        last_written = {run_id: cls._last_written(os.path.join(directory, run_id)) for run_id in cls.runs(directory)}
+        removed = []
+        for position, run_id in enumerate(sorted(last_written, key=last_written.get, reverse=True)):
+            if keep is not None and run_id in keep:
+                continue
+            if (keep_runs is not None and position >= keep_runs) or (oldest is not None and last_written[run_id] < oldest):
+                shutil.rmtree(os.path.join(directory, run_id), ignore_errors=True)
+                removed.append(run_id)
+        return(removed)
+
+    def _data_path(self, collection: str) -> str:
+        return(os.path.join(self.path, collection + ".jsonl.gz"))
+
+    def _index_path(self, collection: str) -> str:
+        return(os.path.join(self.path, collection + ".idx"))
+
+    def write(self, collection: str, items: list, fetched: Optional[datetime] = None) -> None:
+        fetched_str = (fetched if fetched is not None else datetime.utcnow()).isoformat()
+        with self._lock:
+            with open(self._data_path(collection), 'ab') as data_file, open(self._index_path(collection), 'a', encoding='utf-8') as index_file:
+                for start in range(0, len(items), member_size):
+                    member_items = items[start:start + member_size]
+                    member = gzip.compress("".join(json.dumps(item, ensure_ascii=False) + "\n" for item in member_items).encode('utf-8'))
+                    offset = data_file.tell()
+                    data_file.write(member)
+                    for line, item in enumerate(member_items):
+                        index_file.write(json.dumps([item.get('id'), fetched_str, offset, len(member), line]) + "\n")
+            self.counts[collection] = self.counts.get(collection, 0) + len(items)
+            self._index.pop(collection, None)
+
+    def items(self, collection: str) -> Iterator[Any]:
+        if not os.path.exists(self._data_path(collection)):
+            return
+        with gzip.open(self._data_path(collection), 'rt', encoding='utf-8') as data_file:
+            for line in data_file:
+                yield json.loads(line)
+
+    def _load_index(self, collection: str) -> dict:
+        with self._lock:
+            if collection not in self._index:
+                index = {}
+                if os.path.exists(self._index_path(collection)):
+                    with open(self._index_path(collection), encoding='utf-8') as index_file:
+                        for line in index_file:
+                            guid, fetched, offset, length, line_number = json.loads(line)
+                            index.setdefault(guid, []).append((datetime.fromisoformat(fetched), offset, length, line_number))
+                self._index[collection] = index
+            return(self._index[collection])
+
+    def lookup(self, collection: str, guid: str, fetched_before: Optional[datetime] = None) -> Optional[Any]:
+        entries = [entry for entry in self._load_index(collection).get(guid, []) if fetched_before is None or entry[0] <= fetched_before]
+        if len(entries) == 0:
+            return(None)
+        fetched, offset, length, line_number = max(entries, key=lambda entry: entry[0])
+        with open(self._data_path(collection), 'rb') as data_file:
+            data_file.seek(offset)
+            member = zlib.decompress(data_file.read(length), 16 + zlib.MAX_WBITS)
+        return(json.loads(member.decode('utf-8').splitlines()[line_number]))
+
+    def code_list(self, name: str) -> Any:
+        raw_code_list = self.lookup('code_lists', name)
+        if raw_code_list is None:
+            raise Exception("Snapshot has no code list " + name)
+        return(raw_code_list.get('items'))
+
+
+class SnapshotSession():
+    """
+    Session that answers code list requests from a raw snapshot
+
+    Lets an importer be built without network access for replaying a
+    snapshot, any other request raises.
+
+    Args
+    ----------
+    snapshot : RawSnapshot
+        Snapshot with the code lists
+
+    """
+
+    def __init__(self, snapshot: RawSnapshot) -> None:
+        self.snapshot = snapshot
+
+    def get(self, url: str, **kwargs) -> CachedResponse:
+        path = url.split('?')[0]
+        for name, code_list_path in code_list_paths.items():
+            if path.endswith(code_list_path):
+                return(CachedResponse(url, json.dumps(self.snapshot.code_list(name)).encode('utf-8'), {}))
+        raise Exception("Snapshot has no response for " + url)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+from typing import Iterable
+
+
+class SuitabilityFilter():
+    """
+    Region and target group checks of parsed services and channels
+
+    Codes are held in frozensets that are built once, so every check is a
+    hashed lookup instead of a scan over the region's code lists.
+
+    Args
+    ----------
+    municipality_codes : Iterable
+        Codes of the municipalities of the region
+
+    province_codes : Iterable
+        Codes of the provinces of the region
+
+    target_groups : Iterable
+        Target group codes of which a service must have at least one if it has any
+
+
+    Methods
+    -------
+    from_regions( municipalities: list, provinces: list, target_groups: Iterable )
+        Build a filter from municipality and province code list entries
+
+    is_suitable_service( service: dict )
+        Check target groups and areas of a parsed service
+
+    is_suitable_channel( channel: dict )
+        Check that a parsed service location is inside the region
+
+    filter( collection: str, items: list )
+        Return the suitable items of a parsed batch of services or channels
+
+    """
+
+    def __init__(self, municipality_codes: Iterable, province_codes: Iterable, target_groups: Iterable) -> None:
+        self.municipality_codes = frozenset(municipality_codes)
+        self.province_codes = frozenset(province_codes)
+        self.target_groups = frozenset(target_groups)
+
+    @classmethod
+    def from_regions(cls, municipalities: list, provinces: list, target_groups: Iterable) -> 'SuitabilityFilter':
+        return(cls([municipality.get('id') for municipality in municipalities],
+                   [province.get('code') for province in provinces],
+                   target_groups))
+
+    def is_suitable_service(self, service: dict) -> bool:
+        target_groups = service.get('targetGroups')['fi']
+        if len(target_groups) > 0 and self.target_groups.isdisjoint([target_group.get('code') for target_group in target_groups]):
+            return(False)
+        areas = service.get('areas')['fi']
+        if len(areas) == 0:
+            return(True)
+        for area in areas:
+            area_type = area.get('type')
+            if area_type == 'Municipality':
+                if area.get('code') in self.municipality_codes:
+                    return(True)
+            elif area_type == 'Province' or area_type == 'Region':
+                if area.get('code') in self.province_codes:
+                    return(True)
+        return(False)
+
+    def is_suitable_channel(self, channel: dict) -> bool:
+        if channel.get('type') != 'ServiceLocation':
+            return(True)
+        addresses = channel.get('addresses')['fi']
+        if len(addresses) == 0:
+            return(True)
+        return(not self.municipality_codes.isdisjoint([address.get('municipalityCode') for address in addresses]))
+
+    def filter(self, collection: str, items: list) -> list:
+        if collection == "services":
+            is_suitable = self.is_suitable_service
+        elif collection == "channels":
+            is_suitable = self.is_suitable_channel
+        else:
+            raise Exception("Collection not recognized")
+        return([item for item in items if is_suitable(item)])
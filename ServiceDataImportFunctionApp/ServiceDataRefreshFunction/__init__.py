@@ -0,0 +1,24 @@
+import logging
+import os
+from typing import List
+import azure.functions as func
+
+from ..ServiceDataImportFunction.service_data_import.ptv_importer import *
+from ..ServiceDataImportFunction.service_data_import.refresh import RefreshCoalescer, handle_refresh_messages
+
+# Kept between invocations, so code lists and indexes are set up once per worker
+service_data_importer = None
+coalescer = RefreshCoalescer(float(os.environ.get("PTV_REFRESH_WINDOW_SECONDS", "2")))
+
+def main(messages: List[func.ServiceBusMessage]) -> None:
+    global service_data_importer
+    utc_timestamp = datetime.utcnow().replace(
+        tzinfo=timezone.utc).isoformat()
+
+    logging.info("Refreshing services and channels of {} messages {}".format(len(messages), utc_timestamp))
+    if service_data_importer is None:
+        service_data_importer = PTVImporter()
+    result = handle_refresh_messages(service_data_importer, coalescer, [message.get_body() for message in messages])
+    utc_timestamp2 = datetime.utcnow().replace(
+        tzinfo=timezone.utc).isoformat()
+    logging.info("Finished refresh {} {}".format(result, utc_timestamp2))
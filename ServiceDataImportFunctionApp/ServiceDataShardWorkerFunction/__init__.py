@@ -0,0 +1,16 @@
+import logging
+import azure.functions as func
+
+from ..ServiceDataImportFunction.service_data_import.ptv_importer import *
+
+def main(message: func.ServiceBusMessage) -> None:
+    utc_timestamp = datetime.utcnow().replace(
+        tzinfo=timezone.utc).isoformat()
+
+    # Every message is one worker, the importer is not shared with the other workers of this replica
+    logging.info("Shard worker woken up by {} at {}".format(message.get_body().decode('utf-8'), utc_timestamp))
+    service_data_importer = PTVImporter(sharded=True)
+    service_data_importer.import_services(join_only=True)
+    utc_timestamp2 = datetime.utcnow().replace(
+        tzinfo=timezone.utc).isoformat()
+    logging.info("Shard worker finished at {}".format(utc_timestamp2))
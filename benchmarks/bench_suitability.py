@@ -0,0 +1,59 @@
+"""
+Suitability filtering at full-country scale, old list scans against the frozenset filter
+
+Run from the repository root: python benchmarks/bench_suitability.py
+"""
+import sys
+sys.path.append('ServiceDataImportFunctionApp/ServiceDataImportFunction')
+sys.path.append('test')
+import argparse
+import random
+import time
+from service_data_import.suitability import SuitabilityFilter
+from service_data_import.service_parser import parse_service_info
+from service_data_import.channel_parser import parse_channel_info
+from test_service_parser import random_service
+from test_channel_parser import random_channel
+from test_suitability import reference_is_suitable_service, reference_is_suitable_channel, suitable_target_groups
+
+
+def best_of(repeats, function):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return(min(timings), result)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--services', type=int, default=40000)
+    parser.add_argument('--channels', type=int, default=40000)
+    parser.add_argument('--municipalities', type=int, default=309)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    # Whole country: every municipality and province is in the region
+    municipalities = [{'id': str(code)} for code in rng.sample(range(1, 1000), args.municipalities)]
+    provinces = [{'code': str(code)} for code in range(1, 22)]
+    services = [parse_service_info(random_service(rng)) for _ in range(args.services)]
+    channels = [parse_channel_info(random_channel(rng)) for _ in range(args.channels)]
+
+    suitability = SuitabilityFilter.from_regions(municipalities, provinces, suitable_target_groups)
+    cases = [('services', services,
+              lambda: [service for service in services if reference_is_suitable_service(service, municipalities, provinces)]),
+             ('channels', channels,
+              lambda: [channel for channel in channels if reference_is_suitable_channel(channel, municipalities)])]
+    for collection, items, reference in cases:
+        old_seconds, expected = best_of(args.repeats, reference)
+        new_seconds, filtered = best_of(args.repeats, lambda: suitability.filter(collection, items))
+        if filtered != expected:
+            raise Exception("Filtered " + collection + " differ")
+        print("{}: {} items, lists {:.3f} s, frozensets {:.3f} s, {:.1f}x".format(
+            collection, len(items), old_seconds, new_seconds, old_seconds / new_seconds))
+
+
+if __name__ == '__main__':
+    main()
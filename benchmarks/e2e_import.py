@@ -0,0 +1,149 @@
+"""
+End-to-end import runs against the local PTV API stand-in
+
+Starts the stand-in with generated or recorded data, runs import_services()
+into an in-memory Mongo and reports throughput and request latencies.
+An incremental run first imports everything, then modifies a share of the
+items and times the second import.
+
+    python benchmarks/e2e_import.py --size 20000 --latency-ms 40 --jitter-ms 40
+    python benchmarks/e2e_import.py --mode incremental --changed 0.05 --engine async
+    python benchmarks/e2e_import.py --error-rate 0.02 --rate-limit 200 --output e2e.json
+    python benchmarks/e2e_import.py --output-mode normalised
+    python benchmarks/e2e_import.py --fetch-strategy auto
+
+Errors and rate limits need the adaptive controller for retries, it is
+enabled whenever either is set.
+"""
+import sys
+sys.path.append('ServiceDataImportFunctionApp/ServiceDataImportFunction')
+sys.path.append('benchmarks')
+import argparse
+import contextlib
+import io
+import json
+import threading
+import time
+import bson
+import requests
+from service_data_import.adaptive import AdaptiveController
+from service_data_import.ptv_importer import PTVImporter
+from memory_mongo import MemoryClient
+from ptv_standin import PTVData, StandinConfig, StandinServer
+
+
+class TimingSession():
+    """
+    requests.Session that records the latency of every request
+    """
+
+    def __init__(self, session=None):
+        self.session = session if session is not None else requests.Session()
+        self.latencies = []
+        self._lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        start = time.perf_counter()
+        response = self.session.get(url, **kwargs)
+        with self._lock:
+            self.latencies.append(time.perf_counter() - start)
+        return(response)
+
+
+def percentile(values, share):
+    if len(values) == 0:
+        return(None)
+    ordered = sorted(values)
+    return(ordered[min(len(ordered) - 1, int(share * len(ordered)))])
+
+
+def stored_bytes(client, collection):
+    return(sum(len(bson.BSON.encode(document)) for document in client.service_db.get_collection(collection).find({}, {'_id': 0})))
+
+
+def run_import(client, server, engine, streaming, write_mode, adaptive, output_mode=None, fetch_strategy=None):
+    session = TimingSession()
+    controller = AdaptiveController() if adaptive else None
+    statuses_before = dict(server.statuses)
+    with contextlib.redirect_stdout(io.StringIO()):
+        importer = PTVImporter(client, session, engine=engine, streaming=streaming, write_mode=write_mode,
+                               controller=controller, api_url=server.api_url, output_mode=output_mode, fetch_strategy=fetch_strategy)
+        start = time.perf_counter()
+        importer.import_services()
+        seconds = time.perf_counter() - start
+    listed = sum(listing.get('items') or 0 for listing in importer.listings.values())
+    fetched = sum(stage['documents_out'] for stage in importer.metrics.summary()['stages'] if stage['stage'] == 'fetching')
+    latencies = session.latencies
+    return({'seconds': seconds,
+            'listed': listed,
+            'fetched': fetched,
+            'documents_per_second': fetched / seconds if seconds > 0 else None,
+            'requests': len(latencies),
+            'bytes': importer.meter.bytes,
+            'fetch_strategy': importer.active_fetch_strategy or importer.fetch_strategy,
+            'statuses': {str(status): count - statuses_before.get(status, 0) for status, count in server.statuses.items()},
+            'latency_ms': {name: percentile(latencies, share) * 1000 if len(latencies) > 0 else None
+                           for name, share in [('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0)]},
+            'stored': {collection: client.service_db.get_collection(collection).count_documents({}) for collection in ['services', 'channels']},
+            'stored_bytes': {collection: stored_bytes(client, collection) for collection in ['services', 'channels', 'codes']}})
+
+
+def print_run(name, run):
+    print(name)
+    print("  {:.2f} s, {} listed, {} fetched, {:.1f} documents/s".format(run['seconds'], run['listed'], run['fetched'], run['documents_per_second'] or 0))
+    print("  {} requests, {} bytes, services listed by {}, statuses {}".format(run['requests'], run['bytes'], run['fetch_strategy'], run['statuses']))
+    print("  latency ms p50 {p50:.1f} p90 {p90:.1f} p99 {p99:.1f} max {max:.1f}".format(**run['latency_ms']) if run['requests'] > 0 else "  no requests")
+    print("  stored {services} services and {channels} channels".format(**run['stored']))
+    print("  stored bytes: services {services}, channels {channels}, codes {codes}".format(**run['stored_bytes']))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', choices=['full', 'incremental'], default='full')
+    parser.add_argument('--size', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--recording', help="Directory written by ptv_standin.py record, generated data if not given")
+    parser.add_argument('--changed', type=float, default=0.05, help="Share of items modified before an incremental run")
+    parser.add_argument('--engine', choices=['sync', 'async'], default='sync')
+    parser.add_argument('--streaming', action='store_true')
+    parser.add_argument('--write-mode', choices=['upsert', 'delete_insert'], default='upsert')
+    parser.add_argument('--adaptive', action='store_true')
+    parser.add_argument('--output-mode', choices=['denormalised', 'normalised'], default='denormalised')
+    parser.add_argument('--fetch-strategy', choices=['country', 'province', 'municipality', 'auto'], default='country')
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=float, help="Requests per second")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    args = parser.parse_args()
+    if args.streaming and args.engine != 'sync':
+        parser.error("--streaming fetches with the sync engine only")
+
+    data = PTVData.load(args.recording) if args.recording else PTVData.generated(args.size, args.seed)
+    config = StandinConfig(args.page_size, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                           error_rate=args.error_rate, rate_limit=args.rate_limit, seed=args.seed)
+    adaptive = args.adaptive or args.error_rate > 0 or args.rate_limit is not None
+    server = StandinServer(data, config).start()
+    client = MemoryClient()
+    results = {'mode': args.mode, 'items': len(data.services) + len(data.channels), 'engine': args.engine,
+               'streaming': args.streaming, 'write_mode': args.write_mode, 'adaptive': adaptive, 'output_mode': args.output_mode,
+               'fetch_strategy': args.fetch_strategy, 'runs': {}}
+    try:
+        results['runs']['full'] = run_import(client, server, args.engine, args.streaming, args.write_mode, adaptive, args.output_mode, args.fetch_strategy)
+        print_run("Full import", results['runs']['full'])
+        if args.mode == 'incremental':
+            results['changed'] = len(data.touch(args.changed, args.seed + 1))
+            results['runs']['incremental'] = run_import(client, server, args.engine, args.streaming, args.write_mode, adaptive, args.output_mode, args.fetch_strategy)
+            print_run("Incremental import, {} items changed".format(results['changed']), results['runs']['incremental'])
+    finally:
+        server.stop()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump(results, output_file, indent=2)
+        print("Results written to", args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+Local stand-in for the Service Bus queue of refresh messages
+
+Messages are received in batches like the function receives them with
+cardinality many. A batch whose handler fails is put back and delivered
+again, and a message delivered max_deliveries times is dead-lettered.
+
+    python benchmarks/local_queue.py --size 2000 --messages 50 --duplicates 0.5
+
+runs the refresh entry point against the PTV API stand-in and reports
+how long the refreshes took.
+"""
+import sys
+sys.path.append('ServiceDataImportFunctionApp/ServiceDataImportFunction')
+sys.path.append('benchmarks')
+import argparse
+import collections
+import contextlib
+import io
+import json
+import random
+import threading
+import time
+
+
+class LocalMessage():
+
+    def __init__(self, body, message_id):
+        self.body = body
+        self.message_id = message_id
+        self.delivery_count = 0
+
+    def get_body(self):
+        return(self.body)
+
+
+class LocalQueue():
+
+    def __init__(self, max_deliveries=10):
+        self.max_deliveries = max_deliveries
+        self.messages = collections.deque()
+        self.dead_letters = []
+        self._lock = threading.Lock()
+        self._sent = 0
+
+    def send(self, body):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        with self._lock:
+            self._sent = self._sent + 1
+            self.messages.append(LocalMessage(body, str(self._sent)))
+
+    def receive_batch(self, max_count=32):
+        with self._lock:
+            batch = [self.messages.popleft() for _ in range(min(max_count, len(self.messages)))]
+        for message in batch:
+            message.delivery_count = message.delivery_count + 1
+        return(batch)
+
+    def abandon(self, batch):
+        with self._lock:
+            for message in batch:
+                if message.delivery_count >= self.max_deliveries:
+                    self.dead_letters.append(message)
+                else:
+                    self.messages.append(message)
+
+    def run(self, handler, max_count=32):
+        """
+        Deliver batches to handler until the queue is empty, returns handler results
+        """
+        results = []
+        while True:
+            batch = self.receive_batch(max_count)
+            if len(batch) == 0:
+                return(results)
+            try:
+                results.append(handler(batch))
+            except Exception as error:
+                print("Refresh batch failed:", error)
+                self.abandon(batch)
+
+
+def main():
+    from service_data_import.ptv_importer import PTVImporter
+    from service_data_import.refresh import RefreshCoalescer, handle_refresh_messages
+    from e2e_import import TimingSession, percentile
+    from memory_mongo import MemoryClient
+    from ptv_standin import PTVData, StandinConfig, StandinServer
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=2000)
+    parser.add_argument('--messages', type=int, default=50)
+    parser.add_argument('--ids-per-message', type=int, default=3)
+    parser.add_argument('--duplicates', type=float, default=0.3, help="Share of ids repeated from earlier messages")
+    parser.add_argument('--batch', type=int, default=8, help="Messages per function invocation")
+    parser.add_argument('--window', type=float, default=0.0, help="Debounce window in seconds")
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    args = parser.parse_args()
+
+    data = PTVData.generated(args.size)
+    server = StandinServer(data, StandinConfig(latency_ms=args.latency_ms)).start()
+    rng = random.Random(1)
+    service_ids = list(data.services)
+    queue = LocalQueue()
+    sent = []
+    for _ in range(args.messages):
+        ids = [rng.choice(sent) if len(sent) > 0 and rng.random() < args.duplicates else rng.choice(service_ids) for _ in range(args.ids_per_message)]
+        sent.extend(ids)
+        queue.send({'services': ids})
+
+    session = TimingSession()
+    with contextlib.redirect_stdout(io.StringIO()):
+        importer = PTVImporter(MemoryClient(), session, api_url=server.api_url)
+    coalescer = RefreshCoalescer(args.window)
+    timings = []
+
+    def handler(batch):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = handle_refresh_messages(importer, coalescer, [message.get_body() for message in batch])
+        timings.append(time.perf_counter() - start)
+        return(result)
+
+    try:
+        queue.run(handler, args.batch)
+    finally:
+        server.stop()
+    print("{} messages in {} batches, {} ids coalesced, {} requests".format(args.messages, len(timings), coalescer.coalesced, len(session.latencies)))
+    print("refresh seconds p50 {:.3f} p90 {:.3f} max {:.3f}".format(percentile(timings, 0.5), percentile(timings, 0.9), max(timings)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+"""
+In-memory stand-in for the parts of MongoClient the importer uses
+
+Documents are round-tripped through BSON on write like they are on the
+way to a server, so the write path costs something comparable. Queries
+support equality, $in, $nin, $ne, $lt and $or, and lookups by id are
+served from a dict.
+"""
+from bson import BSON, ObjectId
+from pymongo import DESCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+
+class Result():
+
+    def __init__(self, **counts):
+        for name, value in counts.items():
+            setattr(self, name, value)
+
+
+def matches(document, query):
+    for field, condition in query.items():
+        if field == '$or':
+            if not any(matches(document, alternative) for alternative in condition):
+                return(False)
+            continue
+        value = document.get(field)
+        if isinstance(condition, dict):
+            if '$in' in condition and value not in condition['$in']:
+                return(False)
+            if '$nin' in condition and value in condition['$nin']:
+                return(False)
+            if '$ne' in condition and value == condition['$ne']:
+                return(False)
+            if '$lt' in condition and not (value is not None and value < condition['$lt']):
+                return(False)
+            if '$gte' in condition and not (value is not None and value >= condition['$gte']):
+                return(False)
+        elif value != condition:
+            return(False)
+    return(True)
+
+
+def project(document, projection):
+    if not projection:
+        return(dict(document))
+    included = [field for field, flag in projection.items() if flag and field != '_id']
+    if len(included) == 0:
+        # Exclusion projection, everything but the excluded fields
+        projected = {field: value for field, value in document.items() if projection.get(field, 1)}
+        return(projected)
+    projected = {field: document[field] for field in included if field in document}
+    if projection.get('_id', 1):
+        projected['_id'] = document['_id']
+    return(projected)
+
+
+def apply(document, update):
+    document.update(update.get('$set', {}))
+    for field, amount in update.get('$inc', {}).items():
+        document[field] = document.get(field, 0) + amount
+    for field, values in update.get('$push', {}).items():
+        document[field] = document.get(field, []) + values['$each']
+
+
+class Cursor():
+
+    def __init__(self, documents):
+        self.documents = documents
+
+    def sort(self, field, direction=1):
+        present = [document for document in self.documents if document.get(field) is not None]
+        missing = [document for document in self.documents if document.get(field) is None]
+        present.sort(key=lambda document: document[field], reverse=direction == DESCENDING)
+        self.documents = present + missing
+        return(self)
+
+    def limit(self, count):
+        self.documents = self.documents[:count]
+        return(self)
+
+    def __iter__(self):
+        return(iter(self.documents))
+
+
+class MemoryCollection():
+
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self.documents = {}
+        self.by_id = {}
+        self.indexes = {'_id_': {'key': [('_id', 1)]}}
+
+    def _candidates(self, query):
+        condition = query.get('id')
+        if condition is not None and not isinstance(condition, dict):
+            keys = [self.by_id.get(condition)]
+        elif isinstance(condition, dict) and list(condition) == ['$in']:
+            keys = [self.by_id.get(guid) for guid in condition['$in']]
+        else:
+            return(list(self.documents.values()))
+        return([self.documents[key] for key in keys if key is not None])
+
+    def _put(self, document):
+        document.setdefault('_id', ObjectId())
+        stored = BSON.encode(document).decode()
+        self.documents[stored['_id']] = stored
+        # Only documents with an id are indexed, like the importer's unique index on id
+        if stored.get('id') is not None:
+            old_key = self.by_id.get(stored['id'])
+            if old_key is not None and old_key != stored['_id']:
+                self.documents.pop(old_key, None)
+            self.by_id[stored['id']] = stored['_id']
+
+    def _remove(self, document):
+        self.documents.pop(document['_id'], None)
+        if self.by_id.get(document.get('id')) == document['_id']:
+            del self.by_id[document.get('id')]
+
+    def insert_many(self, documents, ordered=True):
+        for document in documents:
+            self._put(document)
+        return(Result(inserted_ids=[document['_id'] for document in documents]))
+
+    def insert_one(self, document):
+        if document.get('_id') in self.documents:
+            raise DuplicateKeyError("Duplicate _id " + str(document['_id']))
+        self._put(document)
+        return(Result(inserted_id=document['_id']))
+
+    def delete_many(self, query):
+        deleted = [document for document in self._candidates(query) if matches(document, query)]
+        for document in deleted:
+            self._remove(document)
+        return(Result(deleted_count=len(deleted)))
+
+    def find(self, query=None, projection=None):
+        query = query or {}
+        return(Cursor([project(document, projection) for document in self._candidates(query) if matches(document, query)]))
+
+    def find_one(self, query=None, projection=None):
+        found = list(self.find(query, projection).limit(1))
+        return(found[0] if len(found) > 0 else None)
+
+    def bulk_write(self, requests, ordered=True):
+        matched = 0
+        upserted = 0
+        for request in requests:
+            existing = [document for document in self._candidates(request._filter) if matches(document, request._filter)]
+            replacement = dict(request._doc)
+            if len(existing) > 0:
+                matched = matched + 1
+                replacement['_id'] = existing[0]['_id']
+            elif not request._upsert:
+                continue
+            else:
+                upserted = upserted + 1
+            self._put(replacement)
+        return(Result(matched_count=matched, upserted_count=upserted, modified_count=matched))
+
+    def update_one(self, query, update, upsert=False):
+        found = [document for document in self._candidates(query) if matches(document, query)]
+        if len(found) == 0:
+            if not upsert:
+                return(Result(matched_count=0, modified_count=0))
+            document = {field: value for field, value in query.items() if not isinstance(value, dict)}
+            # Like Mongo, an upsert that does not match an existing _id collides with it
+            if document.get('_id') in self.documents:
+                raise DuplicateKeyError("Duplicate _id " + str(document['_id']))
+        else:
+            document = dict(found[0])
+        apply(document, update)
+        self._put(document)
+        return(Result(matched_count=len(found[:1]), modified_count=len(found[:1])))
+
+    def find_one_and_update(self, query, update, sort=None, return_document=ReturnDocument.BEFORE):
+        cursor = self.find(query)
+        for field, direction in reversed(sort or []):
+            cursor.sort(field, direction)
+        found = list(cursor.limit(1))
+        if len(found) == 0:
+            return(None)
+        document = dict(found[0])
+        apply(document, update)
+        self._put(document)
+        return(self.documents[document['_id']] if return_document == ReturnDocument.AFTER else found[0])
+
+    def update_many(self, query, update):
+        found = [document for document in self._candidates(query) if matches(document, query)]
+        for document in found:
+            updated = dict(document)
+            apply(updated, update)
+            self._put(updated)
+        return(Result(matched_count=len(found), modified_count=len(found)))
+
+    def create_index(self, keys, unique=False, name=None):
+        name = name if name is not None else "_".join("{}_{}".format(field, direction) for field, direction in keys)
+        self.indexes[name] = {'key': list(keys), 'unique': unique}
+        return(name)
+
+    def index_information(self):
+        return(dict(self.indexes))
+
+    def drop(self):
+        # Like a pymongo Collection, the object can still be written to after a drop
+        self.documents = {}
+        self.by_id = {}
+        self.indexes = {'_id_': {'key': [('_id', 1)]}}
+
+    def rename(self, new_name, dropTarget=False):
+        if new_name in self.database.collections and not dropTarget:
+            raise Exception("Target namespace exists")
+        self.database.collections.pop(self.name, None)
+        self.name = new_name
+        self.database.collections[new_name] = self
+
+    def count_documents(self, query):
+        return(len([document for document in self._candidates(query) if matches(document, query)]))
+
+
+class MemoryDatabase():
+
+    def __init__(self):
+        self.collections = {}
+
+    def get_collection(self, name):
+        if name not in self.collections:
+            self.collections[name] = MemoryCollection(self, name)
+        return(self.collections[name])
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name == 'collections':
+            raise AttributeError(name)
+        return(self.get_collection(name))
+
+    def list_collection_names(self):
+        return([name for name, collection in self.collections.items() if len(collection.documents) > 0 or len(collection.indexes) > 1])
+
+
+class MemoryClient():
+
+    def __init__(self):
+        self.service_db = MemoryDatabase()
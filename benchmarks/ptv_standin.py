@@ -0,0 +1,320 @@
+"""
+Local stand-in for the PTV API endpoints the importer uses
+
+Serves generated or recorded services and channels over HTTP with the
+paging, date filtering and guid lists of the real API, and optionally
+adds latency, errors and a rate limit.
+
+    python benchmarks/ptv_standin.py serve --size 20000 --port 8080 --latency-ms 50
+    python benchmarks/ptv_standin.py record --output recordings/ptv
+
+Point the importer at it with PTV_API_URL=http://127.0.0.1:8080/api/v11.
+"""
+import sys
+sys.path.append('ServiceDataImportFunctionApp/ServiceDataImportFunction')
+sys.path.append('benchmarks')
+import argparse
+import json
+import os
+import random
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from synthetic import catalogue, code_lists, region_codes
+
+api_prefix = "/api/v11"
+
+
+class PTVData():
+    """
+    Services, channels and code lists served by the stand-in
+
+    modified holds the modification time of every service and channel id,
+    and municipality_provinces the province code of municipality codes for
+    the area filtered listings.
+    """
+
+    def __init__(self, services, channels, municipalities, provinces, modified, municipality_provinces=None):
+        self.services = {service['id']: service for service in services}
+        self.channels = {channel['id']: channel for channel in channels}
+        self.municipalities = municipalities
+        self.provinces = provinces
+        self.modified = modified
+        self.municipality_provinces = municipality_provinces if municipality_provinces is not None else {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def generated(cls, size, seed=1, days=60):
+        services, channels = catalogue(size, seed)
+        municipalities, provinces = code_lists()
+        rng = random.Random(seed)
+        now = datetime.utcnow().replace(microsecond=0)
+        modified = {item['id']: now - timedelta(seconds=rng.randint(60, days*24*60*60)) for item in services + channels}
+        return(cls(services, channels, municipalities, provinces, modified, {code: '02' for code in region_codes}))
+
+    @classmethod
+    def load(cls, directory):
+        items = {}
+        modified = {}
+        for kind in ['services', 'channels']:
+            items[kind] = []
+            with open(os.path.join(directory, kind + '.jsonl'), encoding='utf-8') as items_file:
+                for line in items_file:
+                    record = json.loads(line)
+                    items[kind].append(record['payload'])
+                    modified[record['payload']['id']] = datetime.fromisoformat(record['modified'])
+        with open(os.path.join(directory, 'code_lists.json'), encoding='utf-8') as code_list_file:
+            code_list = json.load(code_list_file)
+        return(cls(items['services'], items['channels'], code_list['municipalities'], code_list['provinces'], modified,
+                   code_list.get('municipalityProvinces')))
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for kind, items in [('services', self.services), ('channels', self.channels)]:
+            with open(os.path.join(directory, kind + '.jsonl'), 'w', encoding='utf-8') as items_file:
+                for guid, payload in items.items():
+                    items_file.write(json.dumps({'modified': self.modified[guid].isoformat(), 'payload': payload}, ensure_ascii=False) + "\n")
+        with open(os.path.join(directory, 'code_lists.json'), 'w', encoding='utf-8') as code_list_file:
+            json.dump({'municipalities': self.municipalities, 'provinces': self.provinces,
+                       'municipalityProvinces': self.municipality_provinces}, code_list_file, ensure_ascii=False)
+
+    def touch(self, share, seed=2):
+        """
+        Mark a share of services and channels modified now, returns their ids
+        """
+        rng = random.Random(seed)
+        now = datetime.utcnow().replace(microsecond=0)
+        touched = []
+        with self._lock:
+            for items in [self.services, self.channels]:
+                for guid, payload in items.items():
+                    if rng.random() < share:
+                        names = payload.get('serviceNames') or payload.get('serviceChannelNames')
+                        if names:
+                            names[0]['value'] = names[0]['value'] + " (muutettu)"
+                        self.modified[guid] = now
+                        touched.append(guid)
+        return(touched)
+
+    def _area_codes(self, item):
+        provinces = set()
+        municipalities = set()
+        for area in item.get('areas') or []:
+            if area.get('type') == 'Municipality':
+                municipalities.add(area.get('code'))
+            else:
+                provinces.add(area.get('code'))
+        for address in item.get('addresses') or []:
+            municipality = (address.get('streetAddress') or {}).get('municipality') or {}
+            municipalities.add(municipality.get('code'))
+        provinces.update(self.municipality_provinces.get(code) for code in municipalities)
+        return(provinces, municipalities)
+
+    def _in_area(self, item, area_type, code, include_whole_country):
+        provinces, municipalities = self._area_codes(item)
+        if include_whole_country and (item.get('areaType') == 'Nationwide' or (len(provinces) == 0 and len(municipalities) == 0)):
+            return(True)
+        if area_type == 'Province':
+            return(code in provinces)
+        return(code in municipalities)
+
+    def details(self, kind, guids):
+        """
+        Payloads of known services or channels with their modification times, as PTV API returns them
+        """
+        items = self.services if kind == 'services' else self.channels
+        with self._lock:
+            return([dict(items[guid], modified=self.modified[guid].isoformat()) for guid in guids if guid in items])
+
+    def listing(self, kind, since=None, area=None, include_whole_country=True):
+        items = self.services if kind == 'services' else self.channels
+        with self._lock:
+            listed = []
+            for guid, payload in items.items():
+                if since is not None and self.modified[guid] < since:
+                    continue
+                if area is not None and not self._in_area(payload, area[0], area[1], include_whole_country):
+                    continue
+                # Like PTV API, listings tell only the ids
+                listed.append({'id': guid})
+        listed.sort(key=lambda item: item['id'])
+        return(listed)
+
+
+class StandinConfig():
+    """
+    Behaviour of the stand-in: page size, guid limit, latency, errors and rate limit
+    """
+
+    def __init__(self, page_size=1000, max_guids=100, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, rate_limit=None, seed=1):
+        self.page_size = page_size
+        self.max_guids = max_guids
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.rng = random.Random(seed)
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, headers=None):
+        content = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+        self.server.count(status)
+
+    def _page(self, items, query):
+        page_size = self.server.config.page_size
+        page = int(query.get('page', ['1'])[0])
+        page_count = max(1, -(-len(items) // page_size))
+        return({'pageNumber': page, 'pageSize': page_size, 'pageCount': page_count,
+                'itemList': items[(page - 1) * page_size:page * page_size]})
+
+    def do_GET(self):
+        server = self.server
+        config = server.config
+        delay = config.latency_ms + config.rng.uniform(0, config.jitter_ms) if config.latency_ms or config.jitter_ms else 0
+        if delay:
+            time.sleep(delay / 1000)
+        if not server.admit():
+            return(self._send(429, {'error': "Too many requests"}, {'Retry-After': '1'}))
+        if config.error_rate and config.rng.random() < config.error_rate:
+            return(self._send(503, {'error': "Service unavailable"}))
+
+        parsed = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(parsed.query)
+        path = parsed.path[len(api_prefix):] if parsed.path.startswith(api_prefix) else None
+        data = server.data
+        since = datetime.fromisoformat(query['date'][0]) if 'date' in query else None
+        include_whole_country = query.get('includeWholeCountry', ['true'])[0] == 'true'
+        parts = path.strip('/').split('/') if path is not None else []
+
+        if path == "/CodeList/GetMunicipalityCodes":
+            return(self._send(200, data.municipalities))
+        if path == "/CodeList/GetAreaCodes/type/Province":
+            return(self._send(200, data.provinces))
+        if path in ["/Service/serviceWithGD/list", "/ServiceChannel/list"]:
+            guids = [guid for guid in ','.join(query.get('guids', [''])).split(',') if guid]
+            if len(guids) > config.max_guids:
+                return(self._send(400, {'error': "Too many guids"}))
+            kind = 'services' if path.startswith("/Service/") else 'channels'
+            return(self._send(200, data.details(kind, guids)))
+        if len(parts) in [1, 5] and parts[0] in ['Service', 'ServiceChannel'] and (len(parts) == 1 or (parts[1] == 'area' and parts[3] == 'code')):
+            kind = 'services' if parts[0] == 'Service' else 'channels'
+            area = (parts[2], parts[4]) if len(parts) == 5 else None
+            return(self._send(200, self._page(data.listing(kind, since, area, include_whole_country), query)))
+        return(self._send(404, {'error': "Not found"}))
+
+
+class StandinServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server for the stand-in, start() serves in a background thread
+    """
+
+    daemon_threads = True
+
+    def __init__(self, data, config=None, port=0):
+        super().__init__(('127.0.0.1', port), StandinHandler)
+        self.data = data
+        self.config = config if config is not None else StandinConfig()
+        self.statuses = {}
+        self._lock = threading.Lock()
+        self._tokens = float(self.config.rate_limit or 0)
+        self._refilled = time.monotonic()
+        self._thread = None
+
+    @property
+    def api_url(self):
+        return("http://127.0.0.1:{}{}".format(self.server_address[1], api_prefix))
+
+    def count(self, status):
+        with self._lock:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def admit(self):
+        if not self.config.rate_limit:
+            return(True)
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(float(self.config.rate_limit), self._tokens + (now - self._refilled) * self.config.rate_limit)
+            self._refilled = now
+            if self._tokens < 1:
+                return(False)
+            self._tokens = self._tokens - 1
+            return(True)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return(self)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def record(output, api_url=None):
+    """
+    Record every service and channel of the national catalogue from PTV API
+    """
+    from service_data_import.ptv_importer import PTVImporter, API
+    from service_data_import.paging import parse_modified
+    from unittest.mock import MagicMock
+    importer = PTVImporter(MagicMock(), api_url=api_url or API)
+    service_guids = importer._get_all_service_guids()
+    services = importer._get_services(service_guids)
+    channel_guids = importer._list_ids('channels', importer.api_url + "/ServiceChannel?page={}")
+    channels = importer._get_service_channels(channel_guids)
+    municipalities = importer._get_json(importer._municipality_codes_url())
+    provinces = importer._get_json(importer._province_codes_url())
+    # Modification times come with the details, items without one count as modified now
+    now = datetime.utcnow().replace(microsecond=0)
+    modified = {item['id']: parse_modified(item.pop('modified', None)) or now for item in services + channels}
+    PTVData(services, channels, municipalities, provinces, modified).save(output)
+    print(len(services), "services and", len(channels), "channels recorded to", output)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve')
+    serve.add_argument('--size', type=int, default=10000)
+    serve.add_argument('--recording', help="Directory written by the record command, generated data if not given")
+    serve.add_argument('--port', type=int, default=8080)
+    serve.add_argument('--page-size', type=int, default=1000)
+    serve.add_argument('--latency-ms', type=float, default=0.0)
+    serve.add_argument('--jitter-ms', type=float, default=0.0)
+    serve.add_argument('--error-rate', type=float, default=0.0)
+    serve.add_argument('--rate-limit', type=float, help="Requests per second")
+    recorder = commands.add_parser('record')
+    recorder.add_argument('--output', required=True)
+    recorder.add_argument('--api-url')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        record(args.output, args.api_url)
+        return
+    data = PTVData.load(args.recording) if args.recording else PTVData.generated(args.size)
+    config = StandinConfig(args.page_size, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                           error_rate=args.error_rate, rate_limit=args.rate_limit)
+    server = StandinServer(data, config, args.port)
+    print("Serving", len(data.services), "services and", len(data.channels), "channels at", server.api_url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+Microbenchmarks of the parsers, the suitability checks and the Mongo write path
+
+Run from the repository root:
+
+    python benchmarks/run_benchmarks.py --sizes 1000 10000 100000
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/<older commit>.json
+
+Results are written to benchmarks/results/<commit>.json unless --output is given.
+"""
+import sys
+sys.path.append('ServiceDataImportFunctionApp/ServiceDataImportFunction')
+sys.path.append('benchmarks')
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime
+from unittest.mock import MagicMock
+from service_data_import.ptv_importer import PTVImporter, API
+from memory_mongo import MemoryClient
+from synthetic import catalogue, code_lists
+
+
+class CodeListSession():
+
+    def __init__(self):
+        municipalities, provinces = code_lists()
+        self.responses = {API + "/CodeList/GetMunicipalityCodes": municipalities,
+                          API + "/CodeList/GetAreaCodes/type/Province": provinces}
+
+    def get(self, url):
+        response = MagicMock()
+        response.json.return_value = self.responses[url]
+        return(response)
+
+
+def new_importer():
+    return(PTVImporter(MemoryClient(), CodeListSession(), write_mode='delete_insert'))
+
+
+def timed(repeats, setup, function):
+    timings = []
+    for _ in range(repeats):
+        argument = setup()
+        start = time.perf_counter()
+        function(argument)
+        timings.append(time.perf_counter() - start)
+    return(timings)
+
+
+def loaded_importer(collection, documents):
+    def setup():
+        importer = new_importer()
+        importer.store_to_mongo(collection, [dict(document) for document in documents])
+        # Half of the documents are rewritten, like after an incremental listing
+        return(importer, [dict(document) for document in documents[::2]])
+    return(setup)
+
+
+def delete_and_store(collection):
+    def run(argument):
+        importer, documents = argument
+        importer.remove_old_from_mongo(collection, [document['id'] for document in documents])
+        importer.store_to_mongo(collection, documents)
+    return(run)
+
+
+def upsert(collection):
+    def run(argument):
+        importer, documents = argument
+        importer.upsert_to_mongo(collection, documents)
+    return(run)
+
+
+def benchmarks(size, seed):
+    raw_services, raw_channels = catalogue(size, seed)
+    importer = new_importer()
+    services = [importer._parse_service_info(raw_service) for raw_service in raw_services]
+    channels = [importer._parse_channel_info(raw_channel) for raw_channel in raw_channels]
+    for documents in [services, channels]:
+        for document in documents:
+            document['lastUpdated'] = datetime(2021, 6, 10)
+    same = lambda: importer
+    return([('parse_service', same, lambda importer: [importer._parse_service_info(raw_service) for raw_service in raw_services]),
+            ('parse_channel', same, lambda importer: [importer._parse_channel_info(raw_channel) for raw_channel in raw_channels]),
+            ('is_suitable_service', same, lambda importer: [importer._is_suitable_service(service) for service in services]),
+            ('is_suitable_channel', same, lambda importer: [importer._is_suitable_channel(channel) for channel in channels]),
+            ('filter_services', same, lambda importer: importer.suitability.filter('services', services)),
+            ('filter_channels', same, lambda importer: importer.suitability.filter('channels', channels)),
+            ('delete_insert_services', loaded_importer('services', services), delete_and_store('services')),
+            ('delete_insert_channels', loaded_importer('channels', channels), delete_and_store('channels')),
+            ('upsert_services', loaded_importer('services', services), upsert('services')),
+            ('upsert_channels', loaded_importer('channels', channels), upsert('channels'))])
+
+
+def current_commit():
+    try:
+        return(subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return("unknown")
+
+
+def compare(results, baseline_path, max_regression):
+    with open(baseline_path, encoding='utf-8') as baseline_file:
+        baseline = json.load(baseline_file)
+    best = {(result['benchmark'], result['size']): result['best'] for result in baseline['results']}
+    regressions = []
+    print("Compared to", baseline['commit'])
+    for result in results:
+        key = (result['benchmark'], result['size'])
+        if key not in best:
+            continue
+        ratio = result['best'] / best[key]
+        print("{:<24} {:>7} {:>8.3f} s  {:>6.2f}x".format(result['benchmark'], result['size'], result['best'], ratio))
+        if max_regression is not None and ratio > 1 + max_regression:
+            regressions.append(key)
+    return(regressions)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--only', nargs='+', help="Run only benchmarks with these names")
+    parser.add_argument('--output', help="Result file, benchmarks/results/<commit>.json by default")
+    parser.add_argument('--compare', help="Earlier result file to compare against")
+    parser.add_argument('--max-regression', type=float, help="Exit with an error if a benchmark is slower by more than this share, e.g. 0.2")
+    args = parser.parse_args()
+
+    commit = current_commit()
+    results = []
+    for size in args.sizes:
+        # Importer prints are not part of the timing output
+        with contextlib.redirect_stdout(io.StringIO()):
+            cases = benchmarks(size, args.seed)
+        for name, setup, function in cases:
+            if args.only and name not in args.only:
+                continue
+            with contextlib.redirect_stdout(io.StringIO()):
+                timings = timed(args.repeats, setup, function)
+            result = {'benchmark': name, 'size': size, 'best': min(timings), 'mean': statistics.mean(timings),
+                      'per_item_us': min(timings) / size * 10**6, 'timings': timings}
+            results.append(result)
+            print("{:<24} {:>7} {:>8.3f} s  {:>8.2f} us/item".format(name, size, result['best'], result['per_item_us']))
+
+    output = args.output if args.output else os.path.join('benchmarks', 'results', commit + '.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as output_file:
+        json.dump({'commit': commit, 'created': datetime.utcnow().isoformat(), 'python': platform.python_version(),
+                   'platform': platform.platform(), 'repeats': args.repeats, 'seed': args.seed, 'results': results},
+                  output_file, indent=2)
+    print("Results written to", output)
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.max_regression)
+        if len(regressions) > 0:
+            print("Regressions:", ", ".join("{} at {}".format(name, size) for name, size in regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
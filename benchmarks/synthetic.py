@@ -0,0 +1,147 @@
+"""
+Synthetic PTV payloads shaped like the real services and channel list responses
+
+Services and channels carry texts in three languages, several description
+types, target groups, service classes, areas and organizations in roughly
+the proportions of the national catalogue. The same seed gives the same
+payloads, so timings are comparable between commits.
+"""
+import random
+import uuid
+
+languages = ['fi', 'sv', 'en']
+region_municipalities = [('019', 'Aura'), ('202', 'Kaarina'), ('322', 'Kemiönsaari'), ('284', 'Koski Tl'), ('304', 'Kustavi'),
+                         ('400', 'Laitila'), ('423', 'Lieto'), ('430', 'Loimaa'), ('480', 'Marttila'), ('481', 'Masku'),
+                         ('503', 'Mynämäki'), ('529', 'Naantali'), ('538', 'Nousiainen'), ('561', 'Oripää'), ('577', 'Paimio'),
+                         ('445', 'Parainen'), ('631', 'Pyhäranta'), ('636', 'Pöytyä'), ('680', 'Raisio'), ('704', 'Rusko'),
+                         ('734', 'Salo'), ('738', 'Sauvo'), ('761', 'Somero'), ('833', 'Taivassalo'), ('853', 'Turku'),
+                         ('895', 'Uusikaupunki'), ('918', 'Vehmaa')]
+region_codes = [code for code, name in region_municipalities]
+# Other municipalities of the country, about 300 in total
+country_codes = region_codes + ['{:03d}'.format(code) for code in range(1, 1000) if '{:03d}'.format(code) not in region_codes][:282]
+province_codes = ['{:02d}'.format(code) for code in range(1, 22)]
+words = ['palvelu', 'asiakas', 'kotihoito', 'neuvonta', 'ajanvaraus', 'terveys', 'sosiaali', 'asuminen', 'liikunta',
+         'kirjasto', 'omaishoito', 'tuki', 'hakemus', 'päivätoiminta', 'kuntoutus', 'ohjaus', 'ikäihmiset', 'lapset']
+
+
+def text(rng, word_count):
+    return(' '.join(rng.choice(words) for _ in range(word_count)).capitalize())
+
+
+def texts(rng, word_count, value_key='value', with_type=None):
+    items = []
+    for language in rng.sample(languages, rng.choice([1, 2, 3, 3, 3])):
+        item = {'language': language, value_key: text(rng, word_count)}
+        if with_type is not None:
+            item['type'] = with_type
+        items.append(item)
+    return(items)
+
+
+def names(rng):
+    return([{'language': language, 'value': text(rng, 2)} for language in languages])
+
+
+def code_names(kind, code):
+    # Like in PTV, every occurrence of a code has the same names
+    return(names(random.Random('{}/{}'.format(kind, code))))
+
+
+def code_texts(kind, code, word_count):
+    return(texts(random.Random('{}/{}/texts'.format(kind, code)), word_count))
+
+
+def service_area(rng):
+    area_type = rng.choice(['Municipality', 'Municipality', 'Municipality', 'Province', 'Region', 'BusinessRegions'])
+    if area_type == 'Municipality':
+        code = rng.choice(country_codes)
+        return({'type': area_type, 'code': code, 'name': code_names(area_type, code),
+                'municipalities': [{'code': code, 'name': code_names('Municipality', code)}]})
+    code = rng.choice(province_codes)
+    return({'type': area_type, 'code': code, 'name': code_names(area_type, code)})
+
+
+def organization(rng):
+    if rng.random() < 0.9:
+        return({'roleType': rng.choice(['Responsible', 'Producer']),
+                'organization': {'id': str(uuid.UUID(int=rng.getrandbits(128))), 'name': text(rng, 2)}})
+    return({'roleType': 'Producer', 'additionalInformation': [{'language': 'fi', 'value': text(rng, 3)}]})
+
+
+def service(rng, channel_ids):
+    descriptions = []
+    for description_type in ['Description', 'Summary', 'UserInstruction', 'ChargeTypeAdditionalInfo']:
+        descriptions.extend(texts(rng, rng.randint(5, 80), with_type=description_type))
+    return({'id': str(uuid.UUID(int=rng.getrandbits(128))),
+            'type': 'Service',
+            'subType': rng.choice(['Normal', 'Normal', 'PermissionAndObligation']),
+            'serviceChannels': [{'serviceChannel': {'id': channel_id}} for channel_id in rng.sample(channel_ids, min(len(channel_ids), rng.randint(1, 6)))],
+            'organizations': [organization(rng) for _ in range(rng.randint(1, 3))],
+            'serviceNames': texts(rng, 3),
+            'serviceDescriptions': descriptions,
+            'requirements': texts(rng, 10) if rng.random() < 0.3 else [],
+            'targetGroups': [{'code': code, 'name': code_names('targetGroups', code)} for code in rng.sample(['KR1', 'KR1.1', 'KR1.2', 'KR2', 'KR3'], rng.randint(1, 3))],
+            'serviceClasses': [{'code': code, 'name': code_names('serviceClasses', code), 'description': code_texts('serviceClasses', code, 8)}
+                               for code in ['P' + str(rng.randint(1, 30)) for _ in range(rng.randint(1, 4))]],
+            'lifeEvents': [{'code': code, 'name': code_names('lifeEvents', code)} for code in ['KE' + str(rng.randint(1, 14)) for _ in range(rng.randint(0, 2))]],
+            'areas': [service_area(rng) for _ in range(rng.randint(1, 4))] if rng.random() < 0.4 else []})
+
+
+def address(rng):
+    code = rng.choice(region_codes) if rng.random() < 0.5 else rng.choice(country_codes)
+    return({'type': rng.choice(['Location', 'Postal']), 'subType': 'Street',
+            'streetAddress': {'streetNumber': str(rng.randint(1, 120)), 'postalCode': '{:05d}'.format(rng.randint(100, 99999)),
+                              'latitude': str(rng.randint(6600000, 7700000)), 'longitude': str(rng.randint(200000, 700000)),
+                              'street': texts(rng, 1), 'postOffice': texts(rng, 1),
+                              'municipality': {'code': code, 'name': code_names('Municipality', code)}}})
+
+
+def phones(rng):
+    return([{'language': rng.choice(languages), 'number': str(rng.randint(1000000, 9999999)), 'prefixNumber': '+358',
+             'chargeDescription': rng.choice([None, text(rng, 4)]), 'serviceChargeType': rng.choice(['Chargeable', 'FreeOfCharge'])}
+            for _ in range(rng.randint(0, 2))])
+
+
+def channel(rng, channel_id, service_ids):
+    channel_type = rng.choice(['ServiceLocation', 'ServiceLocation', 'EChannel', 'Phone', 'WebPage', 'PrintableForm'])
+    return({'id': channel_id,
+            'serviceChannelType': channel_type,
+            'areaType': rng.choice(['Nationwide', 'AreaType']),
+            'organizationId': str(uuid.UUID(int=rng.getrandbits(128))),
+            'services': [{'service': {'id': service_id}} for service_id in service_ids],
+            'serviceChannelNames': texts(rng, 3),
+            'serviceChannelDescriptions': texts(rng, rng.randint(5, 60), with_type='Description') + texts(rng, 10, with_type='Summary'),
+            'webPages': texts(rng, 1, value_key='url'),
+            'supportPhones': phones(rng),
+            'phoneNumbers': phones(rng),
+            'supportEmails': texts(rng, 1),
+            'emails': texts(rng, 1),
+            'addresses': [address(rng) for _ in range(rng.randint(1, 2))] if channel_type == 'ServiceLocation' else [],
+            'areas': [service_area(rng) for _ in range(rng.randint(0, 2))],
+            'channelUrls': texts(rng, 1, with_type='URL') if channel_type == 'EChannel' else []})
+
+
+def catalogue(size, seed=1):
+    """
+    Return ( services, channels ) with size services and about as many channels
+    """
+    rng = random.Random(seed)
+    channel_ids = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(size)]
+    services = [service(rng, channel_ids) for _ in range(size)]
+    services_of_channel = {channel_id: [] for channel_id in channel_ids}
+    for raw_service in services:
+        for service_channel in raw_service['serviceChannels']:
+            services_of_channel[service_channel['serviceChannel']['id']].append(raw_service['id'])
+    channels = [channel(rng, channel_id, services_of_channel[channel_id]) for channel_id in channel_ids]
+    return(services, channels)
+
+
+def code_lists():
+    """
+    Return ( municipality codes, province codes ) responses of the PTV code list endpoints
+    """
+    municipalities = [{'code': code, 'names': [{'language': 'fi', 'value': name}, {'language': 'sv', 'value': name}]}
+                      for code, name in region_municipalities]
+    municipalities = municipalities + [{'code': code, 'names': [{'language': 'fi', 'value': 'Kunta ' + code}]} for code in country_codes[len(region_codes):]]
+    provinces = [{'code': code, 'names': [{'language': 'fi', 'value': 'Varsinais-Suomi' if code == '02' else 'Maakunta ' + code}]} for code in province_codes]
+    return(municipalities, provinces)
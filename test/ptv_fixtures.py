@@ -0,0 +1,55 @@
+"""
+Fake PTV API sessions and a fixed clock shared by the importer tests
+"""
+import json
+import urllib
+from datetime import datetime
+from unittest.mock import MagicMock
+
+
+def fixed_datetime(now):
+    """
+    Return a datetime class whose utcnow is now, for patching ptv_importer.datetime
+    """
+    class FixedDatetime(datetime):
+
+        @classmethod
+        def utcnow(cls):
+            return(cls(now.year, now.month, now.day, now.hour, now.minute))
+    return(FixedDatetime)
+
+
+FixedDatetime = fixed_datetime(datetime(2021, 6, 10, 12, 0))
+
+
+class UrlSession():
+    """Fake requests session answering by url so call order does not matter"""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.urls = []
+
+    def get(self, url):
+        self.urls.append(url)
+        response = MagicMock()
+        if url in self.responses:
+            body = self.responses[url]
+        else:
+            guids = urllib.parse.unquote_plus(url.split('guids=')[1]).split(',')
+            body = [self.responses[guid] for guid in guids]
+        response.json.return_value = body
+        response.content = json.dumps(body).encode('utf-8')
+        return(response)
+
+
+def code_list_session():
+    """
+    Session that answers the municipality and province code list requests of PTVImporter construction
+    """
+    session = MagicMock()
+    municipalities = MagicMock()
+    municipalities.json.return_value = [{'code': '853', 'names': [{'value': 'Turku', 'language': 'fi'}]}]
+    provinces = MagicMock()
+    provinces.json.return_value = [{'code': '02', 'names': [{'value': 'Varsinais-Suomi', 'language': 'fi'}]}]
+    session.get.side_effect = [municipalities, provinces]
+    return(session)
@@ -0,0 +1,145 @@
+import sys
+sys.path.append('ServiceDataImportFunctionApp/ServiceDataImportFunction')
+sys.path.append('test')
+import contextlib
+import io
+import random
+import unittest
+import urllib
+from unittest.mock import MagicMock
+from service_data_import.adaptive import AdaptiveController, AdaptiveSession, UrlTooLongError
+from service_data_import.ptv_importer import *
+from ptv_fixtures import code_list_session
+
+
+class StatusSession():
+
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.urls = []
+
+    def get(self, url):
+        self.urls.append(url)
+        response = MagicMock()
+        response.status_code = self.statuses.pop(0) if self.statuses else 200
+        response.headers = {'Retry-After': '7'} if response.status_code == 429 else {}
+        response.json.return_value = {'url': url}
+        return(response)
+
+
+class LengthLimitedSession():
+
+    def __init__(self, max_url_length):
+        self.max_url_length = max_url_length
+        self.urls = []
+
+    def get(self, url):
+        self.urls.append(url)
+        response = MagicMock()
+        response.status_code = 414 if len(url) > self.max_url_length else 200
+        if "GetMunicipalityCodes" in url:
+            response.json.return_value = [{'code': '853', 'names': [{'value': 'Turku', 'language': 'fi'}]}]
+        elif "GetAreaCodes" in url:
+            response.json.return_value = [{'code': '02', 'names': [{'value': 'Varsinais-Suomi', 'language': 'fi'}]}]
+        else:
+            response.json.return_value = [{'id': guid} for guid in urllib.parse.unquote_plus(url.split('guids=')[1]).split(',')]
+        return(response)
+
+
+class AdaptiveControllerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sleeps = []
+        self.controller = AdaptiveController(max_in_flight=8, max_batch_size=100, min_batch_size=10, target_latency=1.0,
+                                             max_retries=3, failure_threshold=3, cooldown=60.0,
+                                             sleep=self.sleeps.append, rng=random.Random(1))
+
+    def test_additive_increase_multiplicative_decrease(self):
+        self.assertEqual(self.controller.in_flight, 4.0)
+        for _ in range(40):
+            self.controller.on_success('/api/v11/Service', 0.1)
+        self.assertEqual(self.controller.in_flight, 8.0)
+        self.assertEqual(self.controller.batch_size, 100)
+        # Overload lowers concurrency, not batch size
+        self.controller.on_failure('/api/v11/Service')
+        self.assertEqual(self.controller.in_flight, 4.0)
+        self.assertEqual(self.controller.batch_size, 100)
+        # Slow responses count as congestion too
+        self.controller.on_success('/api/v11/Service', 2.0)
+        self.assertEqual(self.controller.in_flight, 2.0)
+        for _ in range(10):
+            self.controller.on_failure('/api/v11/ServiceChannel/list')
+        self.assertEqual(self.controller.in_flight, 1.0)
+        self.assertEqual(self.controller.batch_size, 100)
+        # Only too long urls shrink batches, which grow back multiplicatively
+        for _ in range(4):
+            self.controller.on_url_too_long(100000)
+        self.assertEqual(self.controller.batch_size, 10)
+        self.controller.on_success('/api/v11/Service', 0.1)
+        self.assertEqual(self.controller.batch_size, 20)
+        for _ in range(3):
+            self.controller.on_success('/api/v11/Service', 0.1)
+        self.assertEqual(self.controller.batch_size, 100)
+
+    def test_batch_count_respects_url_length(self):
+        guids = ['{:036d}'.format(number) for number in range(300)]
+        self.assertEqual(self.controller.batch_count('http://ptv/list?guids=', guids), 100)
+        self.controller.max_url_length = len('http://ptv/list?guids=') + 36 * 10 + 3 * 9
+        self.assertEqual(self.controller.batch_count('http://ptv/list?guids=', guids), 10)
+        self.controller.max_url_length = 10
+        self.assertEqual(self.controller.batch_count('http://ptv/list?guids=', guids), 1)
+
+    def test_retries_with_jittered_backoff(self):
+        session = AdaptiveSession(StatusSession([503, 429, 200]), self.controller)
+        self.assertEqual(session.get(url='http://ptv/api/v11/Service?page=1').json(), {'url': 'http://ptv/api/v11/Service?page=1'})
+        self.assertEqual(len(self.sleeps), 2)
+        self.assertLessEqual(self.sleeps[0], 0.5)
+        self.assertEqual(self.sleeps[1], 7.0)
+        self.assertEqual(self.controller.counts['retries'], 2)
+
+    def test_gives_up_and_pauses_endpoint(self):
+        session = AdaptiveSession(StatusSession([500] * 10), self.controller)
+        with self.assertRaises(Exception):
+            session.get(url='http://ptv/api/v11/ServiceChannel/list?guids=1')
+        self.assertEqual(self.controller.counts['pauses'], 1)
+        # The paused endpoint is waited out before the next call
+        self.sleeps.clear()
+        with self.assertRaises(Exception):
+            session.get(url='http://ptv/api/v11/ServiceChannel/list?guids=2')
+        self.assertGreater(self.sleeps[0], 50)
+
+    def test_too_long_url_lowers_cap(self):
+        session = AdaptiveSession(StatusSession([414]), self.controller)
+        url = 'http://ptv/api/v11/Service/serviceWithGD/list?guids=' + 'a' * 100
+        with self.assertRaises(UrlTooLongError):
+            session.get(url=url)
+        self.assertEqual(self.controller.max_url_length, len(url) // 2)
+
+    def test_too_long_batch_is_split(self):
+        guids = ['{:036d}'.format(number) for number in range(250)]
+        for engine in ['sync', 'async']:
+            controller = AdaptiveController(max_batch_size=100, sleep=self.sleeps.append)
+            session = LengthLimitedSession(1000)
+            with contextlib.redirect_stdout(io.StringIO()):
+                importer = PTVImporter(MagicMock(), session, controller=controller, engine=engine)
+                services = importer._fetch_services(guids, engine)
+            self.assertEqual(sorted(service['id'] for service in services), guids)
+            self.assertLessEqual(controller.max_url_length, 1000)
+            # A few rejections find the limit, later batches are sent under it
+            self.assertLessEqual(len([url for url in session.urls if len(url) > 1000]), 6)
+
+    def test_importer_batches_follow_controller(self):
+        importer = PTVImporter(MagicMock(), code_list_session(), controller=self.controller)
+        self.assertIsInstance(importer.api_session, AdaptiveSession)
+        guids = [str(number) for number in range(250)]
+        self.assertEqual([end_index for end_index, url in importer._iter_batch_urls("/Service/serviceWithGD/list", guids)], [100, 200, 250])
+        self.controller.on_failure('/api/v11/Service/serviceWithGD/list')
+        self.assertEqual(len(list(importer._iter_batch_urls("/Service/serviceWithGD/list", guids))), 3)
+        self.controller.on_url_too_long(100000)
+        batch_urls = [url for end_index, url in importer._iter_batch_urls("/Service/serviceWithGD/list", guids)]
+        self.assertEqual(len(batch_urls), 5)
+        self.assertEqual(urllib.parse.unquote_plus(batch_urls[0].split('guids=')[1]).split(','), guids[:50])
+
+
+if __name__ == '__main__':
+    unittest.main()
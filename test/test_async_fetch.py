@@ -0,0 +1,80 @@
+import sys
+sys.path.append('ServiceDataImportFunctionApp/ServiceDataImportFunction')
+sys.path.append('test')
+import unittest
+from unittest.mock import MagicMock
+from service_data_import.ptv_importer import *
+from ptv_fixtures import UrlSession
+
+
+def make_service(guid):
+    return({'id': guid,
+            'type': 'Service',
+            'subType': 'Normal',
+            'organizations': [],
+            'serviceChannels': [{'serviceChannel': {'id': 'c' + guid}}],
+            'serviceNames': [{'language': 'fi', 'value': 'Palvelu ' + guid}],
+            'serviceDescriptions': [],
+            'requirements': [],
+            'targetGroups': [{'code': 'KR1', 'name': [{'language': 'fi', 'value': 'Kansalaiset'}]}],
+            'serviceClasses': [],
+            'lifeEvents': [],
+            'areas': []})
+
+
+def make_channel(guid):
+    return({'id': guid,
+            'serviceChannelType': 'EChannel',
+            'areaType': 'Nationwide',
+            'organizationId': 'org1',
+            'services': [{'service': {'id': guid[1:]}}],
+            'serviceChannelNames': [{'language': 'fi', 'value': 'Kanava ' + guid}]})
+
+
+class AsyncFetchEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        service_guids = [str(number) for number in range(250)]
+        responses = {API + "/CodeList/GetMunicipalityCodes": [{'code': '853', 'names': [{'value': 'Turku', 'language': 'fi'}]}],
+                     API + "/CodeList/GetAreaCodes/type/Province": [{'code': '02', 'names': [{'value': 'Varsinais-Suomi', 'language': 'fi'}]}]}
+        for page in range(1, 4):
+            responses[API + "/Service?page={}".format(page)] = {'pageCount': 3, 'itemList': [{'id': guid} for guid in service_guids[(page - 1)*100:page*100]]}
+        responses[API + "/ServiceChannel/area/Province/code/02?includeWholeCountry=true&page=1"] = {'pageCount': 1, 'itemList': [{'id': 'c1'}, {'id': 'c1'}]}
+        for guid in service_guids:
+            responses[guid] = make_service(guid)
+            responses['c' + guid] = make_channel('c' + guid)
+        self.responses = responses
+        self.service_guids = service_guids
+
+    def _importer(self, engine):
+        return(PTVImporter(MagicMock(), UrlSession(self.responses), engine=engine, max_in_flight=4))
+
+    def test_unknown_engine(self):
+        with self.assertRaises(Exception):
+            self._importer('threads')
+
+    def test_same_documents_as_sync(self):
+        sync_importer = self._importer('sync')
+        async_importer = self._importer('async')
+        self.assertEqual(sync_importer.municipalities, async_importer.municipalities)
+        self.assertEqual(sync_importer.provinces, async_importer.provinces)
+
+        sync_guids = sync_importer._fetch_service_guids(None, 'sync')
+        async_guids = async_importer._fetch_service_guids(None, 'async')
+        self.assertEqual(sorted(sync_guids), sorted(async_guids))
+        self.assertEqual(sorted(async_guids), sorted(self.service_guids))
+
+        sync_services = [sync_importer._parse_service_info(service) for service in sync_importer._fetch_services(self.service_guids, 'sync')]
+        async_services = [async_importer._parse_service_info(service) for service in async_importer._fetch_services(self.service_guids, 'async')]
+        self.assertEqual(sync_services, async_services)
+
+        channel_ids = async_importer._fetch_service_channel_ids(None, 'async')
+        self.assertEqual(channel_ids, ['c1'])
+        channel_ids = ['c' + guid for guid in self.service_guids]
+        sync_channels = [sync_importer._parse_channel_info(channel) for channel in sync_importer._fetch_service_channels(channel_ids, 'sync')]
+        async_channels = [async_importer._parse_channel_info(channel) for channel in async_importer._fetch_service_channels(channel_ids, 'async')]
+        self.assertEqual(sync_channels, async_channels)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import sys
+sys.path.append('ServiceDataImportFunctionApp/ServiceDataImportFunction')
+sys.path.append('benchmarks')
+import unittest
+from pymongo import ReplaceOne
+from memory_mongo import MemoryClient
+from run_benchmarks import benchmarks, new_importer, timed
+from synthetic import catalogue
+
+
+class SyntheticCatalogueTest(unittest.TestCase):
+
+    def test_deterministic_and_linked(self):
+        services, channels = catalogue(200, seed=3)
+        self.assertEqual(catalogue(200, seed=3), (services, channels))
+        channel_ids = set(channel['id'] for channel in channels)
+        for service in services:
+            for service_channel in service['serviceChannels']:
+                self.assertIn(service_channel['serviceChannel']['id'], channel_ids)
+
+    def test_filters_keep_part_of_catalogue(self):
+        importer = new_importer()
+        services, channels = catalogue(500)
+        parsed_services = [importer._parse_service_info(service) for service in services]
+        parsed_channels = [importer._parse_channel_info(channel) for channel in channels]
+        self.assertLess(0, len(importer.suitability.filter('services', parsed_services)))
+        self.assertLess(len(importer.suitability.filter('services', parsed_services)), len(parsed_services))
+        self.assertLess(len(importer.suitability.filter('channels', parsed_channels)), len(parsed_channels))
+
+
+class MemoryMongoTest(unittest.TestCase):
+
+    def test_write_paths(self):
+        collection = MemoryClient().service_db.services
+        collection.insert_many([{'id': str(number), 'value': number} for number in range(10)])
+        self.assertEqual(collection.delete_many({'id': {'$in': ['1', '2', 'x']}}).deleted_count, 2)
+        result = collection.bulk_write([ReplaceOne({'id': '3'}, {'id': '3', 'value': 30}, upsert=True),
+                                        ReplaceOne({'id': '11'}, {'id': '11', 'value': 11}, upsert=True)], ordered=False)
+        self.assertEqual((result.matched_count, result.upserted_count), (1, 1))
+        self.assertEqual(collection.find_one({'id': '3'}, {'_id': 0, 'value': 1}), {'value': 30})
+        self.assertEqual(collection.delete_many({'id': {'$nin': ['0', '3']}}).deleted_count, 7)
+        self.assertEqual(sorted(document['id'] for document in collection.find({})), ['0', '3'])
+
+    def test_staging_swap(self):
+        importer = new_importer()
+        importer.store_to_mongo('services', [{'id': 'old'}])
+        importer.store_to_staging('services', [{'id': 'new'}])
+        importer.swap_in_staging('services')
+        service_db = importer.mongo_client.service_db
+        self.assertEqual([document['id'] for document in service_db.services.find({})], ['new'])
+        self.assertEqual([document['id'] for document in service_db.services_previous.find({})], ['old'])
+
+
+class BenchmarkSuiteTest(unittest.TestCase):
+
+    def test_every_benchmark_runs(self):
+        names = []
+        for name, setup, function in benchmarks(50, 1):
+            self.assertEqual(len(timed(1, setup, function)), 1)
+            names.append(name)
+        self.assertIn('parse_service', names)
+        self.assertIn('delete_insert_channels', names)
+
+
+if __name__ == '__main__':
+    unittest.main()
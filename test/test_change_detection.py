@@ -0,0 +1,135 @@
+import sys
+sys.path.append('ServiceDataImportFunctionApp/ServiceDataImportFunction')
+sys.path.append('benchmarks')
+sys.path.append('test')
+import contextlib
+import copy
+import io
+import unittest
+from unittest.mock import MagicMock, patch
+from service_data_import.hashing import content_hash
+from service_data_import.ptv_importer import *
+from service_data_import.service_parser import parse_service_info
+from memory_mongo import MemoryClient
+from ptv_standin import PTVData, StandinServer
+from ptv_fixtures import code_list_session
+
+
+def raw_service(guid, name):
+    return({'id': guid, 'type': 'Service', 'subType': 'Normal',
+            'organizations': [{'roleType': 'Producer', 'organization': {'id': 'org1'}}],
+            'serviceChannels': [{'serviceChannel': {'id': 'c' + guid}}],
+            'serviceNames': [{'language': 'fi', 'value': name}],
+            'serviceDescriptions': [], 'requirements': [],
+            'targetGroups': [{'code': 'KR1', 'name': []}],
+            'serviceClasses': [], 'lifeEvents': [], 'areas': []})
+
+
+class ContentHashTest(unittest.TestCase):
+
+    def test_stable_over_key_order_and_stamps(self):
+        document = {'id': '1', 'name': {'fi': 'Nimi', 'sv': None}}
+        reordered = {'name': {'sv': None, 'fi': 'Nimi'}, 'id': '1', 'lastUpdated': datetime(2021, 6, 9), 'contentHash': 'x'}
+        self.assertEqual(content_hash(document), content_hash(reordered))
+        self.assertNotEqual(content_hash(document), content_hash({'id': '1', 'name': {'fi': 'Toinen'}}))
+
+
+class ChangeDetectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.importer = PTVImporter(MagicMock(), code_list_session())
+        self.now = datetime(2021, 6, 10)
+
+    def test_parsed_documents_carry_hashes(self):
+        raw = raw_service('1', 'Palvelu')
+        raw_hash = content_hash(raw)
+        parsed = self.importer._parse_batch('services', [raw], self.now)[0]
+        self.assertEqual(parsed['rawHash'], raw_hash)
+        self.assertEqual(parsed['contentHash'], content_hash(parsed))
+        self.assertEqual(parsed['lastUpdated'], self.now)
+
+    def test_unchanged_payloads_skip_parsing_and_writing(self):
+        first = [raw_service('1', 'Palvelu'), raw_service('2', 'Toinen')]
+        stored = {parsed['id']: parsed for parsed in self.importer._parse_batch('services', copy.deepcopy(first), self.now)}
+        second = [raw_service('1', 'Palvelu'), raw_service('2', 'Muuttunut')]
+        parsed, unchanged = self.importer._parse_changed('services', second, self.now, stored)
+        self.assertEqual([item['id'] for item in parsed], ['2'])
+        self.assertEqual([item['id'] for item in unchanged], ['1'])
+        self.assertEqual(self.importer.skipped['services']['parse'], 1)
+
+        # Raw change in a field the parser does not use gives the same parsed content
+        third = raw_service('2', 'Toinen')
+        third['modified'] = '2021-06-10T00:00:00'
+        parsed, unchanged = self.importer._parse_changed('services', [third], self.now, stored)
+        self.importer._write_changed('services', parsed, stored)
+        self.assertEqual(self.importer.skipped['services']['write'], 1)
+        self.importer.mongo_client.service_db.services.bulk_write.assert_not_called()
+
+    def test_reparse_ignores_raw_hashes(self):
+        first = [raw_service('1', 'Palvelu')]
+        stored = {parsed['id']: parsed for parsed in self.importer._parse_batch('services', copy.deepcopy(first), self.now)}
+        parsed, unchanged = self.importer._parse_changed('services', first, self.now, stored, reparse=True)
+        self.assertEqual(([item['id'] for item in parsed], unchanged), (['1'], []))
+
+
+class ReferencedChannelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.importer = PTVImporter(MagicMock(), code_list_session())
+        stored_ids = ['c1', 'c2', 'c9']
+        self.importer.mongo_client.service_db.channels.find.side_effect = lambda query, projection: [{'id': guid} for guid in query['id']['$in'] if guid in stored_ids]
+        changed_page = MagicMock()
+        changed_page.json.return_value = {'pageCount': 1, 'itemList': [{'id': 'c2'}, {'id': 'c9'}]}
+        self.importer.meter.session = MagicMock()
+        self.importer.meter.session.get.return_value = changed_page
+
+    def test_only_missing_or_changed_channels_are_fetched(self):
+        guids = self.importer._referenced_channel_guids(['c1', 'c2', 'c3', 'c4', 'c4'], ['c4'], datetime(2021, 6, 9))
+        # c1 is stored and unchanged, c3 is missing, c9 is stored and changed without a referring service
+        self.assertEqual(guids, ['c2', 'c3', 'c9'])
+        self.assertEqual(self.importer.skipped['channels']['fetch'], 1)
+        self.assertIn("/ServiceChannel?page=1&date=2021-06-09T00%3A00%3A00", self.importer.meter.session.get.call_args[1]['url'])
+
+    def test_everything_is_fetched_without_watermark(self):
+        self.assertEqual(self.importer._referenced_channel_guids(['c2', 'c1'], [], None), ['c1', 'c2'])
+        self.importer.meter.session.get.assert_not_called()
+
+
+class UnchangedServiceChannelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data = PTVData.generated(60)
+        self.server = StandinServer(self.data).start()
+        self.client = MemoryClient()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def run_import(self, streaming):
+        with contextlib.redirect_stdout(io.StringIO()):
+            PTVImporter(self.client, api_url=self.server.api_url, refetch_day='never', streaming=streaming).import_services()
+
+    def test_full_refetch_reaches_unchanged_services_with_parser_changes(self):
+        self.run_import(True)
+        changed_parser = lambda importer, service: dict(parse_service_info(service), parserChange=True)
+        with patch.object(PTVImporter, '_parse_service_info', changed_parser), contextlib.redirect_stdout(io.StringIO()):
+            PTVImporter(self.client, api_url=self.server.api_url, refetch_day=str(datetime.utcnow().day), streaming=True).import_services()
+        services = list(self.client.service_db.services.find({}))
+        self.assertGreater(len(services), 0)
+        self.assertTrue(all(service.get('parserChange') for service in services))
+
+    def test_channels_of_unchanged_services_are_fetched(self):
+        for streaming in [False, True]:
+            self.run_import(streaming)
+            service = self.client.service_db.services.find_one({})
+            channel_ids = [channel['id'] for channel in self.client.service_db.channels.find({'id': {'$in': service['channelIds']}})]
+            self.assertGreater(len(channel_ids), 0)
+            self.client.service_db.channels.delete_many({'id': {'$in': channel_ids}})
+            # Listed again without content changes, so the service itself is not parsed again
+            self.data.modified[service['id']] = datetime.utcnow() + timedelta(minutes=1)
+            self.run_import(streaming)
+            self.assertEqual(self.client.service_db.channels.count_documents({'id': {'$in': channel_ids}}), len(channel_ids))
+
+
+if __name__ == '__main__':
+    unittest.main()
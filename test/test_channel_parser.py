@@ -0,0 +1,263 @@
+import sys
+sys.path.append('ServiceDataImportFunctionApp/ServiceDataImportFunction')
+import copy
+import random
+import unittest
+from service_data_import.channel_parser import channel_spec, compile_channel_spec, parse_channel_info
+
+
+# The hand written parser that the compiled spec replaced, kept as the reference output
+
+def reference_parse_channel_info(channel: dict) -> dict:
+    channel_final = {}
+    channel_id = channel.get('id')
+    channel_final['id'] = channel_id
+    channel_type = channel.get('serviceChannelType')
+    channel_final['type'] = channel_type
+    area_type = channel.get('areaType')
+    channel_final['areaType'] = area_type 
+    organization_id = channel.get('organizationId')
+    channel_final['organizationId'] = organization_id
+
+    service_ids = [service.get('service').get('id') for service in channel.get('services')]
+    channel_final['serviceIds'] = service_ids
+
+    languages = ['en', 'fi', 'sv']
+    language_division = {'en': None, 'fi': None, 'sv': None}
+    channel_final['name'] = language_division.copy()
+    channel_final['descriptions'] = language_division.copy()
+    channel_final['webPages'] = language_division.copy()
+    channel_final['emails'] = language_division.copy()
+    channel_final['phoneNumbers'] = language_division.copy()
+    channel_final['addresses'] = language_division.copy()
+    channel_final['areas'] = language_division.copy()
+    channel_final['channelUrls'] = language_division.copy()
+    # Divided by language    
+    for language in languages:
+        names = [l_name.get('value') for l_name in [name for name in channel.get('serviceChannelNames') if name.get('language') == language]]
+        names = [l_name for l_name in names if l_name is not None]
+        if len(names) > 0:
+            name = ' - '.join(names)
+        else:
+            name = None
+        channel_final['name'][language] = name
+
+        if channel.get('serviceChannelDescriptions') is not None:
+            descriptions = [{'value': l_description.get('value'), 'type': l_description.get('type')} for l_description in [description for description in channel.get('serviceChannelDescriptions') if description.get('language') == language]]
+            descriptions = [d for d in descriptions if d['value'] is not None]
+        else:
+            descriptions = []
+        channel_final['descriptions'][language] = descriptions
+
+        # Web pages
+        if channel.get('webPages') is not None:
+            web_pages = [l_web_page for l_web_page in [web_page for web_page in channel.get('webPages') if web_page.get('language') == language]]
+        else:
+            web_pages = []
+        web_page_elements = []
+        for web_page in web_pages:
+            web_page_url = web_page.get('url')
+            web_page_elements.append(web_page_url)
+        channel_final['webPages'][language] = web_page_elements
+
+        # Support phones
+        if channel.get('supportPhones') is not None:
+            support_phones = [l_support_phone for l_support_phone in [support_phone for support_phone in channel.get('supportPhones') if support_phone.get('language') == language]]
+        else:
+            support_phones = []
+        if channel.get('phoneNumbers') is not None:
+            support_phones = support_phones + [l_support_phone for l_support_phone in [support_phone for support_phone in channel.get('phoneNumbers') if support_phone.get('language') == language]]
+
+        support_phone_elements = []
+        for support_phone in support_phones:
+            support_phone_number = support_phone.get('number')
+            support_phone_prefix = support_phone.get('prefixNumber')
+            support_phone_description = support_phone.get('chargeDescription')
+            support_phone_charge_type = support_phone.get('serviceChargeType')  
+            support_phone_el = {"number": support_phone_number,
+                               "prefixNumber": support_phone_prefix,
+                               "chargeDescription": support_phone_description,
+                               "serviceChargeType": support_phone_charge_type}
+            support_phone_elements.append(support_phone_el)
+        channel_final['phoneNumbers'][language] = support_phone_elements
+
+        # Support emails
+        if channel.get('supportEmails') is not None:
+            support_emails = [l_support_email for l_support_email in [support_email for support_email in channel.get('supportEmails') if support_email.get('language') == language]]
+        else:
+            support_emails = []
+        if channel.get('emails') is not None:
+            support_emails = support_emails + [l_support_email for l_support_email in [support_email for support_email in channel.get('emails') if support_email.get('language') == language]]
+        support_email_elements = []
+        for support_email in support_emails:
+            support_email_value = support_email.get('value')
+            support_email_elements.append(support_email_value)
+        channel_final['emails'][language] = support_email_elements
+
+        # Addresses
+        if channel.get('addresses') is not None:
+            addresses = channel.get('addresses')
+        else:
+            addresses = []
+        address_elements = []
+        for address in addresses:
+            address_type = address.get('type')
+            address_subtype = address.get('subType')
+            street_address = address.get('streetAddress')
+            street_number = None
+            postal_code = None
+            latitude = None
+            longitude = None
+            street_name = None
+            post_office = None
+            municipality_name = None
+            municipality_code = None
+            if street_address is not None:
+                street_number = street_address.get('streetNumber')
+                postal_code = street_address.get('postalCode')                    
+                latitude = street_address.get('latitude')                  
+                longitude = street_address.get('longitude')
+                street_names = [street_name.get('value') for street_name in street_address.get('street') if street_name.get('language') == language]
+                street_names = [s_name for s_name in street_names if s_name is not None]
+                if len(street_names) > 0:
+                    street_name = ' - '.join(street_names)
+                post_offices = [post_office.get('value') for post_office in street_address.get('postOffice') if post_office.get('language') == language]
+                post_offices = [p_office for p_office in post_offices if p_office is not None]
+                if len(post_offices) > 0:
+                    post_office = ' - '.join(post_offices)
+                municipality_code = street_address.get('municipality').get('code')
+                sa_municipality_names = [municipality_name.get('value') for municipality_name in street_address.get('municipality').get('name') if municipality_name.get('language') == language]
+                sa_municipality_names = [sa_municipality_name for sa_municipality_name in sa_municipality_names if sa_municipality_name is not None]
+                if len(sa_municipality_names) > 0:
+                    municipality_name = ' - '.join(sa_municipality_names)
+
+            address_el = {"type": address_type,
+                               "subtype": address_subtype,
+                               "streetNumber": street_number,
+                               "postalCode": postal_code,
+                               "latitude": latitude,
+                               "longitude": longitude,
+                               "streetName": street_name,
+                               "postOffice": post_office,
+                               "municipalityCode": municipality_code,
+                               "municipalityName": municipality_name}
+            address_elements.append(address_el)
+        channel_final['addresses'][language] = address_elements
+
+        # Areas
+        if channel.get('areas') is not None:
+            areas = channel.get('areas')
+        else:
+            areas = []
+        area_elements = []
+        for area in areas:
+            area_type = area.get('type')
+            if area.get('type') == 'Municipality':
+                area = area.get('municipalities')[0]
+            area_code = area.get('code')
+            area_names = [l_area_name.get('value') for l_area_name in [area_name for area_name in area.get('name') if area_name.get('language') == language]]
+            area_names = [a_name for a_name in area_names if a_name is not None]
+            if len(area_names) > 0:
+                area_name = ' - '.join(area_names)
+            else:
+                area_name=None
+            area_el = {"name": area_name,
+                                "type": area_type,
+                                "code": area_code}
+            area_elements.append(area_el)
+        channel_final['areas'][language] = area_elements
+
+        # Channel Urls
+        if channel.get('channelUrls') is not None:
+            channel_urls = [l_channel_url for l_channel_url in [channel_url for channel_url in channel.get('channelUrls') if channel_url.get('language') == language]]
+        else:
+            channel_urls = []
+        channel_url_elements = []
+        for channel_url in channel_urls:
+            channel_url_value = channel_url.get('value')
+            channel_url_type = channel_url.get('type')
+            channel_url_el = {"url": channel_url_value,
+                              "type": channel_url_type}                
+            channel_url_elements.append(channel_url_el)
+        channel_final['channelUrls'][language] = channel_url_elements            
+
+    return(channel_final)
+
+
+def random_texts(rng, value_key='value', with_type=False):
+    texts = []
+    for _ in range(rng.randint(0, 3)):
+        text = {'language': rng.choice(['en', 'fi', 'sv', 'se']),
+                value_key: rng.choice(['Arvo', 'Value', None])}
+        if with_type:
+            text['type'] = rng.choice(['Description', 'Summary'])
+        texts.append(text)
+    return(texts)
+
+
+def random_phones(rng):
+    return([{'language': rng.choice(['en', 'fi', 'sv']), 'number': str(rng.randint(100, 999)), 'prefixNumber': '+358',
+             'chargeDescription': rng.choice([None, 'Hinta']), 'serviceChargeType': 'Charged'} for _ in range(rng.randint(0, 2))])
+
+
+def random_address(rng):
+    address = {'type': rng.choice(['Location', 'Postal']), 'subType': rng.choice(['Street', 'PostOfficeBox'])}
+    if rng.random() < 0.8:
+        address['streetAddress'] = {'streetNumber': str(rng.randint(1, 99)), 'postalCode': '20100',
+                                    'latitude': '6713000', 'longitude': '240000',
+                                    'street': random_texts(rng), 'postOffice': random_texts(rng),
+                                    'municipality': {'code': str(rng.randint(1, 999)), 'name': random_texts(rng)}}
+    return(address)
+
+
+def random_area(rng):
+    area_type = rng.choice(['Municipality', 'Province', 'BusinessRegions'])
+    area = {'type': area_type, 'code': str(rng.randint(1, 99)), 'name': random_texts(rng)}
+    if area_type == 'Municipality':
+        area['municipalities'] = [{'code': str(rng.randint(1, 999)), 'name': random_texts(rng)}]
+    return(area)
+
+
+def optional(rng, value):
+    return(value if rng.random() < 0.85 else None)
+
+
+def random_channel(rng):
+    return({'id': str(rng.randint(1, 10**6)),
+            'serviceChannelType': rng.choice(['ServiceLocation', 'EChannel', 'Phone']),
+            'areaType': rng.choice(['Nationwide', 'AreaType']),
+            'organizationId': 'org' + str(rng.randint(1, 9)),
+            'services': [{'service': {'id': str(rng.randint(1, 99))}} for _ in range(rng.randint(0, 3))],
+            'serviceChannelNames': random_texts(rng),
+            'serviceChannelDescriptions': optional(rng, random_texts(rng, with_type=True)),
+            'webPages': optional(rng, random_texts(rng, 'url')),
+            'supportPhones': optional(rng, random_phones(rng)),
+            'phoneNumbers': optional(rng, random_phones(rng)),
+            'supportEmails': optional(rng, random_texts(rng)),
+            'emails': optional(rng, random_texts(rng)),
+            'addresses': optional(rng, [random_address(rng) for _ in range(rng.randint(0, 2))]),
+            'areas': optional(rng, [random_area(rng) for _ in range(rng.randint(0, 2))]),
+            'channelUrls': optional(rng, random_texts(rng, with_type=True))})
+
+
+class ChannelParserEquivalenceTest(unittest.TestCase):
+
+    def test_same_output_as_reference(self):
+        rng = random.Random(20210602)
+        for _ in range(2000):
+            channel = random_channel(rng)
+            expected = reference_parse_channel_info(copy.deepcopy(channel))
+            self.assertEqual(parse_channel_info(copy.deepcopy(channel)), expected)
+
+    def test_added_field(self):
+        spec = channel_spec + [{'field': 'serviceCount', 'kind': 'ids', 'source': 'services', 'path': ('service', 'id')}]
+        parsed = compile_channel_spec(spec)(random_channel(random.Random(5)))
+        self.assertEqual(parsed['serviceCount'], parsed['serviceIds'])
+
+    def test_unknown_kind(self):
+        with self.assertRaises(Exception):
+            compile_channel_spec([{'field': 'x', 'kind': 'nope'}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import sys
+sys.path.append('ServiceDataImportFunctionApp/ServiceDataImportFunction')
+sys.path.append('benchmarks')
+sys.path.append('test')
+import unittest
+from unittest.mock import MagicMock, patch
+from service_data_import import checkpoint, ptv_importer
+from service_data_import.ptv_importer import *
+from memory_mongo import MemoryClient
+from ptv_fixtures import FixedDatetime, UrlSession
+
+
+class CheckpointedImportTest(unittest.TestCase):
+
+    def setUp(self):
+        responses = {API + "/CodeList/GetMunicipalityCodes": [{'code': '853', 'names': [{'value': 'Turku', 'language': 'fi'}]}],
+                     API + "/CodeList/GetAreaCodes/type/Province": [{'code': '02', 'names': [{'value': 'Varsinais-Suomi', 'language': 'fi'}]}]}
+        service_guids = [str(number) for number in range(250)]
+        responses[API + "/Service?page=1&date=2021-06-09T00%3A00%3A00"] = {'pageCount': 1, 'itemList': [{'id': guid} for guid in service_guids]}
+        responses[API + "/ServiceChannel/area/Province/code/02?includeWholeCountry=true&page=1&date=2021-06-09T00%3A00%3A00"] = {'pageCount': 1, 'itemList': []}
+        responses[API + "/ServiceChannel?page=1&date=2021-06-09T00%3A00%3A00"] = {'pageCount': 1, 'itemList': []}
+        for guid in service_guids:
+            responses[guid] = {'id': guid, 'type': 'Service', 'subType': 'Normal', 'organizations': [],
+                               'serviceChannels': [{'serviceChannel': {'id': 'c' + guid}}],
+                               'serviceNames': [{'language': 'fi', 'value': 'Palvelu ' + guid}],
+                               'serviceDescriptions': [], 'requirements': [],
+                               'targetGroups': [{'code': 'KR1', 'name': [{'language': 'fi', 'value': 'Ryhmä'}]}],
+                               'serviceClasses': [], 'lifeEvents': [], 'areas': []}
+            responses['c' + guid] = {'id': 'c' + guid, 'serviceChannelType': 'EChannel', 'areaType': 'Nationwide',
+                                     'organizationId': 'org1', 'services': [{'service': {'id': guid}}],
+                                     'serviceChannelNames': [{'language': 'fi', 'value': 'Kanava ' + guid}]}
+        self.responses = responses
+        self.database = MemoryClient().service_db
+        self.mongo_client = MagicMock()
+        for collection in [self.mongo_client.service_db.services, self.mongo_client.service_db.channels]:
+            collection.find.return_value.sort.return_value.limit.return_value = [{'lastUpdated': datetime(2021, 6, 9)}]
+        self.mongo_client.service_db.sync_state.find_one.return_value = None
+        self.mongo_client.service_db.import_runs = self.database.import_runs
+        self.mongo_client.service_db.import_run_batches = self.database.import_run_batches
+
+    def _run(self):
+        session = UrlSession(self.responses)
+        resume = ImportCheckpoint.resume
+
+        def resume_and_keep(*args):
+            self.checkpoint = resume(*args)
+            return(self.checkpoint)
+        with patch.object(ptv_importer, 'datetime', FixedDatetime), patch.object(ImportCheckpoint, 'resume', resume_and_keep), patch.object(checkpoint, 'listing_chunk_size', 100):
+            importer = PTVImporter(self.mongo_client, session, checkpointed=True, batches_in_flight=1)
+            importer.import_services()
+        return(session)
+
+    def _upserted_ids(self, collection):
+        return([request._filter['id'] for call in collection.bulk_write.call_args_list for request in call[0][0]])
+
+    def test_interrupted_run_resumes_from_last_batch(self):
+        services = self.mongo_client.service_db.services
+        services.bulk_write.side_effect = [MagicMock(), Exception("Evicted")]
+        with self.assertRaises(Exception):
+            self._run()
+        run = self.database.import_runs.find_one({})
+        self.assertEqual(run['status'], 'running')
+        self.assertEqual(run['stage'], 'service_batches')
+        # Listings and batch progress are kept out of the run document
+        self.assertNotIn('serviceGuids', run)
+        self.assertEqual(run['storedServiceIds'], [])
+        listing = list(self.database.import_run_batches.find({'run': run['_id'], 'stage': 'service_listing'}))
+        self.assertEqual([len(chunk['lists']['serviceGuids']) for chunk in listing], [100, 100, 50])
+        batches = list(self.database.import_run_batches.find({'run': run['_id'], 'stage': 'service_batches'}))
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(batches[0]['fields']['serviceBatches'], 1)
+        self.assertEqual(batches[0]['fields']['serviceIndex'], 100)
+        self.assertEqual(len(batches[0]['lists']['storedServiceIds']), 100)
+        self.assertEqual(len(batches[0]['lists']['referencedChannelIds']), 100)
+
+        services.bulk_write.side_effect = None
+        session = self._run()
+        # Listing and the first batch are not fetched again
+        self.assertFalse(any(url.startswith(API + "/Service?page=") for url in session.urls))
+        service_batch_urls = [url for url in session.urls if "/Service/serviceWithGD/list" in url]
+        self.assertEqual(len(service_batch_urls), 2)
+        self.assertEqual(self._upserted_ids(services)[-150:], [str(number) for number in range(100, 250)])
+
+        self.assertEqual(self.database.import_runs.find_one({})['status'], 'done')
+        self.assertEqual(self.database.import_run_batches.count_documents({}), 0)
+        run = self.checkpoint.run
+        self.assertEqual(run['serviceGuids'], [str(number) for number in range(250)])
+        self.assertEqual(run['serviceBatches'], 3)
+        self.assertEqual(len(set(run['storedServiceIds'])), 250)
+        # Channels of services stored before the interruption are still fetched
+        self.assertEqual(sorted(run['storedChannelIds']), sorted(['c' + str(number) for number in range(250)]))
+        self.assertEqual(run['channelBatches'], 3)
+        self.mongo_client.service_db.sync_state.update_one.assert_called()
+
+    def test_finished_run_is_not_resumed(self):
+        self._run()
+        session = self._run()
+        self.assertEqual(self.database.import_runs.count_documents({}), 2)
+        self.assertTrue(all(run['status'] == 'done' for run in self.database.import_runs.find({})))
+        self.assertTrue(any(url.startswith(API + "/Service?page=") for url in session.urls))
+
+    def test_old_unfinished_run_is_abandoned(self):
+        self.database.import_runs.insert_one({'_id': 'old', 'status': 'running', 'stage': 'service_batches', 'refetch': False, 'started': datetime(2021, 6, 8)})
+        self.database.import_run_batches.insert_one({'run': 'old', 'batch': 1, 'lists': {'storedServiceIds': ['1']}, 'fields': {}})
+        self._run()
+        self.assertEqual(self.database.import_runs.find_one({'_id': 'old'})['status'], 'abandoned')
+        self.assertEqual(self.database.import_runs.count_documents({'status': 'done'}), 1)
+        self.assertEqual(self.database.import_run_batches.count_documents({}), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import sys
+sys.path.append('ServiceDataImportFunctionApp/ServiceDataImportFunction')
+sys.path.append('benchmarks')
+import contextlib
+import io
+import unittest
+from service_data_import.codes import CodeDictionary
+from service_data_import.ptv_importer import PTVImporter
+from service_data_import.service_parser import parse_service_info
+from service_data_import.channel_parser import parse_channel_info
+from memory_mongo import MemoryClient
+from ptv_standin import PTVData, StandinServer
+
+
+class CodeDictionaryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data = PTVData.generated(40)
+
+    def test_round_trip(self):
+        codes = CodeDictionary()
+        for collection, raw_items, parse in [('services', self.data.services, parse_service_info), ('channels', self.data.channels, parse_channel_info)]:
+            for raw_item in raw_items.values():
+                parsed = parse(dict(raw_item))
+                normalised = codes.normalise(collection, parsed)
+                self.assertNotIn('name', str(normalised.get('areas')))
+                self.assertEqual(codes.denormalise(collection, normalised), parsed)
+
+    def test_loaded_dictionary_denormalises(self):
+        client = MemoryClient()
+        codes = CodeDictionary()
+        parsed = [parse_service_info(dict(raw_item)) for raw_item in self.data.services.values()]
+        normalised = [codes.normalise('services', service) for service in parsed]
+        stored = codes.store(client.service_db.codes)
+        self.assertEqual(stored, client.service_db.codes.count_documents({}))
+        # Nothing is written again until a code changes
+        self.assertEqual(codes.store(client.service_db.codes), 0)
+        loaded = CodeDictionary.load(client.service_db.codes)
+        self.assertEqual([loaded.denormalise('services', service) for service in normalised], parsed)
+        self.assertEqual(codes.denormalise('services', {'targetGroups': ['unknown']})['targetGroups']['fi'], [{'name': None, 'code': 'unknown'}])
+
+
+class NormalisedImportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data = PTVData.generated(60)
+        self.server = StandinServer(self.data).start()
+        self.client = MemoryClient()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def run_import(self, output_mode):
+        with contextlib.redirect_stdout(io.StringIO()):
+            importer = PTVImporter(self.client, api_url=self.server.api_url, refetch_day='never', output_mode=output_mode)
+            importer.import_services()
+        return(importer)
+
+    def test_normalised_documents_and_mode_switch(self):
+        importer = self.run_import('normalised')
+        self.assertEqual(importer.get_stored_output_mode(), 'normalised')
+        services = list(self.client.service_db.services.find({}, {'_id': 0}))
+        channels = list(self.client.service_db.channels.find({}, {'_id': 0}))
+        self.assertGreater(len(services), 0)
+        self.assertGreater(self.client.service_db.codes.count_documents({}), 0)
+        codes = CodeDictionary.load(self.client.service_db.codes)
+        for service in services:
+            self.assertTrue(all(isinstance(code, str) for code in service['targetGroups']))
+            expected = parse_service_info(dict(self.data.services[service['id']]))
+            denormalised = codes.denormalise('services', service)
+            self.assertEqual({key: denormalised[key] for key in expected}, expected)
+        for channel in channels:
+            expected = parse_channel_info(dict(self.data.channels[channel['id']]))
+            denormalised = codes.denormalise('channels', channel)
+            self.assertEqual({key: denormalised[key] for key in expected}, expected)
+
+        # Unchanged documents stored in the other shape are rewritten when the mode is switched back
+        importer = self.run_import('denormalised')
+        self.assertEqual(importer.get_stored_output_mode(), 'denormalised')
+        self.assertFalse(importer._output_mode_changed())
+        for service in self.client.service_db.services.find({}, {'_id': 0}):
+            self.assertNotIn('normalised', service)
+            self.assertEqual(service['targetGroups'], parse_service_info(dict(self.data.services[service['id']]))['targetGroups'])
+
+    def test_output_mode_is_validated(self):
+        with self.assertRaises(Exception):
+            self.run_import('compact')
+
+
+if __name__ == '__main__':
+    unittest.main()
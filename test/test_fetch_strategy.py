@@ -0,0 +1,68 @@
+import sys
+sys.path.append('ServiceDataImportFunctionApp/ServiceDataImportFunction')
+sys.path.append('benchmarks')
+import contextlib
+import io
+import unittest
+from datetime import datetime, timedelta
+from service_data_import.ptv_importer import PTVImporter
+from memory_mongo import MemoryClient
+from ptv_standin import PTVData, StandinServer
+
+
+class FetchStrategyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data = PTVData.generated(300)
+        self.server = StandinServer(self.data).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def run_import(self, fetch_strategy, client=None, engine='sync'):
+        client = client if client is not None else MemoryClient()
+        with contextlib.redirect_stdout(io.StringIO()):
+            importer = PTVImporter(client, api_url=self.server.api_url, engine=engine, refetch_day='never', fetch_strategy=fetch_strategy)
+            importer.import_services()
+        return(importer, set(service['id'] for service in client.service_db.services.find({}, {'_id': 0, 'id': 1})))
+
+    def test_area_listings_are_deduplicated(self):
+        importer, country_ids = self.run_import('country')
+        municipality_urls = importer._service_list_urls('municipality')
+        self.assertEqual(len(municipality_urls), len(importer.municipalities))
+        self.assertEqual(sum('includeWholeCountry=true' in url for url in municipality_urls), 1)
+        with contextlib.redirect_stdout(io.StringIO()):
+            guids = importer._list_ids_of_all('services', municipality_urls)
+        self.assertEqual(len(guids), len(set(guids)))
+        self.assertTrue(set(guids) < set(self.data.services))
+        # Services of the region are found with every strategy, the async engine lists the same ones
+        province_importer, province_ids = self.run_import('province', engine='async')
+        self.assertEqual(province_ids, country_ids)
+        self.assertLess(province_importer.listings['services']['items'], len(self.data.services))
+
+    def test_auto_uses_cheapest_complete_strategy(self):
+        client = MemoryClient()
+        importer, auto_ids = self.run_import('auto', client)
+        measurement = client.service_db.import_strategies.find_one({})
+        strategies = measurement['strategies']
+        self.assertEqual(strategies['country']['missedSuitable'], 0)
+        complete = [strategy for strategy, measured in strategies.items() if measured['missedSuitable'] == 0]
+        self.assertEqual(measurement['strategy'], min(complete, key=lambda strategy: strategies[strategy]['estimatedBytes']))
+        self.assertEqual(importer.active_fetch_strategy, measurement['strategy'])
+        self.assertEqual(auto_ids, self.run_import('country')[1])
+
+        # The measurement is reused until it is too old
+        importer, _ = self.run_import('auto', client)
+        self.assertEqual(client.service_db.import_strategies.count_documents({}), 1)
+        self.assertNotIn('measuring', [stage['stage'] for stage in importer.metrics.summary()['stages']])
+        client.service_db.import_strategies.update_many({}, {'$set': {'measured': datetime.utcnow() - timedelta(days=31)}})
+        self.run_import('auto', client)
+        self.assertEqual(client.service_db.import_strategies.count_documents({}), 2)
+
+    def test_fetch_strategy_is_validated(self):
+        with self.assertRaises(Exception):
+            self.run_import('region')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import sys
+sys.path.append('ServiceDataImportFunctionApp/ServiceDataImportFunction')
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+from service_data_import.http_cache import CachingSession
+from service_data_import.ptv_importer import *
+
+
+class ConditionalSession():
+    """
+    Serves JSON bodies with an ETag and answers matching If-None-Match with 304
+    """
+
+    def __init__(self, bodies, etags=True):
+        self.bodies = bodies
+        self.etags = etags
+        self.requests = []
+
+    def get(self, url, headers=None):
+        self.requests.append((url, headers))
+        content = json.dumps(self.bodies[url]).encode('utf-8')
+        etag = '"{}"'.format(hash(content)) if self.etags else None
+        response = MagicMock()
+        response.headers = {'ETag': etag} if etag else {}
+        if etag and headers and headers.get('If-None-Match') == etag:
+            response.status_code = 304
+            response.content = b''
+        else:
+            response.status_code = 200
+            response.content = content
+            response.json.return_value = self.bodies[url]
+        return(response)
+
+
+class CachingSessionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.code_url = API + "/CodeList/GetMunicipalityCodes"
+        self.batch_url = API + "/ServiceChannel/list?showHeader=true&guids=c1"
+        self.session = ConditionalSession({self.code_url: [{'code': '853'}], self.batch_url: [{'id': 'c1'}]})
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def test_code_lists_hit_on_warm_start(self):
+        cold = CachingSession(self.session, self.cache_dir.name)
+        self.assertEqual(cold.get(url=self.code_url).json(), [{'code': '853'}])
+        warm = CachingSession(self.session, self.cache_dir.name)
+        self.assertEqual(warm.get(url=self.code_url).json(), [{'code': '853'}])
+        self.assertEqual(len(self.session.requests), 1)
+        self.assertEqual(warm.stats['hits'], 1)
+        self.assertEqual(warm.stats['bytes_saved'], len(json.dumps([{'code': '853'}])))
+        self.assertEqual(warm.hit_ratio(), 1.0)
+
+    def test_batches_are_revalidated(self):
+        cache = CachingSession(self.session, self.cache_dir.name)
+        cache.get(url=self.batch_url)
+        self.assertEqual(cache.get(url=self.batch_url).json(), [{'id': 'c1'}])
+        self.assertEqual(len(self.session.requests), 2)
+        self.assertIsNotNone(self.session.requests[1][1]['If-None-Match'])
+        self.assertEqual(cache.stats, {'hits': 0, 'revalidated': 1, 'misses': 1, 'bytes_saved': len(json.dumps([{'id': 'c1'}]))})
+
+        # Changed content is fetched in full and replaces the cached one
+        self.session.bodies[self.batch_url] = [{'id': 'c1', 'changed': True}]
+        self.assertEqual(cache.get(url=self.batch_url).json(), [{'id': 'c1', 'changed': True}])
+        self.assertEqual(cache.get(url=self.batch_url).json(), [{'id': 'c1', 'changed': True}])
+        self.assertEqual(cache.stats['revalidated'], 2)
+
+    def test_without_validators_and_expired(self):
+        self.session.etags = False
+        cache = CachingSession(self.session, self.cache_dir.name, ttls={'/CodeList/': 60})
+        cache.get(url=self.batch_url)
+        cache.get(url=self.batch_url)
+        self.assertIsNone(self.session.requests[1][1])
+        # Batches without validators are not written at all
+        self.assertEqual(os.listdir(self.cache_dir.name), [])
+        cache.get(url=self.code_url)
+        with patch('time.time', return_value=time.time() + 120):
+            cache.get(url=self.code_url)
+        self.assertEqual(cache.stats['misses'], 4)
+
+    def test_prune_removes_old_entries(self):
+        cache = CachingSession(self.session, self.cache_dir.name)
+        cache.get(url=self.code_url)
+        for file_name in os.listdir(self.cache_dir.name):
+            os.utime(os.path.join(self.cache_dir.name, file_name), (0, 0))
+        CachingSession(self.session, self.cache_dir.name)
+        self.assertEqual(os.listdir(self.cache_dir.name), [])
+
+    def test_importer_wraps_session(self):
+        responses = {API + "/CodeList/GetMunicipalityCodes": [{'code': '853', 'names': [{'value': 'Turku', 'language': 'fi'}]}],
+                     API + "/CodeList/GetAreaCodes/type/Province": [{'code': '02', 'names': [{'value': 'Varsinais-Suomi', 'language': 'fi'}]}]}
+        session = ConditionalSession(responses)
+        with patch.dict(os.environ, {'PTV_HTTP_CACHE_DIR': self.cache_dir.name}):
+            PTVImporter(MagicMock(), session)
+            importer = PTVImporter(MagicMock(), session)
+        self.assertIsInstance(importer.api_session, CachingSession)
+        self.assertEqual(importer.municipalities, [{'name': {'en': None, 'fi': 'Turku', 'sv': None}, 'id': '853'}])
+        self.assertEqual(len(session.requests), 2)
+
+        # A cache given by the caller is not wrapped in another one
+        with patch.dict(os.environ, {'PTV_HTTP_CACHE_DIR': self.cache_dir.name}):
+            importer = PTVImporter(MagicMock(), CachingSession(session, self.cache_dir.name))
+        self.assertNotIsInstance(importer.api_session, CachingSession)
+        self.assertIsInstance(importer.meter.session, CachingSession)
+
+
+if __name__ == '__main__':
+    unittest.main()
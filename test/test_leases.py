@@ -0,0 +1,177 @@
+import sys
+sys.path.append('ServiceDataImportFunctionApp/ServiceDataImportFunction')
+sys.path.append('benchmarks')
+sys.path.append('test')
+import unittest
+from unittest.mock import patch
+from service_data_import import ptv_importer
+from service_data_import.leases import LeaseLost, ShardCoordinator
+from service_data_import.ptv_importer import *
+from memory_mongo import MemoryClient
+from ptv_fixtures import FixedDatetime, UrlSession
+
+
+class ShardCoordinatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.database = MemoryClient().service_db
+        self.first = ShardCoordinator(self.database, 'first', lease_seconds=60, shard_size=2)
+        self.second = ShardCoordinator(self.database, 'second', lease_seconds=60, shard_size=2)
+        self.run = self.first.join_or_start({'refetch': False}, timedelta(hours=24))
+
+    def test_replicas_join_the_same_run(self):
+        self.assertEqual(self.second.join_or_start({'refetch': False}, timedelta(hours=24))['_id'], self.run['_id'])
+        self.assertEqual(self.second.join(timedelta(hours=24))['_id'], self.run['_id'])
+        self.database.import_shard_runs.update_one({'_id': self.run['_id']}, {'$set': {'status': 'done'}})
+        self.assertIsNone(self.second.join(timedelta(hours=24)))
+
+    def test_racing_replicas_start_one_run(self):
+        self.database.import_shard_runs.update_one({'_id': self.run['_id']}, {'$set': {'status': 'done'}})
+        runs = self.database.import_shard_runs
+        find_one = runs.find_one
+        raced = []
+
+        def find_one_and_race(query, *args):
+            found = find_one(query, *args)
+            # The second replica starts a run right after the first one has read the active run
+            if query == {'_id': 'active'} and len(raced) == 0:
+                raced.append(None)
+                raced.append(self.second.join_or_start({'refetch': False}, timedelta(hours=24)))
+            return(found)
+        runs.find_one = find_one_and_race
+        joined = self.first.join_or_start({'refetch': False}, timedelta(hours=24))
+        self.assertEqual(joined['_id'], raced[1]['_id'])
+        self.assertEqual(runs.count_documents({'status': 'running'}), 1)
+
+    def test_tasks_are_claimed_in_order_once(self):
+        plan = self.first.claim(self.run['_id'])
+        self.assertEqual(plan['kind'], 'plan_services')
+        # Nothing is ready before the services are planned
+        self.assertIsNone(self.second.claim(self.run['_id']))
+        self.first.add_shards(self.run['_id'], 'services', ['1', '2', '3'])
+        self.first.complete(plan)
+        first_shard = self.first.claim(self.run['_id'])
+        second_shard = self.second.claim(self.run['_id'])
+        self.assertEqual((first_shard['guids'], second_shard['guids']), (['1', '2'], ['3']))
+        self.assertIsNone(self.second.claim(self.run['_id']))
+
+    def test_expired_lease_is_reclaimed(self):
+        plan = self.first.claim(self.run['_id'])
+        self.database.import_shards.update_one({'_id': plan['_id']}, {'$set': {'leaseUntil': datetime.utcnow() - timedelta(seconds=1)}})
+        reclaimed = self.second.claim(self.run['_id'])
+        self.assertEqual((reclaimed['kind'], reclaimed['owner'], reclaimed['attempts']), ('plan_services', 'second', 2))
+        with self.assertRaises(LeaseLost):
+            self.first.heartbeat(plan)
+        with self.assertRaises(LeaseLost):
+            self.first.complete(plan)
+        self.second.heartbeat(reclaimed)
+
+
+    def test_task_without_attempts_left_fails_the_run(self):
+        plan = self.first.claim(self.run['_id'])
+        self.first.release(plan, "Broken listing")
+        plan = self.second.claim(self.run['_id'])
+        self.assertEqual((plan['kind'], plan['attempts']), ('plan_services', 2))
+        self.database.import_shards.update_one({'_id': plan['_id']}, {'$set': {'leaseUntil': datetime.utcnow() - timedelta(seconds=1)}})
+        self.assertEqual(self.first.claim(self.run['_id'])['attempts'], 3)
+        self.database.import_shards.update_one({'_id': plan['_id']}, {'$set': {'leaseUntil': datetime.utcnow() - timedelta(seconds=1)}})
+        # The expired third attempt is the last one
+        self.assertIsNone(self.second.claim(self.run['_id']))
+        self.assertTrue(self.second.finished(self.run['_id']))
+        self.assertTrue(self.second.failed(self.run['_id']))
+        self.assertEqual(self.database.import_shards.find_one({'_id': plan['_id']})['status'], 'failed')
+
+
+class ShardedImportTest(unittest.TestCase):
+
+    def setUp(self):
+        responses = {API + "/CodeList/GetMunicipalityCodes": [{'code': '853', 'names': [{'value': 'Turku', 'language': 'fi'}]}],
+                     API + "/CodeList/GetAreaCodes/type/Province": [{'code': '02', 'names': [{'value': 'Varsinais-Suomi', 'language': 'fi'}]}]}
+        service_guids = [str(number) for number in range(230)]
+        responses[API + "/Service?page=1"] = {'pageCount': 1, 'itemList': [{'id': guid} for guid in service_guids]}
+        responses[API + "/ServiceChannel/area/Province/code/02?includeWholeCountry=true&page=1"] = {'pageCount': 1, 'itemList': []}
+        for guid in service_guids:
+            responses[guid] = {'id': guid, 'type': 'Service', 'subType': 'Normal', 'organizations': [],
+                               'serviceChannels': [{'serviceChannel': {'id': 'c' + guid}}],
+                               'serviceNames': [{'language': 'fi', 'value': 'Palvelu ' + guid}],
+                               'serviceDescriptions': [], 'requirements': [],
+                               'targetGroups': [{'code': 'KR1.1' if int(guid) % 3 == 0 else 'KR1', 'name': []}],
+                               'serviceClasses': [], 'lifeEvents': [], 'areas': []}
+            responses['c' + guid] = {'id': 'c' + guid, 'serviceChannelType': 'EChannel', 'areaType': 'Nationwide',
+                                     'organizationId': 'org1', 'services': [{'service': {'id': guid}}],
+                                     'serviceChannelNames': [{'language': 'fi', 'value': 'Kanava ' + guid}]}
+        self.responses = responses
+
+    def test_dead_replica_shard_is_taken_over(self):
+        client = MemoryClient()
+        importer = PTVImporter(client, UrlSession(self.responses), sharded=True)
+        importer.shard_size = 100
+        importer.shard_poll_seconds = 0
+        with patch.object(ptv_importer, 'datetime', FixedDatetime):
+            # A replica plans the services, claims the first shard and dies
+            dead = ShardCoordinator(client.service_db, 'dead', lease_seconds=60, shard_size=100)
+            run = dead.join_or_start({'refetch': False}, timedelta(hours=24))
+            plan = dead.claim(run['_id'])
+            dead.add_shards(run['_id'], 'services', [str(number) for number in range(230)])
+            dead.complete(plan, {'luTime': None, 'listingStarted': datetime.utcnow(), 'listing': {'items': 230}})
+            dead.claim(run['_id'])
+            client.service_db.import_shards.update_many({'owner': 'dead', 'status': 'claimed'}, {'$set': {'leaseUntil': datetime(2021, 6, 10, 11, 0)}})
+            importer.import_services()
+
+        self.assertEqual(client.service_db.services.count_documents({}), 153)
+        self.assertEqual(client.service_db.channels.count_documents({}), 153)
+        self.assertEqual(client.service_db.import_shard_runs.find_one({'_id': run['_id']})['status'], 'done')
+        self.assertEqual(client.service_db.import_shards.count_documents({'run': run['_id'], 'status': {'$ne': 'done'}}), 0)
+        reclaimed = client.service_db.import_shards.find_one({'run': run['_id'], 'kind': 'services', 'shard': 0})
+        self.assertEqual(reclaimed['attempts'], 2)
+
+    def test_started_run_is_done_by_shard_workers(self):
+        client = MemoryClient()
+        with patch.object(ptv_importer, 'datetime', FixedDatetime):
+            run = PTVImporter(client, UrlSession(self.responses), sharded=True).start_sharded_run()
+            self.assertEqual(client.service_db.import_shards.count_documents({'run': run['_id'], 'status': 'done'}), 0)
+            workers = [PTVImporter(client, UrlSession(self.responses), sharded=True) for number in range(2)]
+            for worker in workers:
+                worker.shard_size = 100
+                worker.import_services(join_only=True)
+        self.assertEqual(client.service_db.import_shard_runs.find_one({'_id': run['_id']})['status'], 'done')
+        self.assertEqual(client.service_db.services.count_documents({}), 153)
+
+    def test_poison_shard_fails_the_run(self):
+        client = MemoryClient()
+        del self.responses['117']
+        importer = PTVImporter(client, UrlSession(self.responses), sharded=True)
+        importer.shard_size = 100
+        importer.shard_poll_seconds = 0
+        with patch.object(ptv_importer, 'datetime', FixedDatetime):
+            with self.assertRaises(Exception):
+                importer.import_services()
+        run = client.service_db.import_shard_runs.find_one({'status': 'failed'})
+        failed = client.service_db.import_shards.find_one({'run': run['_id'], 'status': 'failed'})
+        self.assertEqual((failed['kind'], failed['shard'], failed['attempts']), ('services', 1, 3))
+
+    def test_run_without_tasks_is_abandoned(self):
+        client = MemoryClient()
+        # The starter made its run active and stopped before adding the tasks
+        client.service_db.import_shard_runs.insert_one({'_id': 'orphan', 'status': 'running', 'refetch': False, 'started': datetime.utcnow() - timedelta(hours=1)})
+        client.service_db.import_shard_runs.insert_one({'_id': 'active', 'run': 'orphan'})
+        importer = PTVImporter(client, UrlSession(self.responses), sharded=True)
+        importer.shard_poll_seconds = 0
+        importer.import_services(join_only=True)
+        self.assertEqual(client.service_db.import_shard_runs.find_one({'_id': 'orphan'})['status'], 'abandoned')
+        # The next start is not blocked by it
+        run = importer.start_sharded_run()
+        self.assertNotEqual(run['_id'], 'orphan')
+        self.assertEqual(client.service_db.import_shards.count_documents({'run': run['_id']}), 3)
+
+    def test_worker_only_joins_running_runs(self):
+        client = MemoryClient()
+        importer = PTVImporter(client, UrlSession(self.responses), sharded=True)
+        importer.import_services(join_only=True)
+        self.assertEqual(client.service_db.import_shard_runs.count_documents({}), 0)
+        with self.assertRaises(Exception):
+            PTVImporter(client, UrlSession(self.responses)).import_services(join_only=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
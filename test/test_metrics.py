@@ -0,0 +1,160 @@
+import sys
+sys.path.append('ServiceDataImportFunctionApp/ServiceDataImportFunction')
+sys.path.append('test')
+import json
+import os
+import tempfile
+import threading
+import tracemalloc
+import unittest
+from unittest.mock import MagicMock, patch
+from service_data_import import ptv_importer
+from service_data_import.metrics import MeteredSession, RunMetrics
+from service_data_import.paging import prefetch_map
+from service_data_import.ptv_importer import *
+from ptv_fixtures import FixedDatetime, UrlSession
+
+
+class RunMetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.output_dir.cleanup()
+
+    def test_stages_are_summed(self):
+        meter = MeteredSession(UrlSession({'a': {'x': 1}, 'b': [1, 2, 3]}))
+        metrics = RunMetrics(meter)
+        for url in ['a', 'b']:
+            with metrics.stage('fetching', 'services') as stage:
+                meter.get(url=url)
+                stage['documents_out'] = 2
+        stage = metrics.summary()['stages'][0]
+        self.assertEqual((stage['stage'], stage['collection']), ('fetching', 'services'))
+        self.assertEqual(stage['requests'], 2)
+        self.assertEqual(stage['bytes'], len('{"x": 1}') + len('[1, 2, 3]'))
+        self.assertEqual(stage['documents_out'], 4)
+        self.assertEqual(stage['entries'], 2)
+
+    def test_requests_are_counted_in_their_own_stages(self):
+        meter = MeteredSession(UrlSession({'a': {'x': 1}, 'b': [1, 2, 3]}))
+        metrics = RunMetrics(meter)
+
+        def fetch(url):
+            with metrics.stage('fetching', 'services'):
+                meter.get(url=url)
+        # Prefetch workers count in the stage that started them
+        with metrics.stage('listing', 'services'):
+            list(prefetch_map(lambda url: meter.get(url=url), ['a', 'b'], 2))
+        # A worker fetching while another stage is open is not counted in it
+        with metrics.stage('parsing', 'services'):
+            worker = threading.Thread(target=fetch, args=('a',))
+            worker.start()
+            worker.join()
+        stages = {stage['stage']: stage for stage in metrics.summary()['stages']}
+        self.assertEqual(stages['listing']['requests'], 2)
+        self.assertEqual(stages['fetching']['requests'], 1)
+        self.assertEqual(stages['parsing']['requests'], 0)
+        self.assertEqual(stages['parsing']['bytes'], 0)
+        self.assertEqual(metrics.summary()['requests'], 3)
+
+    def test_failed_stage_is_recorded(self):
+        metrics = RunMetrics()
+        with self.assertRaises(ValueError):
+            with metrics.stage('parsing', 'channels') as stage:
+                stage['documents_in'] = 3
+                raise ValueError("Broken document")
+        self.assertEqual(metrics.summary()['stages'][0]['documents_in'], 3)
+
+    def test_outputs_and_profiles(self):
+        metrics = RunMetrics.from_env({'PTV_METRICS_DIR': self.output_dir.name, 'PTV_PROFILE': 'cprofile, tracemalloc'})
+        self.assertFalse(tracemalloc.is_tracing())
+        metrics.start_tracing()
+        with metrics.stage('municipalities') as stage:
+            stage['documents_in'] = len([str(number) for number in range(1000)])
+        metrics.finish()
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertGreater(metrics.summary()['stages'][0]['peak_traced_bytes'], 0)
+        files = sorted(os.listdir(self.output_dir.name))
+        self.assertIn('ptv_import_metrics.json', files)
+        self.assertIn('ptv_import_metrics.prom', files)
+        self.assertIn(metrics.run_id + '_municipalities.prof', files)
+        self.assertIn(metrics.run_id + '_municipalities.tracemalloc', files)
+        with open(os.path.join(self.output_dir.name, 'ptv_import_metrics.json')) as summary_file:
+            self.assertEqual(json.load(summary_file)['stages'][0]['documents_in'], 1000)
+        with open(os.path.join(self.output_dir.name, 'ptv_import_metrics.prom')) as prometheus_file:
+            prometheus = prometheus_file.read()
+        self.assertIn('# TYPE ptv_import_stage_seconds gauge', prometheus)
+        self.assertIn('ptv_import_stage_documents_in{stage="municipalities"} 1000', prometheus)
+
+    def test_overlapping_stages_report_no_traced_peak(self):
+        metrics = RunMetrics(profile=['tracemalloc'], output_dir=self.output_dir.name)
+        # Nothing is traced before the run starts tracing
+        with metrics.stage('municipalities'):
+            pass
+        metrics.start_tracing()
+        with metrics.stage('listing', 'services'):
+            with metrics.stage('fetching', 'services'):
+                pass
+        with metrics.stage('storing', 'services'):
+            pass
+        metrics.finish()
+        stages = {stage['stage']: stage for stage in metrics.summary()['stages']}
+        self.assertIsNone(stages['municipalities']['peak_traced_bytes'])
+        self.assertIsNone(stages['listing']['peak_traced_bytes'])
+        self.assertIsNone(stages['fetching']['peak_traced_bytes'])
+        self.assertGreaterEqual(stages['storing']['peak_traced_bytes'], 0)
+        self.assertEqual([name for name in os.listdir(self.output_dir.name) if name.endswith('.tracemalloc')],
+                         [metrics.run_id + '_storing_services.tracemalloc'])
+        self.assertNotIn('ptv_import_stage_peak_traced_bytes{stage="listing"', metrics.prometheus())
+
+    def test_unknown_profiler(self):
+        with self.assertRaises(Exception):
+            RunMetrics.from_env({'PTV_PROFILE': 'perf'})
+
+
+class ImportMetricsTest(unittest.TestCase):
+
+    def test_every_stage_of_a_run_is_measured(self):
+        responses = {API + "/CodeList/GetMunicipalityCodes": [{'code': '853', 'names': [{'value': 'Turku', 'language': 'fi'}]}],
+                     API + "/CodeList/GetAreaCodes/type/Province": [{'code': '02', 'names': [{'value': 'Varsinais-Suomi', 'language': 'fi'}]}]}
+        service_guids = [str(number) for number in range(150)]
+        responses[API + "/Service?page=1&date=2021-06-09T00%3A00%3A00"] = {'pageCount': 1, 'itemList': [{'id': guid} for guid in service_guids]}
+        responses[API + "/ServiceChannel/area/Province/code/02?includeWholeCountry=true&page=1&date=2021-06-09T00%3A00%3A00"] = {'pageCount': 1, 'itemList': []}
+        responses[API + "/ServiceChannel?page=1&date=2021-06-09T00%3A00%3A00"] = {'pageCount': 1, 'itemList': []}
+        for guid in service_guids:
+            target_group = 'KR1.1' if int(guid) % 3 == 0 else 'KR1'
+            responses[guid] = {'id': guid, 'type': 'Service', 'subType': 'Normal', 'organizations': [],
+                               'serviceChannels': [{'serviceChannel': {'id': 'c' + guid}}],
+                               'serviceNames': [{'language': 'fi', 'value': 'Palvelu ' + guid}],
+                               'serviceDescriptions': [], 'requirements': [],
+                               'targetGroups': [{'code': target_group, 'name': []}],
+                               'serviceClasses': [], 'lifeEvents': [], 'areas': []}
+            responses['c' + guid] = {'id': 'c' + guid, 'serviceChannelType': 'EChannel', 'areaType': 'Nationwide',
+                                     'organizationId': 'org1', 'services': [{'service': {'id': guid}}],
+                                     'serviceChannelNames': [{'language': 'fi', 'value': 'Kanava ' + guid}]}
+        mongo_client = MagicMock()
+        for collection in [mongo_client.service_db.services, mongo_client.service_db.channels]:
+            collection.find.return_value.sort.return_value.limit.return_value = [{'lastUpdated': datetime(2021, 6, 9)}]
+        mongo_client.service_db.sync_state.find_one.return_value = None
+        importer = PTVImporter(mongo_client, UrlSession(responses), write_mode='delete_insert')
+        with patch.object(ptv_importer, 'datetime', FixedDatetime):
+            importer.import_services()
+
+        stages = {(stage['stage'], stage['collection']): stage for stage in importer.metrics.summary()['stages']}
+        self.assertEqual(set(stages), set([(stage, collection) for stage in ['listing', 'fetching', 'parsing', 'filtering', 'deleting', 'storing']
+                                           for collection in ['services', 'channels']] + [('listing', 'changed_channels'), ('municipalities', None)]))
+        self.assertEqual(stages[('listing', 'services')]['documents_out'], 150)
+        self.assertEqual(stages[('fetching', 'services')]['requests'], 2)
+        self.assertGreater(stages[('fetching', 'services')]['bytes'], 0)
+        self.assertEqual(stages[('filtering', 'services')]['documents_in'], 150)
+        self.assertEqual(stages[('filtering', 'services')]['documents_out'], 100)
+        self.assertEqual(stages[('fetching', 'channels')]['documents_in'], 100)
+        self.assertEqual(stages[('storing', 'channels')]['documents_out'], 100)
+        self.assertEqual(stages[('municipalities', None)]['documents_out'], 1)
+        self.assertGreater(stages[('parsing', 'services')]['process_peak_rss_bytes'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import sys
+sys.path.append('ServiceDataImportFunctionApp/ServiceDataImportFunction')
+sys.path.append('test')
+import unittest
+from unittest.mock import MagicMock
+from pymongo import ReplaceOne
+from service_data_import.ptv_importer import *
+from ptv_fixtures import code_list_session
+
+
+class UpsertWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mongo_client = MagicMock()
+        result = MagicMock(matched_count=2, upserted_count=1, modified_count=1)
+        self.mongo_client.service_db.services.bulk_write.return_value = result
+        self.importer = PTVImporter(self.mongo_client, code_list_session())
+
+    def test_chunked_unordered_replace_by_id(self):
+        services = [{'id': str(number), 'name': {'fi': 'Palvelu'}} for number in range(7)]
+        totals = self.importer.upsert_to_mongo('services', services, chunk_size=3)
+        calls = self.mongo_client.service_db.services.bulk_write.call_args_list
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(calls[0][0][0], [ReplaceOne({'id': str(number)}, services[number], upsert=True) for number in range(3)])
+        self.assertEqual(len(calls[2][0][0]), 1)
+        for call in calls:
+            self.assertEqual(call[1], {'ordered': False})
+        self.assertEqual(totals, {'matched': 6, 'upserted': 3, 'modified': 3})
+
+    def test_nothing_to_write(self):
+        self.assertEqual(self.importer.upsert_to_mongo('services', []), {'matched': 0, 'upserted': 0, 'modified': 0})
+        self.importer._write_changed('services', [])
+        self.mongo_client.service_db.services.bulk_write.assert_not_called()
+        self.mongo_client.service_db.services.delete_many.assert_not_called()
+
+    def test_legacy_write_mode_never_deletes_everything(self):
+        importer = PTVImporter(self.mongo_client, code_list_session(), write_mode='delete_insert')
+        importer._write_changed('channels', [])
+        self.mongo_client.service_db.channels.delete_many.assert_not_called()
+        with self.assertRaises(Exception):
+            PTVImporter(self.mongo_client, code_list_session(), write_mode='merge')
+
+    def test_unknown_collection(self):
+        with self.assertRaises(Exception):
+            self.importer.upsert_to_mongo('organizations', [{'id': '1'}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import sys
+sys.path.append('ServiceDataImportFunctionApp/ServiceDataImportFunction')
+import threading
+import unittest
+from datetime import datetime
+from unittest.mock import MagicMock
+from service_data_import.async_fetch import AsyncPTVFetcher
+from service_data_import.paging import PagedIdIterator, latest_modified, merge_listings, prefetch_map, parse_modified
+
+
+class PagedIdIteratorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pages = {'1': {'pageCount': 4, 'itemList': [{'id': 'a'}, {'id': 'b'}]},
+                      '2': {'pageCount': 4, 'itemList': [{'id': 'b'}, {'id': 'c'}]},
+                      '3': {'pageCount': 4, 'itemList': None},
+                      '4': {'pageCount': 4, 'itemList': [{'id': 'd'}, {'id': 'a'}]}}
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def get_json(self, url):
+        with self.lock:
+            self.calls.append(url)
+        return(self.pages[url.split('page=')[1]])
+
+    def test_yields_unique_ids_in_page_order(self):
+        iterator = PagedIdIterator(self.get_json, 'http://ptv/Service?page={}', prefetch=3)
+        self.assertEqual(list(iterator), ['a', 'b', 'c', 'd'])
+        self.assertEqual(iterator.page_count, 4)
+        self.assertEqual(sorted(self.calls), ['http://ptv/Service?page={}'.format(page) for page in range(1, 5)])
+
+    def test_shared_seen_set(self):
+        seen = set(['a'])
+        iterator = PagedIdIterator(self.get_json, 'http://ptv/Service?page={}', prefetch=1, seen=seen)
+        self.assertEqual(list(iterator), ['b', 'c', 'd'])
+        self.assertEqual(seen, set(['a', 'b', 'c', 'd']))
+
+    def test_single_page_without_page_count(self):
+        self.pages = {'1': {'itemList': [{'id': 'a'}]}}
+        self.assertEqual(list(PagedIdIterator(self.get_json, 'http://ptv/Service?page={}')), ['a'])
+        self.assertEqual(len(self.calls), 1)
+
+    def test_async_listing_matches_iterator(self):
+        session = MagicMock()
+        session.get.side_effect = lambda url: MagicMock(json=MagicMock(return_value=self.get_json(url)))
+        fetcher = AsyncPTVFetcher(session, max_in_flight=3)
+        guids, item_count = fetcher.run(fetcher.get_paged_listing('http://ptv/Service?page={}'))
+        iterator = PagedIdIterator(self.get_json, 'http://ptv/Service?page={}')
+        self.assertEqual(guids, list(iterator))
+        self.assertEqual(item_count, iterator.item_count)
+
+    def test_merge_listings(self):
+        self.assertEqual(merge_listings([(['a', 'b'], 3), (['c', 'a'], 2), ([], 0)]), (['a', 'b', 'c'], 5))
+
+    def test_latest_modified_time(self):
+        items = [{'id': 'a', 'modified': '2021-06-09T10:11:12.1234567'}, {'id': 'b'}, {'id': 'c', 'modified': '2021-06-09T08:00:00Z'}]
+        self.assertEqual(latest_modified(items), datetime(2021, 6, 9, 10, 11, 12, 123456))
+        self.assertEqual(latest_modified(items, datetime(2021, 6, 10)), datetime(2021, 6, 10))
+        self.assertIsNone(latest_modified([{'id': 'b'}]))
+
+    def test_item_count(self):
+        iterator = PagedIdIterator(self.get_json, 'http://ptv/Service?page={}', prefetch=2)
+        list(iterator)
+        self.assertEqual(iterator.item_count, 6)
+
+    def test_parse_modified(self):
+        self.assertEqual(parse_modified('2021-06-09T10:00:00+03:00'), datetime(2021, 6, 9, 7, 0))
+        self.assertEqual(parse_modified('2021-06-09T10:00:00.5'), datetime(2021, 6, 9, 10, 0, 0, 500000))
+        self.assertIsNone(parse_modified(None))
+        self.assertIsNone(parse_modified('yesterday'))
+
+    def test_prefetch_map_keeps_order_and_bound(self):
+        running = []
+        peak = []
+
+        def work(item):
+            with self.lock:
+                running.append(item)
+                peak.append(len(running))
+            with self.lock:
+                running.remove(item)
+            return(item * 2)
+
+        self.assertEqual(list(prefetch_map(work, range(20), 3)), [item * 2 for item in range(20)])
+        self.assertLessEqual(max(peak), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import sys
+sys.path.append('ServiceDataImportFunctionApp/ServiceDataImportFunction')
+sys.path.append('test')
+import copy
+import random
+import unittest
+from service_data_import.parallel_parse import ParallelParser, parallel_parser_from_env
+from service_data_import.service_parser import parse_service_info
+from service_data_import.channel_parser import parse_channel_info
+from test_service_parser import random_service
+from test_channel_parser import random_channel
+
+
+class ParallelParserTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(7)
+        self.services = [random_service(rng) for _ in range(300)]
+        self.channels = [random_channel(rng) for _ in range(300)]
+
+    def test_same_output_and_order_as_in_process(self):
+        parser = ParallelParser(workers=2, chunk_size=64, min_parallel_items=10)
+        try:
+            self.assertEqual(parser.parse('services', copy.deepcopy(self.services)),
+                             [parse_service_info(service) for service in copy.deepcopy(self.services)])
+            self.assertEqual(parser.parse('channels', self.channels),
+                             [parse_channel_info(channel) for channel in self.channels])
+            self.assertIsNotNone(parser._executor)
+        finally:
+            parser.close()
+
+    def test_small_batches_parsed_in_process(self):
+        parser = ParallelParser(workers=2, min_parallel_items=1000)
+        parsed = parser.parse('channels', self.channels)
+        self.assertEqual(len(parsed), 300)
+        self.assertIsNone(parser._executor)
+
+    def test_configuration(self):
+        self.assertIsNone(parallel_parser_from_env({}))
+        parser = parallel_parser_from_env({'PTV_PARSE_WORKERS': '3', 'PTV_PARSE_CHUNK_SIZE': '50'})
+        self.assertEqual((parser.workers, parser.chunk_size, parser.min_parallel_items), (3, 50, 20))
+        with self.assertRaises(Exception):
+            ParallelParser(workers=2).parse('organizations', [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import sys
+sys.path.append('ServiceDataImportFunctionApp/ServiceDataImportFunction')
+sys.path.append('benchmarks')
+import unittest
+import urllib
+from datetime import datetime, timedelta
+import requests
+from e2e_import import run_import
+from memory_mongo import MemoryClient
+from ptv_standin import PTVData, StandinConfig, StandinServer
+
+
+class PTVStandinTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data = PTVData.generated(60)
+        self.server = StandinServer(self.data, StandinConfig(page_size=25)).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_paging_and_date(self):
+        first_page = requests.get(self.server.api_url + "/Service?page=1").json()
+        self.assertEqual((first_page['pageCount'], len(first_page['itemList'])), (3, 25))
+        last_page = requests.get(self.server.api_url + "/Service?page=3").json()
+        self.assertEqual(len(last_page['itemList']), 10)
+        since = datetime.utcnow() - timedelta(days=30)
+        listed = requests.get(self.server.api_url + "/Service?page=1&date=" + urllib.parse.quote_plus(since.strftime("%Y-%m-%dT%H:%M:%S"))).json()
+        expected = len([guid for guid in self.data.services if self.data.modified[guid] >= since.replace(microsecond=0)])
+        self.assertEqual(min(expected, 25), len(listed['itemList']))
+
+    def test_guids_and_limit(self):
+        guids = list(self.data.services)[:3]
+        services = requests.get(self.server.api_url + "/Service/serviceWithGD/list?showHeader=true&guids=" + urllib.parse.quote_plus(','.join(guids))).json()
+        self.assertEqual([service['id'] for service in services], guids)
+        response = requests.get(self.server.api_url + "/ServiceChannel/list?guids=" + ','.join(str(number) for number in range(101)))
+        self.assertEqual(response.status_code, 400)
+
+    def test_rate_limit(self):
+        self.server.config.rate_limit = 2
+        self.server._tokens = 2
+        statuses = [requests.get(self.server.api_url + "/CodeList/GetMunicipalityCodes").status_code for _ in range(4)]
+        self.assertIn(429, statuses)
+
+    def test_full_and_incremental_import(self):
+        client = MemoryClient()
+        full = run_import(client, self.server, 'sync', False, 'upsert', False)
+        self.assertGreaterEqual(full['listed'], len(self.data.services))
+        self.assertGreater(full['stored']['services'], 0)
+        self.assertEqual(full['statuses'], {'200': full['requests']})
+        touched = self.data.touch(0.1)
+        incremental = run_import(client, self.server, 'sync', False, 'upsert', False)
+        self.assertLess(incremental['fetched'], full['fetched'])
+        self.assertGreaterEqual(incremental['fetched'], len([guid for guid in touched if guid in self.data.services]))
+        self.assertIsNotNone(incremental['latency_ms']['p99'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import sys
+sys.path.append('ServiceDataImportFunctionApp/ServiceDataImportFunction')
+sys.path.append('benchmarks')
+sys.path.append('test')
+import unittest
+from unittest.mock import patch
+from service_data_import import ptv_importer
+from service_data_import.ptv_importer import *
+from memory_mongo import MemoryClient
+from ptv_fixtures import UrlSession, fixed_datetime
+
+FixedDatetime = fixed_datetime(datetime(2021, 6, 1, 12, 0))
+
+
+def listing(guids):
+    return({'pageCount': 1, 'itemList': [{'id': guid} for guid in guids]})
+
+
+class ReconciliationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.responses = {API + "/CodeList/GetMunicipalityCodes": [{'code': '853', 'names': [{'value': 'Turku', 'language': 'fi'}]}],
+                          API + "/CodeList/GetAreaCodes/type/Province": [{'code': '02', 'names': [{'value': 'Varsinais-Suomi', 'language': 'fi'}]}]}
+        self.client = MemoryClient()
+        self.client.service_db.services.insert_many([{'id': str(number)} for number in range(10)])
+        self.client.service_db.channels.insert_many([{'id': 'c' + str(number)} for number in range(10)])
+
+    def test_only_withdrawn_items_are_deleted(self):
+        self.responses[API + "/Service?page=1"] = listing([str(number) for number in range(1, 50)])
+        self.responses[API + "/ServiceChannel?page=1"] = listing(['c' + str(number) for number in range(10) if number != 4])
+        importer = PTVImporter(self.client, UrlSession(self.responses))
+        self.assertEqual(importer.reconcile_deletions(), {'services': 1, 'channels': 1})
+        self.assertIsNone(self.client.service_db.services.find_one({'id': '0'}))
+        self.assertIsNone(self.client.service_db.channels.find_one({'id': 'c4'}))
+        self.assertEqual(self.client.service_db.services.count_documents({}), 9)
+        stages = {(stage['stage'], stage['collection']): stage for stage in importer.metrics.summary()['stages']}
+        self.assertEqual(stages[('reconciling', 'services')]['documents_out'], 1)
+
+    def test_suspicious_listings_delete_nothing(self):
+        self.responses[API + "/Service?page=1"] = listing([])
+        self.responses[API + "/ServiceChannel?page=1"] = listing(['c1'])
+        importer = PTVImporter(self.client, UrlSession(self.responses))
+        self.assertEqual(importer.reconcile_deletions(), {'services': 0, 'channels': 0})
+        self.assertEqual(self.client.service_db.services.count_documents({}), 10)
+        self.assertEqual(self.client.service_db.channels.count_documents({}), 10)
+
+    def test_refetch_day(self):
+        importer = PTVImporter(self.client, UrlSession(self.responses))
+        self.assertTrue(importer._is_refetch_day(datetime(2021, 6, 1)))
+        self.assertFalse(PTVImporter(self.client, UrlSession(self.responses), refetch_day='15')._is_refetch_day(datetime(2021, 6, 1)))
+        never = PTVImporter(self.client, UrlSession(self.responses), refetch_day='never')
+        self.assertFalse(any(never._is_refetch_day(datetime(2021, 6, day)) for day in range(1, 31)))
+
+    def test_incremental_run_reconciles_instead_of_refetching(self):
+        self.client.service_db.sync_state.insert_one({'source': sync_source, 'entity': 'services', 'watermark': datetime(2021, 5, 31)})
+        self.client.service_db.sync_state.insert_one({'source': sync_source, 'entity': 'channels', 'watermark': datetime(2021, 5, 31)})
+        date = "&date=2021-05-31T00%3A00%3A00"
+        self.responses[API + "/Service?page=1" + date] = listing([])
+        self.responses[API + "/ServiceChannel/area/Province/code/02?includeWholeCountry=true&page=1" + date] = listing([])
+        self.responses[API + "/ServiceChannel?page=1" + date] = listing([])
+        self.responses[API + "/Service?page=1"] = listing([str(number) for number in range(9)])
+        self.responses[API + "/ServiceChannel?page=1"] = listing(['c' + str(number) for number in range(10)])
+        importer = PTVImporter(self.client, UrlSession(self.responses), streaming=True, reconcile=True, refetch_day='never')
+        with patch.object(ptv_importer, 'datetime', FixedDatetime):
+            importer.import_services()
+        self.assertEqual(self.client.service_db.services.count_documents({}), 9)
+        self.assertEqual(self.client.service_db.channels.count_documents({}), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import sys
+sys.path.append('ServiceDataImportFunctionApp/ServiceDataImportFunction')
+sys.path.append('benchmarks')
+import contextlib
+import io
+import threading
+import unittest
+from unittest.mock import MagicMock
+from service_data_import.ptv_importer import PTVImporter
+from service_data_import.refresh import RefreshCoalescer, handle_refresh_messages, parse_refresh_message
+from local_queue import LocalQueue
+from memory_mongo import MemoryClient
+from ptv_standin import PTVData, StandinServer
+
+guid = '0f8fad5b-d9cb-469f-a165-70867728950e'
+
+
+class RefreshMessageTest(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(parse_refresh_message(b'{"services": ["' + guid.upper().encode() + b'"]}'), ([guid], []))
+        for body in ['[]', '{"channels": "x"}', '{"services": ["not a guid"]}', 'not json']:
+            with self.assertRaises(ValueError):
+                parse_refresh_message(body)
+
+    def test_coalescing_window(self):
+        now = [100.0]
+        coalescer = RefreshCoalescer(10, clock=lambda: now[0])
+        first = coalescer.request(['a', 'a', 'b'], ['a'])
+        now[0] = 105.0
+        second = coalescer.request(['a', 'c'], [])
+        now[0] = 115.0
+        # Pending requests of a are merged, b was not requested again and is ready with it
+        self.assertEqual(coalescer.next_claim(first), (['a', 'b', 'c'], ['a']))
+        # A request arriving while the refresh is in flight is not covered by it
+        third = coalescer.request(['a'], [])
+        coalescer.release(['a', 'b', 'c'], ['a'], True)
+        self.assertIsNone(coalescer.next_claim(first))
+        self.assertIsNone(coalescer.next_claim(second))
+        now[0] = 125.0
+        self.assertEqual(coalescer.next_claim(third), (['a'], []))
+        # A failed refresh leaves its requests pending
+        coalescer.release(['a'], [], False)
+        self.assertEqual(coalescer.next_claim(third), (['a'], []))
+        coalescer.release(['a'], [], True)
+        self.assertIsNone(coalescer.next_claim(third))
+        self.assertEqual(coalescer.tickets, {})
+        self.assertEqual(coalescer.coalesced, 2)
+
+    def test_request_during_refresh_is_refreshed_again(self):
+        importer = MagicMock()
+        started = threading.Event()
+        finish = threading.Event()
+
+        def refresh(service_ids, channel_ids):
+            if importer.refresh.call_count == 1:
+                started.set()
+                finish.wait(5)
+            return({'services': {'requested': len(service_ids)}})
+        importer.refresh.side_effect = refresh
+        coalescer = RefreshCoalescer(0)
+        results = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            first = threading.Thread(target=lambda: results.append(handle_refresh_messages(importer, coalescer, [{'services': [guid]}])))
+            first.start()
+            started.wait(5)
+            second = threading.Thread(target=lambda: results.append(handle_refresh_messages(importer, coalescer, [{'services': [guid]}])))
+            second.start()
+            finish.set()
+            first.join(5)
+            second.join(5)
+        self.assertEqual(importer.refresh.call_count, 2)
+        self.assertEqual(len(results), 2)
+
+    def test_failed_refresh_is_retried(self):
+        importer = MagicMock()
+        importer.refresh.side_effect = [Exception("PTV unavailable"), {'services': {}}]
+        coalescer = RefreshCoalescer(0)
+        queue = LocalQueue(max_deliveries=3)
+        queue.send({'services': [guid]})
+        results = queue.run(lambda batch: handle_refresh_messages(importer, coalescer, [message.get_body() for message in batch]))
+        self.assertEqual(results, [{'services': {}}])
+        self.assertEqual(importer.refresh.call_count, 2)
+
+
+class RefreshImportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data = PTVData.generated(60)
+        self.server = StandinServer(self.data).start()
+        self.client = MemoryClient()
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.importer = PTVImporter(self.client, api_url=self.server.api_url)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_queued_ids_are_refreshed(self):
+        service_ids = list(self.data.services)
+        suitable_ids = [service_id for service_id in service_ids
+                        if self.importer._is_suitable_service(self.importer._parse_service_info(dict(self.data.services[service_id])))]
+        withdrawn_id = '11111111-1111-1111-1111-111111111111'
+        self.client.service_db.services.insert_one({'id': withdrawn_id})
+        queue = LocalQueue()
+        queue.send({'services': suitable_ids[:2]})
+        queue.send({'services': suitable_ids[:1] + [withdrawn_id]})
+        queue.send(b'broken')
+        coalescer = RefreshCoalescer(0)
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = queue.run(lambda batch: handle_refresh_messages(self.importer, coalescer, [message.get_body() for message in batch]))
+        self.assertEqual(results[0]['services'], {'requested': 3, 'fetched': 2, 'stored': 2, 'deleted': 1})
+        self.assertEqual(sorted(document['id'] for document in self.client.service_db.services.find()), sorted(suitable_ids[:2]))
+        # Referenced channels that were not stored come along
+        referenced_ids = set(service_channel['serviceChannel']['id'] for service_id in suitable_ids[:2]
+                             for service_channel in self.data.services[service_id]['serviceChannels'])
+        self.assertEqual(results[0]['channels']['fetched'], len(referenced_ids))
+        self.assertEqual(self.client.service_db.sync_state.count_documents({}), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
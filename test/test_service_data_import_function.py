@@ -102,12 +102,12 @@ class ServiceDataImportTest(unittest.TestCase):
           'addresses': [{'streetAddress': {'street': [], 'postOffice': [], 'municipality': {'code': '009', 'name':[]}}}],
           'areas': []}]
         
-        mongo_response = [{'_id': None,'max': 1000 * datetime.strptime('2021-06-09T00:00.00.000Z', "%Y-%m-%dT%H:%M.%S.%fZ").timestamp()}]
+        mongo_response = [{'lastUpdated': 1000 * datetime.strptime('2021-06-09T00:00.00.000Z', "%Y-%m-%dT%H:%M.%S.%fZ").timestamp()}]
         self.mongo_client_instance = MagicMock()
         self.mongo_client_instance.service_db = MagicMock()
         self.mongo_client_instance.service_db.services = MagicMock()
-        self.mongo_client_instance.service_db.services.aggregate = MagicMock()
-        self.mongo_client_instance.service_db.services.aggregate.return_value = mongo_response
+        self.mongo_client_instance.service_db.services.find = MagicMock()
+        self.mongo_client_instance.service_db.services.find.return_value.sort.return_value.limit.return_value = mongo_response
         self.api_session_instance = MagicMock()
         self.api_session_instance.get = MagicMock()
         get_mock_0 = MagicMock()
@@ -128,6 +128,26 @@ class ServiceDataImportTest(unittest.TestCase):
     def test_latest_update_time(self):
         lu_time = self.ptv_importer.get_latest_update_time_from_mongo('services')
         self.assertEqual(lu_time, datetime(2021, 6, 9))
+        self.mongo_client_instance.service_db.services.find.return_value.sort.assert_called_once_with('lastUpdated', DESCENDING)
+        self.mongo_client_instance.service_db.services.find.return_value.sort.return_value.limit.assert_called_once_with(1)
+
+    def test_latest_update_time_as_date(self):
+        self.mongo_client_instance.service_db.channels.find.return_value.sort.return_value.limit.return_value = [{'lastUpdated': datetime(2021, 6, 9, 1, 2)}]
+        lu_time = self.ptv_importer.get_latest_update_time_from_mongo('channels')
+        self.assertEqual(lu_time, datetime(2021, 6, 9, 1, 2))
+
+    def test_ensure_indexes(self):
+        services = self.mongo_client_instance.service_db.services
+        services.create_index.assert_any_call([('id', 1)], unique=True, name='id_1')
+        services.create_index.assert_any_call([('lastUpdated', 1)], unique=False, name='lastUpdated_1')
+        services.index_information.return_value = {'_id_': {'key': [('_id', 1)]},
+                                                   'id_1': {'key': [('id', 1)], 'unique': True},
+                                                   'lastUpdated_1': {'key': [('lastUpdated', 1)]}}
+        self.mongo_client_instance.service_db.municipalities.index_information.return_value = {'id_1': {'key': [('id', 1)]}}
+        missing = self.ptv_importer.ensure_indexes()
+        self.assertEqual(missing['services'], [])
+        self.assertEqual(missing['channels'], ['id', 'lastUpdated'])
+        self.assertEqual(missing['municipalities'], ['id'])
         
     def test_is_suitable(self):
         service_guids = self.ptv_importer._get_all_service_guids(None)
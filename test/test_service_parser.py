@@ -0,0 +1,197 @@
+import sys
+sys.path.append('ServiceDataImportFunctionApp/ServiceDataImportFunction')
+import copy
+import random
+import unittest
+from service_data_import.service_parser import parse_service_info
+
+
+# The multi pass parser that parse_service_info replaced, kept as the reference output
+
+def reference_parse_service_info(service: dict) -> dict:
+    service_final = {}
+    service_id = service.get('id')
+    service_final['id'] = service_id
+    service_type = service.get('type')
+    service_final['type'] = service_type
+    service_subtype = service.get('subType')
+    service_final['subtype'] = service_subtype
+
+    channel_ids = [channel.get('serviceChannel').get('id') for channel in service.get('serviceChannels')]
+    service_final['channelIds'] = channel_ids
+
+    organizations = service.get('organizations')
+    organization_elements = []
+    for organization in organizations:
+        role_type = organization.get('roleType')
+        if organization.get('organization') is not None:
+            organization_el = organization.get('organization')
+            organization_el['roleType'] = role_type
+            organization_elements.append(organization_el)
+        else:
+            if len(organization.get('additionalInformation')) > 0:
+                org_name = organization.get('additionalInformation')[0]['value']
+                organization_el = {'name': org_name, 'id': None, 'roleType': role_type}
+                organization_elements.append(organization_el)
+
+    service_final['organizations'] = organization_elements
+
+
+    languages = ['en', 'fi', 'sv']
+    language_division = {'en': None, 'fi': None, 'sv': None}
+    service_final['name'] = language_division.copy()
+    service_final['descriptions'] = language_division.copy()
+    service_final['requirement'] = language_division.copy()
+    service_final['targetGroups'] = language_division.copy()
+    service_final['serviceClasses'] = language_division.copy()
+    service_final['areas'] = language_division.copy()
+    service_final['lifeEvents'] = language_division.copy()
+    # Divided by language    
+    for language in languages:
+        names = [l_name.get('value') for l_name in [name for name in service.get('serviceNames') if name.get('language') == language]]
+        names = [l_name for l_name in names if l_name is not None]
+        if len(names) > 0:
+            name = ' - '.join(names)
+        else:
+            name = None
+        service_final['name'][language] = name
+        descriptions = [{'value': l_description.get('value'), 'type': l_description.get('type')} for l_description in [description for description in service.get('serviceDescriptions') if description.get('language') == language]]
+        descriptions = [d for d in descriptions if d['value'] is not None]
+        service_final['descriptions'][language] = descriptions
+
+        requirements = [l_requirement.get('value') for l_requirement in [requirement for requirement in service.get('requirements') if requirement.get('language') == language]]
+        requirements = [r for r in requirements if r is not None]
+        requirement = " ".join(requirements)
+        service_final['requirement'][language] = requirement
+
+        # Target groups
+        target_groups = service.get('targetGroups')
+        target_group_elements = []
+        for target_group in target_groups:
+            target_group_names = [l_target_group_name.get('value') for l_target_group_name in [target_group_name for target_group_name in target_group.get('name') if target_group_name.get('language') == language]]
+            target_group_names = [tgn for tgn in target_group_names if tgn is not None]
+            target_group_name = " ".join(target_group_names)
+            target_group_code = target_group.get('code')
+            target_group_el = {"name": target_group_name,
+                               "code": target_group_code}
+            target_group_elements.append(target_group_el) 
+        service_final['targetGroups'][language] = target_group_elements
+
+
+        # Service classes
+        service_classes = service.get('serviceClasses')
+        service_class_elements = []
+        for service_class in service_classes:
+            service_class_names = [l_service_class_name.get('value') for l_service_class_name in [service_class_name for service_class_name in service_class.get('name') if service_class_name.get('language') == language]]
+            service_class_names = [sc_name for sc_name in service_class_names if sc_name is not None]
+            if len(service_class_names) > 0:
+                service_class_name = ' - '.join(service_class_names)
+            else:
+                service_class_name = None
+            service_class_descriptions = [l_service_class_description.get('value') for l_service_class_description in [service_class_description for service_class_description in service_class.get('description') if service_class_description.get('language') == language]]
+            service_class_descriptions = [scd for scd in service_class_descriptions if scd is not None]
+            service_class_description = " ".join(service_class_descriptions)
+            service_class_code = service_class.get('code')
+            service_class_el = {"name": service_class_name,
+                                "description": service_class_description,
+                                "code": service_class_code}
+            service_class_elements.append(service_class_el)
+        service_final['serviceClasses'][language] = service_class_elements
+
+        # Areas
+        areas = service.get('areas')
+        area_elements = []
+        for area in areas:
+            area_type = area.get('type')
+            if area.get('type') == 'Municipality':
+                area = area.get('municipalities')[0]
+            area_code = area.get('code')
+            area_names = [l_area_name.get('value') for l_area_name in [area_name for area_name in area.get('name') if area_name.get('language') == language]]
+            area_names = [a_name for a_name in area_names if a_name is not None]
+            if len(area_names) > 0:
+                area_name = ' - '.join(area_names)
+            else:
+                area_name = None
+            area_el = {"name": area_name,
+                                "type": area_type,
+                                "code": area_code}
+            area_elements.append(area_el)
+        service_final['areas'][language] = area_elements
+
+        # Life events
+        life_events = service.get('lifeEvents')
+        le_elements = []
+        for life_event in life_events:
+            life_event_code = life_event.get('code')
+            life_event_names = [l_life_event_name.get('value') for l_life_event_name in [life_event_name for life_event_name in life_event.get('name') if life_event_name.get('language') == language]]
+            life_event_names = [le_name for le_name in life_event_names if le_name is not None]
+            if len(life_event_names) > 0:
+                life_event_name = ' - '.join(life_event_names)
+            else:
+                life_event_name = None
+            life_event_el = {"name": life_event_name,
+                                "code": life_event_code}
+            le_elements.append(life_event_el)
+        service_final['lifeEvents'][language] = le_elements          
+
+    return(service_final)
+
+
+def random_texts(rng, with_type=False):
+    texts = []
+    for _ in range(rng.randint(0, 4)):
+        text = {'language': rng.choice(['en', 'fi', 'sv', 'se', None]),
+                'value': rng.choice(['Arvo', 'Värde', 'Value', None, ''])}
+        if with_type:
+            text['type'] = rng.choice(['Description', 'Summary'])
+        texts.append(text)
+    return(texts)
+
+
+def random_area(rng):
+    area_type = rng.choice(['Municipality', 'Province', 'Region', 'BusinessRegions'])
+    area = {'type': area_type, 'code': str(rng.randint(1, 999)), 'name': random_texts(rng)}
+    if area_type == 'Municipality':
+        area['municipalities'] = [{'code': str(rng.randint(1, 999)), 'name': random_texts(rng)}]
+    return(area)
+
+
+def random_service(rng):
+    organizations = []
+    for _ in range(rng.randint(0, 3)):
+        if rng.random() < 0.5:
+            organizations.append({'roleType': 'Producer', 'organization': {'id': str(rng.randint(1, 9)), 'name': 'Org'}})
+        else:
+            organizations.append({'roleType': 'Responsible', 'additionalInformation': rng.choice([[], [{'value': 'Muu'}]])})
+    return({'id': str(rng.randint(1, 10**6)),
+            'type': 'Service',
+            'subType': rng.choice(['Normal', None]),
+            'serviceChannels': [{'serviceChannel': {'id': str(rng.randint(1, 99))}} for _ in range(rng.randint(0, 3))],
+            'organizations': organizations,
+            'serviceNames': random_texts(rng),
+            'serviceDescriptions': random_texts(rng, True),
+            'requirements': random_texts(rng),
+            'targetGroups': [{'code': rng.choice(['KR1', 'KR1.2', 'KR2']), 'name': random_texts(rng)} for _ in range(rng.randint(0, 3))],
+            'serviceClasses': [{'code': 'P' + str(rng.randint(1, 30)), 'name': random_texts(rng), 'description': random_texts(rng)} for _ in range(rng.randint(0, 3))],
+            'lifeEvents': [{'code': 'KE' + str(rng.randint(1, 14)), 'name': random_texts(rng)} for _ in range(rng.randint(0, 2))],
+            'areas': [random_area(rng) for _ in range(rng.randint(0, 3))]})
+
+
+class ServiceParserEquivalenceTest(unittest.TestCase):
+
+    def test_same_output_as_reference(self):
+        rng = random.Random(20210602)
+        for _ in range(2000):
+            service = random_service(rng)
+            expected = reference_parse_service_info(copy.deepcopy(service))
+            self.assertEqual(parse_service_info(copy.deepcopy(service)), expected)
+
+    def test_language_dicts_are_not_shared(self):
+        rng = random.Random(1)
+        parsed = parse_service_info(random_service(rng))
+        parsed['targetGroups']['fi'].append({'name': 'x', 'code': 'y'})
+        self.assertIsNot(parsed['targetGroups']['fi'], parsed['targetGroups']['sv'])
+
+
+if __name__ == '__main__':
+    unittest.main()
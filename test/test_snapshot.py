@@ -0,0 +1,132 @@
+import sys
+sys.path.append('ServiceDataImportFunctionApp/ServiceDataImportFunction')
+sys.path.append('benchmarks')
+sys.path.append('test')
+import os
+import tempfile
+import time
+import unittest
+import urllib
+from unittest.mock import patch
+from service_data_import import ptv_importer, snapshot
+from service_data_import.snapshot import RawSnapshot, SnapshotSession
+from service_data_import.ptv_importer import *
+from memory_mongo import MemoryClient
+from ptv_fixtures import FixedDatetime, UrlSession
+
+
+def ptv_responses(count):
+    responses = {API + "/CodeList/GetMunicipalityCodes": [{'code': '853', 'names': [{'value': 'Turku', 'language': 'fi'}]}],
+                 API + "/CodeList/GetAreaCodes/type/Province": [{'code': '02', 'names': [{'value': 'Varsinais-Suomi', 'language': 'fi'}]}]}
+    service_guids = [str(number) for number in range(count)]
+    responses[API + "/Service?page=1"] = {'pageCount': 1, 'itemList': [{'id': guid} for guid in service_guids]}
+    responses[API + "/ServiceChannel/area/Province/code/02?includeWholeCountry=true&page=1"] = {'pageCount': 1, 'itemList': []}
+    for guid in service_guids:
+        responses[guid] = {'id': guid, 'type': 'Service', 'subType': 'Normal', 'organizations': [],
+                           'serviceChannels': [{'serviceChannel': {'id': 'c' + guid}}],
+                           'serviceNames': [{'language': 'fi', 'value': 'Palvelu ' + guid}],
+                           'serviceDescriptions': [], 'requirements': [],
+                           'targetGroups': [{'code': 'KR1.1' if int(guid) % 3 == 0 else 'KR1', 'name': []}],
+                           'serviceClasses': [], 'lifeEvents': [], 'areas': []}
+        responses['c' + guid] = {'id': 'c' + guid, 'serviceChannelType': 'EChannel', 'areaType': 'Nationwide',
+                                 'organizationId': 'org1', 'services': [{'service': {'id': guid}}],
+                                 'serviceChannelNames': [{'language': 'fi', 'value': 'Kanava ' + guid}]}
+    return(responses)
+
+
+class RawSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_items_and_lookup(self):
+        raw_snapshot = RawSnapshot(self.directory.name, 'run1')
+        with patch.object(snapshot, 'member_size', 3):
+            raw_snapshot.write('services', [{'id': str(number), 'version': 1} for number in range(7)], datetime(2021, 6, 9))
+            raw_snapshot.write('services', [{'id': '5', 'version': 2}], datetime(2021, 6, 10))
+        self.assertEqual(len(list(raw_snapshot.items('services'))), 8)
+        self.assertEqual(raw_snapshot.lookup('services', '6'), {'id': '6', 'version': 1})
+        self.assertEqual(raw_snapshot.lookup('services', '5'), {'id': '5', 'version': 2})
+        self.assertEqual(raw_snapshot.lookup('services', '5', fetched_before=datetime(2021, 6, 9, 12)), {'id': '5', 'version': 1})
+        self.assertIsNone(raw_snapshot.lookup('services', 'x'))
+        self.assertEqual(list(raw_snapshot.items('channels')), [])
+
+    def test_latest_run(self):
+        RawSnapshot(self.directory.name, '20210609T000000_a')
+        RawSnapshot(self.directory.name, '20210610T000000_b')
+        self.assertEqual(RawSnapshot.latest(self.directory.name).run_id, '20210610T000000_b')
+        with self.assertRaises(Exception):
+            RawSnapshot.latest(os.path.join(self.directory.name, 'missing'))
+
+
+    def test_prune_keeps_last_runs_and_drops_old_ones(self):
+        for number, run_id in enumerate(['a', 'b', 'c', 'd']):
+            RawSnapshot(self.directory.name, run_id).write('services', [{'id': run_id}])
+            written = time.time() - (4 - number) * 24 * 60 * 60
+            os.utime(os.path.join(self.directory.name, run_id), (written, written))
+            os.utime(os.path.join(self.directory.name, run_id, 'services.jsonl.gz'), (written, written))
+            os.utime(os.path.join(self.directory.name, run_id, 'services.idx'), (written, written))
+        self.assertEqual(RawSnapshot.prune(self.directory.name, keep_runs=3), ['a'])
+        # The run being written is kept even when it is old
+        self.assertEqual(RawSnapshot.prune(self.directory.name, max_age_days=2.5, keep=['b']), [])
+        self.assertEqual(sorted(RawSnapshot.prune(self.directory.name, max_age_days=1.5)), ['b', 'c'])
+        self.assertEqual(RawSnapshot.runs(self.directory.name), ['d'])
+
+
+class SnapshotImportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_import_is_replayed_without_network(self):
+        client = MemoryClient()
+        importer = PTVImporter(client, UrlSession(ptv_responses(150)), write_mode='upsert', snapshot_dir=self.directory.name)
+        with patch.object(ptv_importer, 'datetime', FixedDatetime):
+            importer.import_services()
+        raw_snapshot = RawSnapshot.latest(self.directory.name)
+        self.assertEqual(len(list(raw_snapshot.items('services'))), 150)
+        self.assertEqual(raw_snapshot.lookup('channels', 'c1')['id'], 'c1')
+
+        replay_client = MemoryClient()
+        replayer = PTVImporter(replay_client, SnapshotSession(raw_snapshot), write_mode='upsert')
+        self.assertEqual(replayer.provinces, importer.provinces)
+        replayer.import_from_snapshot(raw_snapshot, chunk_size=40)
+        for collection in ['services', 'channels']:
+            stored_ids = sorted(document['id'] for document in client.service_db.get_collection(collection).find())
+            replayed_ids = sorted(document['id'] for document in replay_client.service_db.get_collection(collection).find())
+            self.assertEqual(len(stored_ids), 100)
+            self.assertEqual(replayed_ids, stored_ids)
+
+        # Replaying again writes nothing when the parsers have not changed
+        replayer.import_from_snapshot(raw_snapshot)
+        self.assertEqual(replayer.skipped['services']['write'], 100)
+
+    def test_batches_are_snapshotted_as_they_arrive(self):
+        session = UrlSession(ptv_responses(150))
+        get = session.get
+
+        def failing_get(url):
+            if 'guids=' in url and '149' in urllib.parse.unquote_plus(url):
+                raise Exception("PTV API failed")
+            return(get(url))
+        session.get = failing_get
+        importer = PTVImporter(MemoryClient(), session, write_mode='upsert', snapshot_dir=self.directory.name)
+        with patch.object(ptv_importer, 'datetime', FixedDatetime):
+            with self.assertRaises(Exception):
+                importer.import_services()
+        self.assertEqual(len(list(RawSnapshot.latest(self.directory.name).items('services'))), 100)
+
+    def test_snapshot_session_refuses_other_requests(self):
+        raw_snapshot = RawSnapshot(self.directory.name, 'run1')
+        with self.assertRaises(Exception):
+            SnapshotSession(raw_snapshot).get(API + "/Service?page=1")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import sys
+sys.path.append('ServiceDataImportFunctionApp/ServiceDataImportFunction')
+sys.path.append('test')
+import unittest
+from unittest.mock import MagicMock
+from service_data_import.ptv_importer import *
+from ptv_fixtures import code_list_session
+
+
+class StagingSwapTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mongo_client = MagicMock()
+        self.collections = {}
+        self.events = []
+
+        def get_collection(name):
+            if name not in self.collections:
+                collection = MagicMock(name=name)
+                collection.rename.side_effect = lambda new_name, **kwargs: self.events.append((name, new_name, kwargs))
+                collection.aggregate.side_effect = lambda pipeline: self.events.append((name, pipeline))
+                self.collections[name] = collection
+            return(self.collections[name])
+        self.mongo_client.service_db.get_collection.side_effect = get_collection
+        self.mongo_client.service_db.list_collection_names.return_value = ['services', 'channels']
+        self.importer = PTVImporter(self.mongo_client, code_list_session())
+
+    def test_stage_and_swap(self):
+        services = [{'id': '1'}, {'id': '2'}]
+        self.importer.store_to_staging('services', services)
+        staging = self.collections['services_staging']
+        staging.drop.assert_called_once()
+        staging.insert_many.assert_called_once_with(services)
+        staging.create_index.assert_any_call([('id', 1)], unique=True, name='id_1')
+
+        self.importer.swap_in_staging('services')
+        # Live services are renamed aside and staging renamed in their place, nothing is copied
+        self.assertEqual(self.events, [('services', 'services_previous', {'dropTarget': True}),
+                                       ('services_staging', 'services', {})])
+        self.collections['services'].aggregate.assert_not_called()
+        self.mongo_client.service_db.services.delete_many.assert_not_called()
+
+    def test_failed_rename_restores_live_collection(self):
+        self.collections['services_staging'] = MagicMock(name='services_staging')
+        self.collections['services_staging'].rename.side_effect = Exception("Mongo down")
+        with self.assertRaises(Exception):
+            self.importer.swap_in_staging('services')
+        self.assertEqual(self.events, [('services', 'services_previous', {'dropTarget': True}),
+                                       ('services_previous', 'services', {})])
+
+    def test_failed_swap_rolls_back_earlier_ones(self):
+        self.mongo_client.service_db.list_collection_names.return_value = ['services', 'services_previous', 'channels']
+        self.importer.swap_in_staging = MagicMock(side_effect=[None, Exception("Mongo down")])
+        with self.assertRaises(Exception):
+            self.importer.swap_in_staging_together(['services', 'channels'])
+        self.assertEqual(self.events, [('services_previous', 'services', {'dropTarget': True})])
+
+    def test_first_swap_without_live_collection(self):
+        self.mongo_client.service_db.list_collection_names.return_value = []
+        self.importer.swap_in_staging('channels')
+        self.assertEqual(self.events, [('channels_staging', 'channels', {})])
+        with self.assertRaises(Exception):
+            self.importer.rollback_collection('channels')
+
+    def test_rollback(self):
+        self.mongo_client.service_db.list_collection_names.return_value = ['services', 'services_previous']
+        self.importer.rollback_collection('services')
+        self.assertEqual(self.events, [('services_previous', 'services', {'dropTarget': True})])
+
+    def test_unknown_collection(self):
+        with self.assertRaises(Exception):
+            self.importer.store_to_staging('municipality', [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import sys
+sys.path.append('ServiceDataImportFunctionApp/ServiceDataImportFunction')
+sys.path.append('test')
+import unittest
+from unittest.mock import MagicMock, patch
+from service_data_import import ptv_importer
+from service_data_import.parallel_parse import ParallelParser
+from service_data_import.ptv_importer import *
+from ptv_fixtures import FixedDatetime, UrlSession
+
+
+class StreamingImportTest(unittest.TestCase):
+
+    def setUp(self):
+        responses = {API + "/CodeList/GetMunicipalityCodes": [{'code': '853', 'names': [{'value': 'Turku', 'language': 'fi'}]}],
+                     API + "/CodeList/GetAreaCodes/type/Province": [{'code': '02', 'names': [{'value': 'Varsinais-Suomi', 'language': 'fi'}]}]}
+        service_guids = [str(number) for number in range(230)]
+        responses[API + "/Service?page=1&date=2021-06-09T00%3A00%3A00"] = {'pageCount': 1, 'itemList': [{'id': guid} for guid in service_guids]}
+        responses[API + "/ServiceChannel/area/Province/code/02?includeWholeCountry=true&page=1&date=2021-06-09T00%3A00%3A00"] = {'pageCount': 1, 'itemList': [{'id': 'c0'}]}
+        responses[API + "/ServiceChannel?page=1&date=2021-06-09T00%3A00%3A00"] = {'pageCount': 1, 'itemList': []}
+        for guid in service_guids:
+            # Every third service is for elderly only and filtered out
+            target_group = 'KR1.1' if int(guid) % 3 == 0 else 'KR1'
+            responses[guid] = {'id': guid, 'type': 'Service', 'subType': 'Normal', 'organizations': [],
+                               'serviceChannels': [{'serviceChannel': {'id': 'c' + guid}}],
+                               'serviceNames': [{'language': 'fi', 'value': 'Palvelu ' + guid}],
+                               'serviceDescriptions': [], 'requirements': [],
+                               'targetGroups': [{'code': target_group, 'name': [{'language': 'fi', 'value': 'Ryhmä'}]}],
+                               'serviceClasses': [], 'lifeEvents': [], 'areas': []}
+            responses['c' + guid] = {'id': 'c' + guid, 'serviceChannelType': 'EChannel', 'areaType': 'Nationwide',
+                                     'organizationId': 'org1', 'services': [{'service': {'id': guid}}],
+                                     'serviceChannelNames': [{'language': 'fi', 'value': 'Kanava ' + guid}]}
+        self.responses = responses
+        self.service_guids = service_guids
+
+    def _run(self, streaming, parallel_parser=None):
+        mongo_client = MagicMock()
+        for collection in [mongo_client.service_db.services, mongo_client.service_db.channels]:
+            collection.find.return_value.sort.return_value.limit.return_value = [{'lastUpdated': datetime(2021, 6, 9)}]
+        mongo_client.service_db.sync_state.find_one.return_value = None
+        importer = PTVImporter(mongo_client, UrlSession(self.responses), streaming=streaming, batches_in_flight=2, parallel_parser=parallel_parser, write_mode='delete_insert')
+        with patch.object(ptv_importer, 'datetime', FixedDatetime):
+            importer.import_services()
+        return(mongo_client)
+
+    def _stored(self, collection):
+        return([document for call in collection.insert_many.call_args_list for document in call[0][0]])
+
+    def test_streaming_stores_same_documents(self):
+        batch_client = self._run(False)
+        stream_client = self._run(True)
+        for name in ['services', 'channels']:
+            batch_collection = getattr(batch_client.service_db, name)
+            stream_collection = getattr(stream_client.service_db, name)
+            self.assertEqual(sorted(self._stored(batch_collection), key=lambda d: d['id']),
+                             sorted(self._stored(stream_collection), key=lambda d: d['id']))
+        # One insert per fetched batch of 100 guids
+        self.assertEqual(stream_client.service_db.services.insert_many.call_count, 3)
+        stored_ids = [document['id'] for document in self._stored(stream_client.service_db.services)]
+        self.assertEqual(len(stored_ids), len([guid for guid in self.service_guids if int(guid) % 3 != 0]))
+        # Deletes only ever target the stored ids of a batch
+        for call in stream_client.service_db.services.delete_many.call_args_list:
+            self.assertIn('$in', call[0][0]['id'])
+
+    def test_streaming_batches_are_parsed_in_process_pool(self):
+        parser = ParallelParser(workers=2)
+        parser._get_executor = MagicMock(wraps=parser._get_executor)
+        batch_client = self._run(False)
+        stream_client = self._run(True, parser)
+        self.assertEqual(sorted(self._stored(batch_client.service_db.services), key=lambda d: d['id']),
+                         sorted(self._stored(stream_client.service_db.services), key=lambda d: d['id']))
+        # Every batch of services and channels went to the pool, not only the full ones
+        self.assertGreaterEqual(parser._get_executor.call_count, 4)
+        self.assertIsNone(parser._executor)
+
+    def test_async_engine_is_rejected(self):
+        mongo_client = MagicMock()
+        importer = PTVImporter(mongo_client, UrlSession(self.responses), streaming=True, write_mode='delete_insert')
+        with self.assertRaises(Exception):
+            importer.import_services(engine='async')
+        importer.engine = 'async'
+        with self.assertRaises(Exception):
+            importer.import_services()
+        mongo_client.service_db.services.insert_many.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
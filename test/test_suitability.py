@@ -0,0 +1,77 @@
+import sys
+sys.path.append('ServiceDataImportFunctionApp/ServiceDataImportFunction')
+sys.path.append('test')
+import random
+import unittest
+from service_data_import.suitability import SuitabilityFilter
+from service_data_import.service_parser import parse_service_info
+from service_data_import.channel_parser import parse_channel_info
+from test_service_parser import random_service
+from test_channel_parser import random_channel
+
+suitable_target_groups = ['KR1', 'KR1.2']
+
+
+def reference_is_suitable_service(service, municipalities, provinces):
+    service_tg_codes = [t_group.get('code') for t_group in service.get('targetGroups')['fi']]
+    contains_suitable = True
+    if len(service_tg_codes) > 0:
+        contains_suitable = any([True for tg_code in service_tg_codes if tg_code in suitable_target_groups])
+    tg_OK = contains_suitable
+
+    service_areas = service.get('areas')['fi']
+    province_match = True
+    municipality_match = True
+    if len(service_areas) > 0:
+        municipality_codes = [mun.get('id') for mun in municipalities]
+        province_codes = [pro.get('code') for pro in provinces]
+        address_municipality_codes = [area.get('code') for area in service_areas if area.get('type') == 'Municipality']
+        address_province_codes = [area.get('code') for area in service_areas if area.get('type') == 'Province' or area.get('type') == 'Region']
+        province_match = any([True for pro_code in address_province_codes if pro_code in province_codes])
+        municipality_match = any([True for mun_code in address_municipality_codes if mun_code in municipality_codes])
+    region_OK = province_match or municipality_match
+    return(tg_OK and region_OK)
+
+
+def reference_is_suitable_channel(channel, municipalities):
+    if channel.get('type') == 'ServiceLocation':
+        addresses = channel.get('addresses')['fi']
+        if len(addresses) > 0:
+            municipality_codes = [mun.get('id') for mun in municipalities]
+            address_municipality_codes = [add.get('municipalityCode') for add in addresses]
+            return(any([True for am_code in address_municipality_codes if am_code in municipality_codes]))
+        else:
+            return(True)
+    else:
+        return(True)
+
+
+class SuitabilityFilterTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(20210614)
+        self.municipalities = [{'id': str(code), 'name': {'fi': 'Kunta'}} for code in rng.sample(range(1, 1000), 300)]
+        self.provinces = [{'code': str(code)} for code in rng.sample(range(1, 1000), 300)]
+        self.suitability = SuitabilityFilter.from_regions(self.municipalities, self.provinces, suitable_target_groups)
+        self.rng = rng
+
+    def test_services_same_as_reference(self):
+        services = [parse_service_info(random_service(self.rng)) for _ in range(2000)]
+        expected = [service for service in services if reference_is_suitable_service(service, self.municipalities, self.provinces)]
+        self.assertEqual(self.suitability.filter('services', services), expected)
+        self.assertNotEqual(len(expected), 0)
+        self.assertNotEqual(len(expected), len(services))
+
+    def test_channels_same_as_reference(self):
+        channels = [parse_channel_info(random_channel(self.rng)) for _ in range(2000)]
+        expected = [channel for channel in channels if reference_is_suitable_channel(channel, self.municipalities)]
+        self.assertEqual(self.suitability.filter('channels', channels), expected)
+        self.assertNotEqual(len(expected), len(channels))
+
+    def test_unknown_collection(self):
+        with self.assertRaises(Exception):
+            self.suitability.filter('municipalities', [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import sys
+sys.path.append('ServiceDataImportFunctionApp/ServiceDataImportFunction')
+sys.path.append('benchmarks')
+import contextlib
+import io
+import unittest
+import urllib
+from unittest.mock import MagicMock
+from service_data_import.ptv_importer import *
+from memory_mongo import MemoryClient
+from ptv_standin import PTVData, StandinServer
+
+
+class ListingSession():
+
+    def __init__(self, listing, modified):
+        self.listing = listing
+        self.modified = modified
+        self.urls = []
+
+    def get(self, url):
+        self.urls.append(url)
+        response = MagicMock()
+        if url.endswith('GetMunicipalityCodes'):
+            response.json.return_value = [{'code': '853', 'names': [{'value': 'Turku', 'language': 'fi'}]}]
+        elif url.endswith('Province'):
+            response.json.return_value = [{'code': '02', 'names': [{'value': 'Varsinais-Suomi', 'language': 'fi'}]}]
+        elif 'guids=' in url:
+            guids = urllib.parse.unquote_plus(url.split('guids=')[1]).split(',')
+            response.json.return_value = [{'id': guid, 'modified': self.modified[guid]} for guid in guids if guid in self.modified]
+        else:
+            response.json.return_value = self.listing
+        return(response)
+
+
+class SyncWatermarkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mongo_client = MagicMock()
+        self.mongo_client.service_db.sync_state.find_one.return_value = {'source': 'ptv', 'entity': 'services', 'watermark': datetime(2021, 6, 8, 6, 30)}
+
+    def _importer(self, listing, modified=None):
+        self.session = ListingSession(listing, modified or {})
+        return(PTVImporter(self.mongo_client, self.session))
+
+    def test_incremental_window_starts_from_stored_watermark(self):
+        importer = self._importer({'pageCount': 1, 'itemList': []})
+        self.assertEqual(importer.get_sync_watermark('services'), datetime(2021, 6, 8, 6, 30))
+        importer._get_all_service_guids(importer.get_sync_watermark('services'))
+        self.assertTrue(self.session.urls[-1].endswith('&date=2021-06-08T06%3A30%3A00'))
+
+    def test_watermark_from_fetched_modification_times(self):
+        listing = {'pageCount': 1, 'itemList': [{'id': '1'}, {'id': '2'}]}
+        importer = self._importer(listing, {'1': '2021-06-09T10:00:00', '2': '2021-06-09T11:30:00'})
+        importer._fetch_services(importer._get_all_service_guids(None), 'sync')
+        self.assertEqual(importer._fetched_watermark('services', datetime(2021, 6, 10), None), datetime(2021, 6, 9, 11, 30))
+        # Items modified after the listing was requested may have been left out of it
+        self.assertEqual(importer._fetched_watermark('services', datetime(2021, 6, 9, 11), None), datetime(2021, 6, 9, 11))
+
+    def test_watermark_without_modification_times(self):
+        importer = self._importer({'pageCount': 1, 'itemList': [{'id': '1'}]})
+        importer._fetch_services(importer._get_all_service_guids(None), 'sync')
+        self.assertEqual(importer._fetched_watermark('services', datetime(2021, 6, 10), None), datetime(2021, 6, 10))
+        importer = self._importer({'pageCount': 1, 'itemList': []})
+        importer._get_all_service_guids(None)
+        self.assertEqual(importer._fetched_watermark('services', datetime(2021, 6, 10), datetime(2021, 6, 8)), datetime(2021, 6, 8))
+
+    def test_committed_only_after_store(self):
+        data = PTVData.generated(30)
+        server = StandinServer(data).start()
+        client = MemoryClient()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                PTVImporter(client, api_url=server.api_url, refetch_day='never').import_services()
+        finally:
+            server.stop()
+        watermarks = {entity: client.service_db.sync_state.find_one({'source': 'ptv', 'entity': entity})['watermark'] for entity in ['services', 'channels']}
+        self.assertEqual(watermarks['services'], max(data.modified[guid] for guid in data.services))
+        self.assertIn(watermarks['channels'], [data.modified[guid] for guid in data.channels])
+
+        listing = {'pageCount': 1, 'itemList': [{'id': '1'}]}
+        importer = self._importer(listing)
+        importer._write_changed = MagicMock(side_effect=Exception("Mongo down"))
+        importer.store_to_staging = MagicMock(side_effect=Exception("Mongo down"))
+        with self.assertRaises(Exception):
+            importer.import_services()
+        self.mongo_client.service_db.sync_state.update_one.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()